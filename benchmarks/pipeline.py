@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+End-to-end capture pipeline benchmark against real Xvfb displays
+
+Starts displays through DisplayManager, draws a synthetic workload on them and measures
+the capture, encode and total cost of every frame, plus the bytes per frame, for each
+resolution and image format/quality. Results are written as JSON to compare runs.
+
+    python -m benchmarks.pipeline --resolutions 1280x720,1920x1080 --formats JPEG:80,WEBP:80,PNG
+"""
+
+import sys
+import copy
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+import Xlib.display
+
+from webx11.display import DisplayManager
+from webx11.settings import get_settings
+from webx11.window import WindowScreenCapture
+
+LINE_HEIGHT = 16
+BANDS = 32
+
+
+class Workload:
+    """Something drawn on the root window of a display, one step per frame"""
+    def __init__(self, display_name, width, height):
+        self.display = Xlib.display.Display(display_name)
+        self.root = self.display.screen().root
+        self.width = width
+        self.height = height
+        self.frame = 0
+
+    def gc(self, color):
+        return self.root.create_gc(foreground=color, background=0xffffff)
+
+    def setup(self):
+        # Some text on a light background, like a terminal or a document
+        self.root.fill_rectangle(self.gc(0xf0f0f0), 0, 0, self.width, self.height)
+        gc = self.gc(0x202020)
+        for y in range(LINE_HEIGHT, self.height, LINE_HEIGHT):
+            self.root.draw_text(gc, 4, y, self.line(y // LINE_HEIGHT))
+        self.display.sync()
+
+    def line(self, number):
+        return ('%06d The quick brown fox jumps over the lazy dog. ' % number) * (self.width // 300 + 1)
+
+    def step(self):
+        self.frame += 1
+        self.draw()
+        self.display.sync()
+
+    def draw(self):
+        pass
+
+    def close(self):
+        self.display.close()
+
+
+class StaticWorkload(Workload):
+    """Nothing changes once drawn: what every idle display costs"""
+    name = 'static'
+
+
+class ScrollWorkload(Workload):
+    """A new line of text every frame, the rest scrolling up"""
+    name = 'scroll'
+
+    def draw(self):
+        gc = self.gc(0x202020)
+        self.root.copy_area(gc, self.root, 0, LINE_HEIGHT, self.width, self.height - LINE_HEIGHT, 0, 0)
+        self.root.fill_rectangle(self.gc(0xf0f0f0), 0, self.height - LINE_HEIGHT, self.width, LINE_HEIGHT)
+        self.root.draw_text(gc, 4, self.height - 4, self.line(self.frame))
+
+
+class AnimationWorkload(Workload):
+    """Every pixel changes every frame, like a video playing full screen"""
+    name = 'animation'
+
+    def draw(self):
+        band = self.width // BANDS + 1
+        for i in range(BANDS):
+            shade = (i * 8 + self.frame * 5) % 256
+            color = (shade << 16) | ((255 - shade) << 8) | ((shade * 3) % 256)
+            self.root.fill_rectangle(self.gc(color), i * band, 0, band, self.height)
+        # Moving shapes on top, so that the bands are not the only thing compressing well
+        gc = self.gc(0xffffff)
+        for i in range(8):
+            x = (self.frame * 13 + i * self.width // 8) % self.width
+            y = (self.frame * 7 + i * self.height // 8) % self.height
+            self.root.fill_arc(gc, x, y, 64, 64, 0, 360 * 64)
+
+
+WORKLOADS = {workload.name: workload for workload in (StaticWorkload, ScrollWorkload, AnimationWorkload)}
+
+
+def summarize(values):
+    """Milliseconds statistics of a list of seconds"""
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'mean': round(statistics.mean(values) * 1000, 3),
+        'p50': round(values[len(values) // 2] * 1000, 3),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+        'max': round(values[-1] * 1000, 3),
+    }
+
+
+def run_case(display, workload_class, image_format, quality, frames):
+    """Capture frames of a workload, returns the measurements of this case"""
+    settings = copy.copy(get_settings())
+    settings.image_format = image_format
+    settings.image_quality = quality
+    capture = WindowScreenCapture(display.display_name, display.fbdir)
+    capture.settings = settings
+    workload = workload_class(display.display_name, display.width, display.height)
+    try:
+        workload.setup()
+        # The first capture always is a full frame, then only the workload changes
+        capture.capture_window(0, 0, display.height, display.width, quality, force=True, profiles=((quality, 1.0),))
+        capture_times, encode_times, total_times, sizes = [], [], [], []
+        skipped = 0
+        for _ in range(frames):
+            workload.step()
+            # Make sure the DAMAGE events of the step reached the capture connection
+            capture.display.sync()
+            start = time.perf_counter()
+            frame = capture.capture_window(0, 0, display.height, display.width, quality, profiles=((quality, 1.0),))
+            total_times.append(time.perf_counter() - start)
+            if capture.last_stats is not None:
+                capture_times.append(capture.last_stats[0])
+                encode_times.append(capture.last_stats[1])
+            if frame:
+                sizes.append(sum(len(data) for data in frame.values()))
+            else:
+                skipped += 1
+    finally:
+        workload.close()
+        capture.close()
+
+    return {
+        'workload': workload_class.name,
+        'width': display.width,
+        'height': display.height,
+        'image_format': image_format,
+        'image_quality': quality,
+        'frames': frames,
+        'frames_skipped': skipped,
+        'capture_ms': summarize(capture_times),
+        'encode_ms': summarize(encode_times),
+        'total_ms': summarize(total_times),
+        'bytes_per_frame': round(statistics.mean(sizes)) if sizes else 0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def parse_format(value):
+    """JPEG:80 -> ('JPEG', 80), PNG -> ('PNG', default quality)"""
+    image_format, _, quality = value.partition(':')
+    return image_format.upper(), int(quality) if quality else get_settings().image_quality
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--resolutions', default='1280x720,1920x1080',
+                        help='Comma separated WIDTHxHEIGHT list (default: %(default)s)')
+    parser.add_argument('--formats', default='JPEG:80,WEBP:80,PNG',
+                        help='Comma separated FORMAT[:QUALITY] list (default: %(default)s)')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help='Comma separated workloads among %s (default: all)' % ', '.join(WORKLOADS))
+    parser.add_argument('--frames', type=int, default=60, help='Frames per case (default: %(default)s)')
+    parser.add_argument('--output', default='-', help='JSON results file, - for stdout (default: %(default)s)')
+    args = parser.parse_args()
+
+    settings = get_settings()
+    resolutions = [parse_resolution(value) for value in args.resolutions.split(',')]
+    formats = [parse_format(value) for value in args.formats.split(',')]
+    workloads = [WORKLOADS[name] for name in args.workloads.split(',')]
+
+    results = []
+    display_manager = DisplayManager()
+    try:
+        for width, height in resolutions:
+            display = display_manager.create_display(width, height)
+            if display is None:
+                print(f"Could not start a {width}x{height} display, is Xvfb installed?", file=sys.stderr)
+                sys.exit(1)
+            try:
+                for workload_class in workloads:
+                    for image_format, quality in formats:
+                        result = run_case(display, workload_class, image_format, quality, args.frames)
+                        print(f"{workload_class.name:>9} {width}x{height} {image_format}:{quality} "
+                              f"total {result['total_ms']['mean']:.2f} ms, {result['bytes_per_frame']} bytes/frame",
+                              file=sys.stderr)
+                        results.append(result)
+            finally:
+                display_manager.remove_display(display.display_id)
+    finally:
+        display_manager.stop_all()
+
+    report = {
+        'date': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'settings': {
+            'capture_mode': settings.capture_mode,
+            'capture_backend': settings.capture_backend,
+            'tile_size': settings.tile_size,
+            'video_codec': settings.video_codec,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -33,7 +33,7 @@ setup(
         "Pillow>=9.0.0",
         "python-xlib>=0.31",
         "websockets>=10.0",
-        "aioquic>=0.9.0"
+        "aioquic>=1.2.0"
     ],
     extras_require={
         "dev": [
@@ -51,6 +51,7 @@ setup(
     package_data={
         "webx11": [
             "partials/*.html",
+            "static/*",
             "settings.json",
         ],
     },
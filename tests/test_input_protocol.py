@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from webx11.input_protocol import (INPUT_HEADER, INPUT_RECORD_SIZE, INPUT_RECORDS, INPUT_VERSION,
+                                   decode_input, encode_input, is_binary_input)
+
+EVENTS = [
+    {'type': 'mousedown', 'button': 1, 'x': 10, 'y': 20},
+    {'type': 'mouseup', 'button': 3, 'x': 65535, 'y': 0},
+    {'type': 'mousemove', 'x': 1920, 'y': 1080},
+    {'type': 'scroll', 'x': 5, 'y': 6, 'deltaY': -120},
+    {'type': 'scroll', 'x': 5, 'y': 6, 'deltaY': 32767},
+    {'type': 'keydown', 'keysym': 0xff0d},
+    {'type': 'keyup', 'keysym': 0x010020ac},  # Unicode keysym of the euro sign
+]
+
+
+def test_every_record_type_is_covered():
+    assert {event['type'] for event in EVENTS} == {name for name, _, _ in INPUT_RECORDS.values()}
+
+
+@pytest.mark.parametrize('event', EVENTS, ids=lambda event: event['type'])
+def test_roundtrip(event):
+    message = encode_input([event])
+    assert len(message) == INPUT_HEADER.size + INPUT_RECORD_SIZE
+    assert decode_input(message) == [event]
+
+
+def test_batch_roundtrip():
+    message = encode_input(EVENTS)
+    assert message[:2] == bytes([INPUT_VERSION, len(EVENTS)])
+    assert decode_input(message) == EVENTS
+
+
+def test_unknown_records_are_skipped():
+    message = bytearray(encode_input(EVENTS[:2]))
+    message[INPUT_HEADER.size] = 0xff  # A record type from a newer client
+    assert decode_input(bytes(message)) == EVENTS[1:2]
+
+
+def test_truncated_message():
+    with pytest.raises(ValueError):
+        decode_input(encode_input(EVENTS)[:-1])
+
+
+def test_is_binary_input():
+    assert is_binary_input(encode_input(EVENTS))
+    assert is_binary_input(bytearray(encode_input([])))
+
+
+@pytest.mark.parametrize('message', [
+    json.dumps({'type': 'refresh'}),
+    json.dumps({'type': 'text_input', 'text': 'x'}).encode('utf-8'),
+    '\x01\x01',
+    b'\x01',
+    b'',
+])
+def test_json_and_text_are_not_binary_input(message):
+    assert not is_binary_input(message)
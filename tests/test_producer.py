@@ -0,0 +1,150 @@
+import asyncio
+
+from webx11.producer import FrameOutbox
+from webx11.tiles import TILE_KEYFRAME, pack_tiles, unpack_tiles
+from webx11.video import VIDEO_HEADER, VIDEO_KEYFRAME, VIDEO_MAGIC
+
+KEYFRAME = b'\xff\xd8 a full frame'
+
+
+def tiles(*rects, width=128, height=128):
+    return pack_tiles(width, height, [(x, y, w, h, b'%d,%d' % (x, y)) for x, y, w, h in rects])
+
+
+def chunk(number, keyframe=False):
+    return VIDEO_HEADER.pack(VIDEO_MAGIC, VIDEO_KEYFRAME if keyframe else 0, 64, 64, number) + b'data'
+
+
+def run_outbox(test):
+    """Run test(outbox, sent, keyframe_requests) on the event loop, the outbox only sends while it awaits"""
+    async def main():
+        sent = []
+        keyframe_requests = []
+
+        async def send(frame):
+            sent.append(frame)
+
+        outbox = FrameOutbox(send, lambda: keyframe_requests.append(True))
+        try:
+            await test(outbox, sent, keyframe_requests)
+        finally:
+            outbox.close()
+    asyncio.run(main())
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_tiles_are_dropped_until_a_keyframe():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.put(tiles((0, 0, 64, 64)))
+        assert outbox.pending() == 0
+        outbox.put(KEYFRAME)
+        outbox.put(tiles((0, 0, 64, 64)))
+        assert outbox.pending() == 2
+        await drain()
+        assert sent == [KEYFRAME, tiles((0, 0, 64, 64))]
+        assert outbox.pending() == 0
+    run_outbox(test)
+
+
+def test_keyframe_supersedes_waiting_updates():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.put(KEYFRAME)
+        outbox.put(tiles((0, 0, 64, 64)))
+        newer = pack_tiles(128, 128, [(0, 0, 128, 128, b'all')], flags=TILE_KEYFRAME)
+        outbox.put(newer)
+        assert outbox.pending() == 1
+        await drain()
+        assert sent == [newer]
+    run_outbox(test)
+
+
+def test_tile_updates_are_merged():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.put(KEYFRAME)
+        await drain()
+        outbox.put(tiles((0, 0, 64, 64), (64, 0, 64, 64)))
+        outbox.put(tiles((0, 0, 64, 64), (0, 64, 64, 64)))
+        assert outbox.pending() == 1
+        await drain()
+        assert len(sent) == 2
+        width, height, merged = unpack_tiles(sent[1])
+        assert (width, height) == (128, 128)
+        # The older (0, 0) tile is covered by the newer one
+        assert [(x, y) for x, y, _, _, _ in merged] == [(64, 0), (0, 0), (0, 64)]
+        assert merged[1][4] == b'0,0'
+        assert not keyframe_requests
+    run_outbox(test)
+
+
+def test_resized_tile_update_waits_for_a_keyframe():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.put(KEYFRAME)
+        await drain()
+        outbox.put(tiles((0, 0, 64, 64)))
+        outbox.put(tiles((0, 0, 64, 64), width=256))
+        assert keyframe_requests == [True]
+        assert outbox.pending() == 0
+        # Updates are meaningless until the requested keyframe arrives
+        outbox.put(tiles((0, 0, 64, 64)))
+        assert outbox.pending() == 0
+        outbox.put(KEYFRAME)
+        await drain()
+        assert sent == [KEYFRAME, KEYFRAME]
+    run_outbox(test)
+
+
+def test_too_many_merged_tiles_wait_for_a_keyframe():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.max_pending_tiles = 2
+        outbox.put(KEYFRAME)
+        await drain()
+        outbox.put(tiles((0, 0, 64, 64)))
+        outbox.put(tiles((64, 0, 64, 64), (0, 64, 64, 64)))
+        assert keyframe_requests == [True]
+        assert outbox.pending() == 0
+    run_outbox(test)
+
+
+def test_video_chunks_are_queued_in_order():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.put(chunk(1))
+        assert outbox.pending() == 0
+        outbox.put(chunk(2, keyframe=True))
+        outbox.put(chunk(3))
+        outbox.put(chunk(4))
+        assert outbox.pending() == 3
+        await drain()
+        assert sent == [chunk(2, keyframe=True), chunk(3), chunk(4)]
+    run_outbox(test)
+
+
+def test_video_keyframe_drops_waiting_chunks():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.put(chunk(1, keyframe=True))
+        outbox.put(chunk(2))
+        outbox.put(chunk(3, keyframe=True))
+        assert outbox.pending() == 1
+        await drain()
+        assert sent == [chunk(3, keyframe=True)]
+    run_outbox(test)
+
+
+def test_video_overflow_waits_for_a_keyframe():
+    async def test(outbox, sent, keyframe_requests):
+        outbox.max_pending_chunks = 3
+        outbox.put(chunk(1, keyframe=True))
+        outbox.put(chunk(2))
+        outbox.put(chunk(3))
+        outbox.put(chunk(4))
+        assert keyframe_requests == [True]
+        assert outbox.pending() == 0
+        outbox.put(chunk(5))
+        assert outbox.pending() == 0
+        outbox.put(chunk(6, keyframe=True))
+        await drain()
+        assert sent == [chunk(6, keyframe=True)]
+    run_outbox(test)
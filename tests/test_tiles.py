@@ -0,0 +1,126 @@
+import pytest
+
+from webx11.tiles import TILE_KEYFRAME, pack_tiles, unpack_tiles, merge_tiles, is_tile_update, is_keyframe
+
+np = pytest.importorskip("numpy")
+from webx11.tiles import TileTracker  # noqa: E402
+
+
+def frame(width, height, stride=None, fill=0):
+    """A BGRX buffer, with padding at the end of every row when stride is given"""
+    stride = stride or width * 4
+    return bytearray([fill]) * (stride * height)
+
+
+def set_pixel(buffer, x, y, stride, value=0xff):
+    buffer[y * stride + x * 4] = value
+
+
+def test_pack_unpack_roundtrip():
+    tiles = [(0, 0, 64, 64, b'first'), (64, 0, 32, 64, b''), (0, 64, 96, 16, b'third tile')]
+    message = pack_tiles(96, 80, tiles)
+    assert unpack_tiles(message) == (96, 80, tiles)
+
+
+def test_unpack_empty_update():
+    assert unpack_tiles(pack_tiles(10, 20, [])) == (10, 20, [])
+
+
+def test_is_keyframe():
+    full_frame = b'\xff\xd8 a JPEG image'
+    assert not is_tile_update(full_frame)
+    assert is_keyframe(full_frame)
+    update = pack_tiles(64, 64, [(0, 0, 64, 64, b'tile')])
+    assert is_tile_update(update)
+    assert not is_keyframe(update)
+    assert is_keyframe(pack_tiles(64, 64, [(0, 0, 64, 64, b'tile')], flags=TILE_KEYFRAME))
+
+
+def test_merge_drops_covered_tiles():
+    older = [(0, 0, 64, 64, b'a'), (64, 0, 64, 64, b'b'), (0, 64, 64, 64, b'c')]
+    newer = [(0, 0, 128, 64, b'd')]
+    assert merge_tiles(older, newer) == [(0, 64, 64, 64, b'c'), (0, 0, 128, 64, b'd')]
+
+
+def test_merge_keeps_partially_covered_tiles():
+    older = [(0, 0, 64, 64, b'a')]
+    newer = [(32, 32, 64, 64, b'b')]
+    assert merge_tiles(older, newer) == older + newer
+
+
+def test_first_frame_is_full():
+    tracker = TileTracker(tile_size=16)
+    assert tracker.update(frame(64, 64), 64, 64) is None
+
+
+def test_unchanged_frame_has_no_dirty_tile():
+    tracker = TileTracker(tile_size=16)
+    tracker.update(frame(64, 64), 64, 64)
+    assert tracker.update(frame(64, 64), 64, 64) == []
+
+
+def test_dirty_tiles():
+    tracker = TileTracker(tile_size=16)
+    tracker.update(frame(64, 64), 64, 64)
+    buffer = frame(64, 64)
+    set_pixel(buffer, 20, 5, 64 * 4)
+    set_pixel(buffer, 63, 63, 64 * 4)
+    assert tracker.update(buffer, 64, 64) == [(16, 0, 16, 16), (48, 48, 16, 16)]
+    # The previous frame now holds the dirty tiles, the same buffer is unchanged
+    assert tracker.update(buffer, 64, 64) == []
+
+
+def test_adjacent_dirty_tiles_are_merged():
+    tracker = TileTracker(tile_size=16)
+    tracker.update(frame(64, 64), 64, 64)
+    buffer = frame(64, 64)
+    for x in (0, 16, 32):
+        set_pixel(buffer, x, 0, 64 * 4)
+    assert tracker.update(buffer, 64, 64) == [(0, 0, 48, 16)]
+
+
+def test_edge_tiles_are_clipped():
+    tracker = TileTracker(tile_size=16)
+    tracker.update(frame(40, 20), 40, 20)
+    buffer = frame(40, 20)
+    set_pixel(buffer, 39, 19, 40 * 4)
+    assert tracker.update(buffer, 40, 20) == [(32, 16, 8, 4)]
+
+
+def test_stride_padding_is_ignored():
+    tracker = TileTracker(tile_size=16)
+    stride = 64 * 4 + 32
+    tracker.update(frame(64, 32, stride), 64, 32, stride)
+    # Only the padding after every row changed
+    buffer = frame(64, 32, stride)
+    for y in range(32):
+        buffer[y * stride + 64 * 4:(y + 1) * stride] = b'\xff' * 32
+    assert tracker.update(buffer, 64, 32, stride) == []
+    set_pixel(buffer, 17, 17, stride)
+    assert tracker.update(buffer, 64, 32, stride) == [(16, 16, 16, 16)]
+
+
+def test_too_many_dirty_tiles_sends_a_full_frame():
+    tracker = TileTracker(tile_size=16, max_dirty_ratio=0.5)
+    tracker.update(frame(64, 64), 64, 64)
+    assert tracker.update(frame(64, 64, fill=1), 64, 64) is None
+    # The full frame became the reference
+    assert tracker.update(frame(64, 64, fill=1), 64, 64) == []
+
+
+def test_force_and_resize_send_a_full_frame():
+    tracker = TileTracker(tile_size=16)
+    tracker.update(frame(64, 64), 64, 64)
+    assert tracker.update(frame(64, 64), 64, 64, force=True) is None
+    assert tracker.update(frame(32, 64), 32, 64) is None
+
+
+def test_tile_image():
+    tracker = TileTracker(tile_size=16)
+    buffer = frame(32, 32)
+    # BGRX: blue, green, red
+    buffer[(17 * 32 + 18) * 4:(17 * 32 + 18) * 4 + 3] = bytes([1, 2, 3])
+    tracker.update(buffer, 32, 32)
+    image = tracker.tile_image((16, 16, 16, 16))
+    assert image.size == (16, 16)
+    assert image.getpixel((2, 1)) == (3, 2, 1)
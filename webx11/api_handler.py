@@ -1,16 +1,24 @@
 import json
-from http.server import BaseHTTPRequestHandler
-from webx11.settings import SettingsManager
-from urllib.parse import urlparse
+import asyncio
+from webx11.http_server import AsyncRequestHandler
+from webx11.settings import get_settings
+from webx11.assets import StaticAssets
+from webx11 import metrics
+from urllib.parse import urlparse, parse_qs
 import os
 
 module_dir = os.path.dirname(os.path.abspath(__file__))
 html_path = os.path.join(module_dir, "partials", "display.html")
 
-class APIHandler(BaseHTTPRequestHandler):
+# Read once: the viewer page is a small shell loading the cacheable static assets
+with open(html_path, "r") as f:
+    display_shell = f.read()
+static_assets = StaticAssets()
+
+class APIHandler(AsyncRequestHandler):
     def __init__(self, display_manager, *args, **kwargs):
         self.display_manager = display_manager
-        self.settings = SettingsManager()
+        self.settings = get_settings()
         super().__init__(*args, **kwargs)
     
     def log_message(self, format, *args):
@@ -27,7 +35,7 @@ class APIHandler(BaseHTTPRequestHandler):
             self.send_cors_headers()
         self.end_headers()
     
-    def do_GET(self):
+    async def do_GET(self):
         parsed_path = urlparse(self.path)
         path = parsed_path.path
 
@@ -39,6 +47,12 @@ class APIHandler(BaseHTTPRequestHandler):
             self.serve_display(parsed_path)
         elif path == '/settings.json':
             self.serve_settings()
+        elif path.startswith('/job/'):
+            await self.serve_job(parsed_path)
+        elif path.startswith('/static/'):
+            self.serve_static(parsed_path)
+        elif path == '/metrics':
+            self.serve_metrics()
         else:
             self.send_error(404, "Not Found")
     
@@ -82,14 +96,18 @@ class APIHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(self.settings.dump_json().encode('utf-8'))
 
+    def serve_metrics(self):
+        self.send_response(200)
+        self.send_header('Content-type', metrics.CONTENT_TYPE)
+        self.end_headers()
+        self.wfile.write(metrics.render().encode('utf-8'))
+
     def handle_start_executable_display(self, parsed_path):
         display_id = None
         try:
             sections = parsed_path.path.split('/')
-            print(sections)
             display_id = int(sections[2])
-        except (ValueError, IndexError) as e:
-            print(e)
+        except (ValueError, IndexError):
             self.send_error(404, "Invalid display ID. Must be an int.")
             return
         content_length = int(self.headers.get('Content-Length', 0))
@@ -107,14 +125,9 @@ class APIHandler(BaseHTTPRequestHandler):
                 self.send_error(400, "Missing parameter: executable.")
                 return
             
-            process = self.display_manager.start_executable(display_id, data.get('executable'))
-            display.executable = data.get('executable')
-            self.send_response(200)
-            if self.settings.cors_unsafe_allow_all:
-                self.send_cors_headers()
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"message": "OK", "display": display.display_id, "process": process.pid}).encode('utf-8'))
+            # The application is started in the background, its PID is in the job result
+            job = self.display_manager.start_executable_job(display_id, data.get('executable'))
+            self.send_job_accepted(job)
             
         except json.JSONDecodeError:
             self.send_error(400, "Invalid JSON")
@@ -152,14 +165,41 @@ class APIHandler(BaseHTTPRequestHandler):
         if self.settings.cors_unsafe_allow_all:
             self.send_cors_headers()
         self.send_header('Content-type', 'text/html')
+        self.send_header('Cache-Control', 'no-cache')
         self.end_headers()
         
-        app_name = f"Display {display_id}"
-    
-        with open(html_path, "r") as f:
-            html_content = f.read()
-            html_content = html_content.format(top=0, left=0, app_name=app_name, display_id=display_id)
+        html_content = display_shell.format(display_id=display_id,
+                                            js_version=static_assets.version('viewer.js'),
+                                            css_version=static_assets.version('viewer.css'))
         self.wfile.write(html_content.encode('utf-8'))
+
+    def serve_static(self, parsed_path):
+        """Pre-compressed viewer assets, cached forever when requested with their version"""
+        asset = static_assets.get(parsed_path.path.split('/')[-1])
+        if not asset:
+            self.send_error(404, "Not Found")
+            return
+        if self.headers.get('If-None-Match') == asset.etag:
+            self.send_response(304)
+            self.send_header('ETag', asset.etag)
+            self.end_headers()
+            return
+
+        encoding, body = asset.encode(self.headers.get('Accept-Encoding'))
+        self.send_response(200)
+        if self.settings.cors_unsafe_allow_all:
+            self.send_cors_headers()
+        self.send_header('Content-type', asset.content_type)
+        self.send_header('ETag', asset.etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if parse_qs(parsed_path.query).get('v') == [asset.version]:
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        else:
+            self.send_header('Cache-Control', 'no-cache')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
     
     def handle_close_display(self, parsed_path):
         try:
@@ -167,15 +207,48 @@ class APIHandler(BaseHTTPRequestHandler):
         except (ValueError, IndexError):
             self.send_error(404, "Invalid display ID")
             return
-        self.display_manager.remove_display(display_id)
-        self.send_response(200)
+        job = self.display_manager.remove_display_job(display_id)
+        self.send_response(202)
         if self.settings.cors_unsafe_allow_all:
             self.send_cors_headers()
         self.send_header('Content-type', 'application/json')
         self.end_headers()
-        self.wfile.write(json.dumps({"success": True}).encode('utf-8'))
+        self.wfile.write(json.dumps({"success": True, "job": job.id}).encode('utf-8'))
         return
 
+    def send_job_accepted(self, job):
+        self.send_response(202)
+        if self.settings.cors_unsafe_allow_all:
+            self.send_cors_headers()
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({"message": "Accepted", "display": job.display_id, "job": job.id}).encode('utf-8'))
+
+    async def serve_job(self, parsed_path):
+        """Status of a background job, ?wait=<seconds> waits for it to finish"""
+        try:
+            job_id = int(parsed_path.path.split('/')[-1])
+            wait = float(parse_qs(parsed_path.query).get('wait', [0])[0])
+        except (ValueError, IndexError):
+            self.send_error(404, "Invalid job ID")
+            return
+        job = self.display_manager.jobs.get(job_id)
+        if not job:
+            self.send_error(404, "Job not found")
+            return
+        if wait > 0:
+            # Waiting on the event loop, the other connections are still served meanwhile
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), min(wait, 60))
+            except asyncio.TimeoutError:
+                pass
+        self.send_response(200)
+        if self.settings.cors_unsafe_allow_all:
+            self.send_cors_headers()
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(job.to_dict()).encode('utf-8'))
+
     def handle_create_display(self):
         """ Start a new X11 display"""
         content_length = int(self.headers.get('Content-Length', 0))
@@ -191,15 +264,9 @@ class APIHandler(BaseHTTPRequestHandler):
                 self.send_error(400, "Missing parameters width and height")
                 return
             
-            # Creating a new display
-            display = self.display_manager.create_display(data.get('width'), data.get('height'))
-            
-            self.send_response(200)
-            if self.settings.cors_unsafe_allow_all:
-                self.send_cors_headers()
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"message": "OK", "display": display.display_id}).encode('utf-8'))
+            # Creating a new display in the background, the client polls or waits for the job
+            job = self.display_manager.create_display_job(data.get('width'), data.get('height'))
+            self.send_job_accepted(job)
             
         except json.JSONDecodeError:
             self.send_error(400, "Invalid JSON")
@@ -208,15 +275,16 @@ class APIHandler(BaseHTTPRequestHandler):
 
     def handle_resize(self, parsed_path):
         try:
-            display_id, width, height = parsed_path.path.split('/')[2:]
+            display_id, width, height = (int(value) for value in parsed_path.path.split('/')[2:])
         except (ValueError, IndexError):
             self.send_error(404, "Invalid display ID")
             return
-        self.display_manager.resize_display(int(display_id), int(width), int(height))
-        self.send_response(200)
+        # Waits for the display lock, which a start or stop job may hold for seconds
+        job = self.display_manager.resize_display_job(display_id, width, height)
+        self.send_response(202)
         if self.settings.cors_unsafe_allow_all:
             self.send_cors_headers()
         self.send_header('Content-type', 'application/json')
         self.end_headers()
-        self.wfile.write(json.dumps({"success": True}).encode('utf-8'))
+        self.wfile.write(json.dumps({"success": True, "job": job.id}).encode('utf-8'))
         return
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import gzip
+import hashlib
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+module_dir = os.path.dirname(os.path.abspath(__file__))
+static_dir = os.path.join(module_dir, "static")
+
+CONTENT_TYPES = {
+    '.js': 'application/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+}
+
+
+class StaticAsset:
+    """A static file, read and compressed once when the server starts"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.content = f.read()
+        self.content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream')
+        # The version is part of the asset URL, so that the browser can cache it forever
+        self.version = hashlib.sha256(self.content).hexdigest()[:16]
+        self.etag = '"%s"' % self.version
+        self.encodings = {'gzip': gzip.compress(self.content, compresslevel=9)}
+        if BROTLI_AVAILABLE:
+            self.encodings['br'] = brotli.compress(self.content)
+
+    def encode(self, accept_encoding):
+        """Returns the (content encoding, body) pair to send for an Accept-Encoding header"""
+        accepted = [encoding.split(';')[0].strip() for encoding in (accept_encoding or '').split(',')]
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.encodings:
+                return encoding, self.encodings[encoding]
+        return None, self.content
+
+
+class StaticAssets:
+    """The viewer's static files (JavaScript, CSS), served from memory"""
+    def __init__(self, directory=static_dir):
+        self.assets = {}
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                self.assets[name] = StaticAsset(path)
+
+    def get(self, name):
+        return self.assets.get(name)
+
+    def version(self, name):
+        return self.assets[name].version
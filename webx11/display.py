@@ -1,19 +1,36 @@
 import subprocess
 import threading
+import select
 import Xlib
 import time
 import os
+import shutil
+import tempfile
+import logging
 
 from Xlib import X
-from webx11.window import WindowScreenCapture, WindowInputHandler
-from webx11.settings import SettingsManager
+from webx11.window import WindowScreenCapture, WindowInputHandler, WindowWatcher
+from webx11.settings import get_settings, add_settings_listener
+from webx11.producer import FrameProducer
+from webx11.workers import capture_pool
+from webx11.jobs import JobRunner
+from webx11 import metrics
+from webx11.log import get_logger, fields
 from io import BytesIO
 import gzip
 
+logger = get_logger('display')
+resize_log = get_logger('resize')
+
+# Seconds Xvfb gets to report that it is ready
+XVFB_START_TIMEOUT = 5
+
+
 class SingleWindowDisplay:
-    def __init__(self, display_num, display_id, width=1920, height=1080, depth=24):
-        self.display_num = display_num
-        self.display_name = f":{display_num}"
+    def __init__(self, display_id, width=1920, height=1080, depth=24):
+        # Picked by Xvfb itself when it starts
+        self.display_num = None
+        self.display_name = None
         self.display_id = display_id
         self.width = width
         self.height = height
@@ -25,64 +42,101 @@ class SingleWindowDisplay:
         self.screen_capture = None
         self.input_handler = None
         self.is_running = False
-        self.has_updated = False
-        self.last_frame = None
-        self.settings = SettingsManager()
+        self.settings = get_settings()
         self.maxwidth = width
         self.maxheight = height
-        self.still_frames = 0
         self.executable = None
+        self.fbdir = None
+        self.watcher = None
+        self.frame_producer = FrameProducer(self, self.settings.fps)
+        # Serializes the slow operations on this display: start, resize, application launch, stop
+        self.lock = threading.RLock()
         
     def start(self):
         """Start the virtual display for this window"""
         try:
-            # Start Xvfb
-            print('DISPLAY NAME', self.display_name)
+            # Start Xvfb, it picks a free display number and writes it to displayfd once it accepts connections
+            read_fd, write_fd = os.pipe()
             cmd = [
-                'Xvfb', self.display_name, 
+                'Xvfb', '-displayfd', str(write_fd),
                 '-screen', '0', f'{self.width}x{self.height}x{self.depth}',
                 '-ac',
                 '-nolisten', 'tcp'
             ]
-            print('cmd is', " ".join(cmd))
-            self.xvfb_process = subprocess.Popen([
-                'Xvfb', self.display_name, 
-                '-screen', '0', f'{self.width}x{self.height}x{self.depth}',
-                '-ac',
-                '-nolisten', 'tcp'
-            ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            
-            # Wait for Xvfb to start
-            for i in range(10):
-                time.sleep(1)
-                try:
-                    test_display = Xlib.display.Display(self.display_name)
-                    test_display.close()
-                    break
-                except Exception as e:
-                    print(e)
-                    if i == 9:
-                        raise Exception("Xvfb failed to start")
-                    continue
+            if self.settings.capture_backend == 'fbdir':
+                # Xvfb maps its screen to an XWD file in this directory, we read the pixels from there
+                self.fbdir = tempfile.mkdtemp(prefix='webx11-')
+                cmd += ['-fbdir', self.fbdir]
+            logger.debug("Starting Xvfb", extra=fields(cmd=" ".join(cmd)))
+            try:
+                self.xvfb_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                     pass_fds=(write_fd,))
+            finally:
+                os.close(write_fd)
+            try:
+                self.display_num = self.wait_display_fd(read_fd)
+            finally:
+                os.close(read_fd)
+            self.display_name = f":{self.display_num}"
             
             # Connect to the display
             self.x11_display = Xlib.display.Display(self.display_name)
-            self.screen_capture = WindowScreenCapture(self)
+            if self.settings.capture_executor != 'process':
+                # With the process executor, the capture lives in a worker process
+                self.screen_capture = WindowScreenCapture(self.display_name, self.fbdir)
             self.input_handler = WindowInputHandler(self)
+            # Resizes to the application windows as soon as they are mapped or resized
+            self.watcher = WindowWatcher(self.display_name, self.on_windows_changed)
             
             self.is_running = True
-            print(f"Window display started on {self.display_name} (ID: {self.display_id})")
+            logger.info("Window display started", extra=fields(display=self.display_id, x11_display=self.display_name))
             return True
             
         except Exception as e:
-            print(f"Failed to start window display: {e}")
+            logger.error("Failed to start window display: %s", e)
             if self.xvfb_process:
                 self.xvfb_process.terminate()
+                if self.display_num is None:
+                    # Whatever Xvfb complained about
+                    logger.error("Xvfb output:\n%s", self.xvfb_process.communicate()[0].decode('utf-8', 'replace'))
+            self.remove_fbdir()
             return False
+
+    def apply_settings(self, settings):
+        """Use a reloaded settings snapshot. The quality and fps apply to the next frames, the
+        capture backend, tiles and video codec only to the displays started afterwards"""
+        self.settings = settings
+        if self.screen_capture:
+            self.screen_capture.settings = settings
+        self.frame_producer.apply_settings(settings)
+
+    def wait_display_fd(self, read_fd):
+        """Wait for the display number Xvfb writes once ready, instead of polling for its socket"""
+        data = b''
+        deadline = time.monotonic() + XVFB_START_TIMEOUT
+        while not data.endswith(b'\n'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([read_fd], [], [], remaining)[0]:
+                raise Exception("Xvfb did not start within %s seconds" % XVFB_START_TIMEOUT)
+            chunk = os.read(read_fd, 16)
+            if not chunk:
+                raise Exception("Xvfb exited with code %s" % self.xvfb_process.wait())
+            data += chunk
+        return int(data)
     
     def stop(self):
         """Stop the virtual display"""
         self.is_running = False
+        self.frame_producer.stop()
+        if self.input_handler:
+            self.input_handler.stop()
+        if self.watcher:
+            self.watcher.stop()
+        # Before Xvfb goes away, libX11 exits the process on connection errors
+        if self.screen_capture:
+            self.screen_capture.close()
+        else:
+            capture_pool().release(self)
         if self.xvfb_process:
             self.xvfb_process.terminate()
             self.xvfb_process.wait()
@@ -90,36 +144,58 @@ class SingleWindowDisplay:
             try:
                 self.x11_display.close()
             except Xlib.error.ConnectionClosedError:
-                print("Display closed.")
-        print(f"Window display stopped (ID: {self.display_id})")
+                logger.debug("Display closed", extra=fields(display=self.display_id))
+        self.remove_fbdir()
+        metrics.forget(display=self.display_id)
+        logger.info("Window display stopped", extra=fields(display=self.display_id))
     
+    def remove_fbdir(self):
+        if self.fbdir:
+            shutil.rmtree(self.fbdir, ignore_errors=True)
+            self.fbdir = None
+
     def get_display(self):
         return self.x11_display
     
-    def capture_window(self, compressed=False, force=False):
-        """Capture the window content"""
+    async def capture_window_async(self, force=False, profiles=None):
+        """Capture the window content on the capture pool, without blocking the event loop"""
+        return await capture_pool().capture(self, force, profiles)
+
+    def capture_window(self, compressed=False, force=False, profiles=None):
+        """Capture the window content, encoded once per (quality, scale) profile"""
         if self.screen_capture:
-            capture = self.screen_capture.capture_window(self.x, self.y, self.height, self.width, self.settings.image_quality, self.settings.dpi, force)
-
-            """ This clearly needs some better documenting and explanation """
-            if capture != self.last_frame or force or self.still_frames < 10:
-                if capture != self.last_frame:
-                    self.still_frames = 0
-                else:
-                    self.still_frames += 1
-                self.last_frame = capture
-                self.has_updated = True
-                if compressed:
-                    with BytesIO() as out:
-                        with gzip.GzipFile(fileobj=out, mode="w", compresslevel=1) as f:
-                            f.write(capture)
-                        print('Compressed/Uncompressed', len(out.getvalue()), len(capture))
-                        return out.getvalue()
-                return capture
-            
-            self.has_updated = False
+            capture = self.screen_capture.capture_window(self.x, self.y, self.height, self.width, self.settings.image_quality, self.settings.dpi, force, profiles)
+            return self.process_frame(capture, compressed, self.screen_capture.last_stats)
         return None
+
+    def process_frame(self, capture, compressed=False, stats=None):
+        """Record the metrics of a capture and return its frames, gzipped if compressed
+
+        The capture is None when the screen did not change since the previous one, unless forced:
+        there is nothing to send then"""
+        if stats is not None:
+            self.record_capture(capture, *stats)
+        if compressed and capture:
+            return {profile: self.compress(frame) for profile, frame in capture.items()}
+        return capture
     
+    def record_capture(self, capture, capture_seconds, encode_seconds):
+        metrics.CAPTURE_SECONDS.labels(self.display_id).observe(capture_seconds)
+        if not capture:
+            metrics.FRAMES_UNCHANGED.labels(self.display_id).inc()
+            return
+        metrics.ENCODE_SECONDS.labels(self.display_id).observe(encode_seconds)
+        metrics.FRAMES_ENCODED.labels(self.display_id).inc()
+        metrics.ENCODED_BYTES.labels(self.display_id).inc(sum(len(frame) for frame in capture.values()))
+
+    def compress(self, frame):
+        with BytesIO() as out:
+            with gzip.GzipFile(fileobj=out, mode="w", compresslevel=1) as f:
+                f.write(frame)
+            get_logger('frames').debug("Compressed frame", extra=fields(
+                display=self.display_id, compressed=len(out.getvalue()), size=len(frame)))
+            return out.getvalue()
+
     def force_resize(self, height, width):
         # Always make sure that the size defined when starting the X server is smaller
         # than the size you try to resize with!
@@ -128,33 +204,46 @@ class SingleWindowDisplay:
         self.width = width
         self.x = 0
         self.y = 0
-        print('force_resize:: expected new dimensions', height, width)
-        print('force_resize:: geometry before', win.get_geometry())
+        # The geometry is only queried (a round-trip each) when debugging
+        debug = resize_log.isEnabledFor(logging.DEBUG)
+        if debug:
+            resize_log.debug("Force resize", extra=fields(display=self.display_id, width=width, height=height,
+                                                          before=str(win.get_geometry())))
 
         win.configure(x=0, y=0, width=width, height=height, border_width=0)
         win.change_attributes(win_gravity=X.NorthWestGravity, bit_gravity=X.StaticGravity)
 
         self.x11_display.sync()
-        print('Win', win.get_wm_name(), win.get_geometry())
 
         children = self.x11_display.screen().root.query_tree().children
         for w in children:
             if w.get_wm_name() is not None:
-                print('\tWinChild', w.get_wm_name(), w.get_geometry())
+                if debug:
+                    resize_log.debug("Resizing window", extra=fields(display=self.display_id, window=w.get_wm_name(),
+                                                                     geometry=str(w.get_geometry())))
                 w.configure(x=0, y=0, width=width, height=height, border_width=0)
                 # w.change_attributes(win_gravity=X.NorthWestGravity, bit_gravity=X.StaticGravity)
                 self.x11_display.sync()
-        print('force_resize:: geometry after children update', win.get_geometry())
+        if debug:
+            resize_log.debug("Force resized", extra=fields(display=self.display_id, after=str(win.get_geometry())))
+        # Might not damage anything, but the client needs a frame with the new size
+        self.frame_producer.request_keyframe()
 
     
-    def smart_resize(self):
+    def on_windows_changed(self, x11_display):
+        # Called from the watcher thread, with its own X connection
+        with self.lock:
+            if self.is_running:
+                self.smart_resize(x11_display)
+
+    def smart_resize(self, x11_display=None):
         """Automatically resize based on the inner windows sizes"""
         max_width, max_height, max_x, max_y = 0, 0, 0, 0
 
-        children = self.x11_display.screen().root.query_tree().children
+        x11_display = x11_display or self.x11_display
+        children = x11_display.screen().root.query_tree().children
         for w in children:
             geometry = w.get_geometry()
-            print("Smart resize", w, w.get_wm_name(), geometry)
             if geometry.width > max_width:
                 max_width = geometry.width
             if geometry.height > max_height:
@@ -164,11 +253,16 @@ class SingleWindowDisplay:
             if geometry.y > max_y:
                 max_y = geometry.y
 
+        if not max_width or not max_height:
+            return  # No window yet
         self.height = max_height
         self.width = max_width
         self.x = max_x
         self.y = max_y
-        print('smart resized to h/w x+y', self.height, self.width, self.x, self.y)
+        resize_log.debug("Smart resized", extra=fields(display=self.display_id, width=self.width, height=self.height,
+                                                       x=self.x, y=self.y))
+        # Might not damage anything, but the client needs a frame with the new size
+        self.frame_producer.request_keyframe()
 
     def get_window_info(self):
         """Get window information"""
@@ -181,69 +275,187 @@ class SingleWindowDisplay:
             'name': f"Window {self.display_id}"
         }
 
+class DisplayPool:
+    """Xvfb displays started ahead of time at the maximum resolution
+
+    create_display takes one right away while a background thread starts its replacement.
+    When no display was created for idle_timeout seconds, the pooled displays are stopped
+    and only started again on the next creation."""
+    def __init__(self, display_manager, size, idle_timeout):
+        self.display_manager = display_manager
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.settings = get_settings()
+        self.idle = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.last_demand = time.monotonic()  # Fill the pool at startup
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def take(self, display_id, width, height):
+        """Return a started display, or None if the pool is empty or its displays are too small"""
+        self.last_demand = time.monotonic()
+        self.wake.set()
+        if not width or not height or width > self.settings.max_width or height > self.settings.max_height:
+            return None
+        with self.lock:
+            if not self.idle:
+                return None
+            display = self.idle.pop(0)
+        # The metrics and log records of a display are labelled with its ID, which pooled
+        # displays do not have yet: it is set before anything is recorded for this one
+        display.display_id = display_id
+        # Xvfb runs at the maximum size, only the requested area is captured
+        display.width = width
+        display.height = height
+        return display
+
+    def run(self):
+        while not self.stopped.is_set():
+            wanted = time.monotonic() - self.last_demand < self.idle_timeout
+            if not wanted:
+                self.reap()
+            with self.lock:
+                ready = len(self.idle)
+            if wanted and ready < self.size:
+                display = SingleWindowDisplay(None, self.settings.max_width, self.settings.max_height)
+                if not display.start():
+                    self.stopped.wait(5)  # Do not retry in a tight loop when Xvfb can not start
+                    continue
+                with self.lock:
+                    if self.stopped.is_set():
+                        display.stop()
+                    else:
+                        self.idle.append(display)
+                    ready = len(self.idle)
+                logger.info("Display pool: %d/%d ready", ready, self.size)
+            else:
+                self.wake.wait(1)
+                self.wake.clear()
+
+    def reap(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for display in idle:
+            display.stop()
+        if idle:
+            logger.info("Display pool: stopped %d idle displays", len(idle))
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        self.reap()
+
+
 class DisplayManager:
+    """Keep track of the displays
+
+    The threadlock only guards the displays dict, never a slow operation. Starting, resizing
+    and stopping a display is serialized by its own lock, so that a slow start never holds
+    back the other displays. The *_job methods run these operations in the background."""
     def __init__(self):
         self.displays = {}
-        self.next_display_num = 2
         self.next_display_id = 1
         self.threadlock = threading.Lock()
-        
-    def create_display(self, width=1920, height=1080):
-        """Create a new virtual display"""
-        print('create_display:: width, height', width, height)
+        self.jobs = JobRunner()
+        settings = get_settings()
+        self.pool = None
+        if settings.display_pool_size:
+            self.pool = DisplayPool(self, settings.display_pool_size, settings.display_pool_idle_timeout)
+        add_settings_listener(self.on_settings_changed)
+
+    def on_settings_changed(self, settings):
+        """Push reloaded settings into the running displays"""
+        for display in self.get_all_displays():
+            display.apply_settings(settings)
+        if self.pool and (settings.max_width, settings.max_height) != (self.pool.settings.max_width, self.pool.settings.max_height):
+            # The pooled displays were started with the previous maximum size
+            self.pool.settings = settings
+            self.jobs.submit('reap', None, self.pool.reap)
+
+    def reserve_display_id(self):
         with self.threadlock:
-            display_num = self.next_display_num
-            self.next_display_num += 1
-            
             display_id = self.next_display_id
             self.next_display_id += 1
-            
-            # Create display
-            display = SingleWindowDisplay(display_num, display_id, width, height)
-            
-            if display.start():
-                self.displays[display_id] = display
-                return display
+            return display_id
+
+    def create_display(self, width=1920, height=1080):
+        """Create a new virtual display, returns None if it could not be started"""
+        try:
+            return self.start_display(self.reserve_display_id(), width, height)
+        except Exception as e:
+            logger.error("Failed to create display: %s", e)
             return None
+
+    def create_display_job(self, width=1920, height=1080):
+        """Create a new virtual display in the background, its ID is known right away"""
+        display_id = self.reserve_display_id()
+        return self.jobs.submit('create', display_id,
+                                lambda: self.start_display(display_id, width, height).get_window_info())
+
+    def start_display(self, display_id, width, height):
+        logger.debug("Creating display", extra=fields(display=display_id, width=width, height=height))
+        # A pre-started display if there is one, otherwise start a new one
+        display = self.pool.take(display_id, width, height) if self.pool else None
+        if display is None:
+            display = SingleWindowDisplay(display_id, width, height)
+            if not display.start():
+                raise Exception("Xvfb failed to start")
+
+        with self.threadlock:
+            self.displays[display_id] = display
+        return display
     
     def start_executable(self, display_id, executable_path):
-        with self.threadlock:
-            if display_id in self.displays:
-                display = self.displays[display_id]
-                # Prepare environment with the new display
-                env = os.environ.copy()
-                env['DISPLAY'] = display.display_name
-                # Start the application
-                process = subprocess.Popen(
-                    executable_path,
-                    shell=True,
-                    env=env,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    preexec_fn=os.setsid
-                )
-                time.sleep(1) # We are waiting for the window to be displayed, so that we can get its actual size
-                display.smart_resize()
-                return process
+        display = self.get_display(display_id)
+        if display is None:
             raise Exception("Unknown display", display_id)
+        with display.lock:
+            # Prepare environment with the new display
+            env = os.environ.copy()
+            env['DISPLAY'] = display.display_name
+            # Start the application
+            process = subprocess.Popen(
+                executable_path,
+                shell=True,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                preexec_fn=os.setsid
+            )
+            display.executable = executable_path
+            # The display's window watcher resizes it once the application maps its window
+            return process
 
+    def start_executable_job(self, display_id, executable_path):
+        if self.get_display(display_id) is None:
+            raise Exception("Unknown display", display_id)
+        return self.jobs.submit('run', display_id, lambda: {
+            'display': display_id, 'process': self.start_executable(display_id, executable_path).pid})
 
     def remove_display(self, display_id):
         """Remove a window display"""
         with self.threadlock:
-            if display_id in self.displays:
-                win = self.displays[display_id]
-                del self.displays[display_id]
+            win = self.displays.pop(display_id, None)
+        if win is not None:
+            with win.lock:
                 win.stop()
 
+    def remove_display_job(self, display_id):
+        return self.jobs.submit('remove', display_id, self.remove_display, display_id)
+
     def resize_display(self, display_id, width, height):
-        print('resize_display:: width, height', width, height)
-        """Force resize a display"""
-        with self.threadlock:
-            if display_id in self.displays:
-                print('Found window id', display_id)
-                win = self.displays[display_id]
-                win.force_resize(height, width)
+        """Force resize a display, blocks on its lock and X round-trips: never call it from the event loop"""
+        win = self.get_display(display_id)
+        if win is not None:
+            with win.lock:
+                if win.is_running:
+                    win.force_resize(height, width)
+
+    def resize_display_job(self, display_id, width, height):
+        return self.jobs.submit('resize', display_id, self.resize_display, display_id, width, height)
     
     def get_display(self, display_id):
         """Get a window display by ID"""
@@ -255,7 +467,12 @@ class DisplayManager:
     
     def stop_all(self):
         """Stop all displays"""
+        if self.pool:
+            self.pool.stop()
         with self.threadlock:
-            for display in self.displays.values():
-                display.stop()
+            displays = list(self.displays.values())
             self.displays.clear()
+        for display in displays:
+            with display.lock:
+                display.stop()
+        self.jobs.shutdown()
@@ -0,0 +1,288 @@
+import ctypes
+import ctypes.util
+import struct
+import mmap
+
+from Xlib import X
+
+# Framebuffer backends used by WindowScreenCapture
+# grab(width, height) returns a buffer of BGRX pixels and its stride (bytes per line)
+# The buffer is only valid until the next call to grab()
+
+ZPixmap = 2
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+ALL_PLANES = 0xffffffff
+
+# XWD file header, as written by Xvfb -fbdir (25 big-endian CARD32, followed by the window name)
+XWD_HEADER = struct.Struct('>25I')
+XWD_COLOR_SIZE = 12
+XWD_LSB_FIRST = 0
+
+
+class XlibFramebuffer:
+    """Plain GetImage requests, the pixels are sent over the X socket"""
+    def __init__(self, display):
+        self.root = display.screen().root
+
+    def grab(self, width, height):
+        raw = self.root.get_image(0, 0, width, height, X.ZPixmap, ALL_PLANES)
+        return raw.data, width * 4
+
+    def close(self):
+        pass
+
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class XImage(ctypes.Structure):
+    # Only the leading fields are needed, XImage is always allocated by Xlib
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+    ]
+
+
+_libs = None
+_x_errors = []
+_lost_displays = set()  # Connections to an X server which went away, e.g. its Xvfb died
+
+
+def _x_error_handler(display, event):
+    # The default Xlib handler exits the process, only remember that something failed
+    _x_errors.append(event)
+    return 0
+
+
+def _x_io_error_handler(display):
+    # Connection lost. libX11 exits the process once this returns, unless an exit handler is
+    # set on the display: with it, every later call on the display fails instead
+    _lost_displays.add(display)
+    return 0
+
+
+def _x_io_error_exit_handler(display, user_data):
+    _lost_displays.add(display)
+
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)(_x_error_handler)
+X_IO_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)(_x_io_error_handler)
+X_IO_ERROR_EXIT_HANDLER = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p)(_x_io_error_exit_handler)
+
+
+def load_libraries():
+    """Load libX11, libXext and libc through ctypes, once"""
+    global _libs
+    if _libs is not None:
+        return _libs
+
+    names = {'X11': ctypes.util.find_library('X11'), 'Xext': ctypes.util.find_library('Xext'),
+             'c': ctypes.util.find_library('c')}
+    missing = [name for name, path in names.items() if path is None]
+    if missing:
+        raise Exception("Missing libraries for MIT-SHM capture: %s" % ", ".join(missing))
+    x11 = ctypes.CDLL(names['X11'])
+    xext = ctypes.CDLL(names['Xext'])
+    libc = ctypes.CDLL(names['c'], use_errno=True)
+
+    x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x11.XOpenDisplay.restype = ctypes.c_void_p
+    x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+    x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XRootWindow.restype = ctypes.c_ulong
+    x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDefaultVisual.restype = ctypes.c_void_p
+    x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDestroyImage.argtypes = [ctypes.POINTER(XImage)]
+    x11.XSetErrorHandler.argtypes = [ctypes.c_void_p]
+    x11.XSetErrorHandler.restype = ctypes.c_void_p
+    x11.XSetIOErrorHandler.argtypes = [ctypes.c_void_p]
+    x11.XSetIOErrorHandler.restype = ctypes.c_void_p
+    # Only in libX11 1.7 and later
+    set_exit_handler = getattr(x11, 'XSetIOErrorExitHandler', None)
+    if set_exit_handler is not None:
+        set_exit_handler.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+        set_exit_handler.restype = None
+
+    xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+    xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                     ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo),
+                                     ctypes.c_uint, ctypes.c_uint]
+    xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+    xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+    xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+    xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage),
+                                  ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+
+    libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+    libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+    libc.shmat.restype = ctypes.c_void_p
+    libc.shmdt.argtypes = [ctypes.c_void_p]
+    libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    x11.XSetErrorHandler(ctypes.cast(X_ERROR_HANDLER, ctypes.c_void_p))
+    x11.XSetIOErrorHandler(ctypes.cast(X_IO_ERROR_HANDLER, ctypes.c_void_p))
+    _libs = (x11, xext, libc)
+    return _libs
+
+
+class ShmFramebuffer:
+    """XShmGetImage into a shared memory segment, the pixels are read in place through a memoryview
+
+    Losing the connection to the X server makes libX11 exit the whole process, unless it has
+    XSetIOErrorExitHandler to prevent it: only this display's capture fails then."""
+    def __init__(self, display_name):
+        self.x11, self.xext, self.libc = load_libraries()
+        self.dpy = None
+        self.shminfo = None
+        self.image = None
+        self.image_size = None
+
+        if not hasattr(self.x11, 'XSetIOErrorExitHandler'):
+            raise Exception("libX11 1.7 or later is required, an Xvfb exiting would stop the server")
+        self.dpy = self.x11.XOpenDisplay(display_name.encode('utf-8'))
+        if not self.dpy:
+            raise Exception("Could not open display %s for MIT-SHM capture" % display_name)
+        self.x11.XSetIOErrorExitHandler(self.dpy, ctypes.cast(X_IO_ERROR_EXIT_HANDLER, ctypes.c_void_p), None)
+        try:
+            if not self.xext.XShmQueryExtension(self.dpy):
+                self.check_connection()
+                raise Exception("MIT-SHM extension not available on %s" % display_name)
+            screen = self.x11.XDefaultScreen(self.dpy)
+            self.root = self.x11.XRootWindow(self.dpy, screen)
+            self.visual = self.x11.XDefaultVisual(self.dpy, screen)
+            self.depth = self.x11.XDefaultDepth(self.dpy, screen)
+            # The segment is sized for the whole screen, smaller captures reuse it
+            self.max_width = self.x11.XDisplayWidth(self.dpy, screen)
+            self.max_height = self.x11.XDisplayHeight(self.dpy, screen)
+            self.attach(self.max_width * self.max_height * 4)
+        except Exception:
+            self.close()
+            raise
+
+    def attach(self, size):
+        shminfo = XShmSegmentInfo()
+        shminfo.shmid = self.libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if shminfo.shmid < 0:
+            raise Exception("shmget failed: errno %s" % ctypes.get_errno())
+        shminfo.shmaddr = self.libc.shmat(shminfo.shmid, None, 0)
+        # Marked for removal right away, the segment lives until both sides detach from it
+        self.libc.shmctl(shminfo.shmid, IPC_RMID, None)
+        if shminfo.shmaddr in (None, ctypes.c_void_p(-1).value):
+            raise Exception("shmat failed: errno %s" % ctypes.get_errno())
+        shminfo.readOnly = 0
+        self.shminfo = shminfo
+
+        del _x_errors[:]
+        self.xext.XShmAttach(self.dpy, ctypes.byref(shminfo))
+        self.x11.XSync(self.dpy, 0)
+        self.check_connection()
+        if _x_errors:
+            # e.g. the X server can not access our segment
+            raise Exception("XShmAttach failed")
+
+    def create_image(self, width, height):
+        self.destroy_image()
+        image = self.xext.XShmCreateImage(self.dpy, self.visual, self.depth, ZPixmap, None,
+                                          ctypes.byref(self.shminfo), width, height)
+        if not image:
+            raise Exception("XShmCreateImage failed")
+        image.contents.data = self.shminfo.shmaddr
+        self.image = image
+        self.image_size = (width, height)
+
+    def destroy_image(self):
+        if self.image:
+            # The data belongs to the shared memory segment, it must not be freed by Xlib
+            self.image.contents.data = None
+            self.x11.XDestroyImage(self.image)
+        self.image = None
+        self.image_size = None
+
+    def grab(self, width, height):
+        if not self.dpy:
+            raise Exception("MIT-SHM capture is closed")
+        if self.image_size != (width, height):
+            self.create_image(width, height)
+        if not self.xext.XShmGetImage(self.dpy, self.root, self.image, 0, 0, ALL_PLANES):
+            self.check_connection()
+            raise Exception("XShmGetImage failed")
+        stride = self.image.contents.bytes_per_line
+        pixels = (ctypes.c_ubyte * (stride * height)).from_address(self.shminfo.shmaddr)
+        return memoryview(pixels).cast('B'), stride
+
+    def check_connection(self):
+        if self.dpy in _lost_displays:
+            raise Exception("Connection to the X server lost")
+
+    def close(self):
+        if self.dpy:
+            self.destroy_image()
+            lost = self.dpy in _lost_displays
+            if self.shminfo is not None:
+                if self.shminfo.shmaddr:
+                    if not lost:
+                        self.xext.XShmDetach(self.dpy, ctypes.byref(self.shminfo))
+                        self.x11.XSync(self.dpy, 0)
+                    self.libc.shmdt(self.shminfo.shmaddr)
+                self.shminfo = None
+            self.x11.XCloseDisplay(self.dpy)
+            # The address may be reused by the next connection
+            _lost_displays.discard(self.dpy)
+            self.dpy = None
+
+
+class MmapFramebuffer:
+    """Read the pixels straight from the XWD file Xvfb -fbdir maps its screen to, no X round-trip at all
+    Several processes can map the same file, e.g. to spread the encoding over multiple cores"""
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        (header_size, _, _, _, self.max_width, self.max_height, _, byte_order, _, _, _,
+         bits_per_pixel, self.stride, _, _, _, _, _, _, ncolors, _, _, _, _, _) = XWD_HEADER.unpack_from(self.mmap)
+        if bits_per_pixel != 32 or byte_order != XWD_LSB_FIRST:
+            self.close()
+            raise Exception("Unsupported framebuffer format: %s bpp, byte order %s" % (bits_per_pixel, byte_order))
+        self.offset = header_size + ncolors * XWD_COLOR_SIZE
+        self.pixels = memoryview(self.mmap)
+
+    def grab(self, width, height):
+        if self.mmap is None:
+            raise Exception("Framebuffer file is closed")
+        # The rows keep the stride of the whole screen, only the first ones are needed
+        return self.pixels[self.offset:self.offset + self.stride * height], self.stride
+
+    def close(self):
+        if self.mmap is not None:
+            self.pixels.release()
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass  # Some frame still references the mapping, it is unmapped once released
+            self.mmap = None
+        self.file.close()
@@ -0,0 +1,152 @@
+import io
+import asyncio
+import email.parser
+import email.utils
+import http.client
+from http import HTTPStatus
+from webx11.log import get_logger
+
+# Seconds an idle keep-alive connection stays open
+KEEP_ALIVE_TIMEOUT = 60
+# Seconds a client has to send the headers and body of a request, once it started it
+REQUEST_TIMEOUT = 30
+MAX_HEADERS = 100
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+logger = get_logger('http')
+
+
+class AsyncRequestHandler:
+    """The part of BaseHTTPRequestHandler used by APIHandler, served from the asyncio event loop
+
+    do_<METHOD> may be a coroutine. The response is buffered, so that it can be sent with
+    its Content-Length and the connection kept alive for the next request."""
+    server_version = 'WebX11'
+
+    def __init__(self, command, path, request_version, headers, body):
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+        self.rfile = io.BytesIO(body)
+        self.wfile = io.BytesIO()
+        self.status = None
+        self.response_headers = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_response(self, code, message=None):
+        self.status = (code, message or HTTPStatus(code).phrase)
+        self.response_headers = []
+
+    def send_header(self, keyword, value):
+        self.response_headers.append((keyword, str(value)))
+
+    def end_headers(self):
+        pass
+
+    def send_error(self, code, message=None):
+        # Replaces whatever was written so far, like the body of an error page would
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/html;charset=utf-8')
+        self.wfile = io.BytesIO()
+        self.wfile.write(('<html><body><h1>Error %d</h1><p>%s</p></body></html>' % (
+            code, message or self.status[1])).encode('utf-8'))
+
+    async def handle(self):
+        method = getattr(self, 'do_' + self.command, None)
+        if method is None:
+            self.send_error(501, "Unsupported method (%r)" % self.command)
+            return
+        result = method()
+        if asyncio.iscoroutine(result):
+            await result
+
+    def response(self, keep_alive):
+        code, message = self.status or (500, HTTPStatus(500).phrase)
+        body = self.wfile.getvalue()
+        lines = ['HTTP/1.1 %d %s' % (code, message),
+                 'Server: %s' % self.server_version,
+                 'Date: %s' % email.utils.formatdate(usegmt=True)]
+        lines += ['%s: %s' % header for header in self.response_headers
+                  if header[0].lower() not in ('content-length', 'connection')]
+        lines.append('Content-Length: %d' % len(body))
+        lines.append('Connection: %s' % ('keep-alive' if keep_alive else 'close'))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+class AsyncHTTPServer:
+    """Minimal HTTP/1.1 server with keep-alive, running on the asyncio event loop"""
+    def __init__(self, handler_factory):
+        self.handler_factory = handler_factory
+
+    async def read_request(self, reader):
+        """Returns (command, path, version, headers, body), or None when the client is gone"""
+        request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+        if not request_line:
+            return None
+        command, path, version = request_line.decode('latin-1').split()
+        headers, body = await asyncio.wait_for(self.read_headers_and_body(reader), REQUEST_TIMEOUT)
+        return command, path, version, headers, body
+
+    async def read_headers_and_body(self, reader):
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line.decode('latin-1'))
+            if len(header_lines) > MAX_HEADERS:
+                raise ValueError("Too many headers")
+        headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(''.join(header_lines))
+
+        length = int(headers.get('Content-Length', 0))
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return headers, body
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError:
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                if request is None:
+                    break
+                command, path, version, headers, body = request
+
+                connection = headers.get('Connection', '').lower()
+                if version == 'HTTP/1.1':
+                    keep_alive = connection != 'close'
+                else:
+                    keep_alive = connection == 'keep-alive'
+
+                handler = self.handler_factory(command, path, version, headers, body)
+                try:
+                    await handler.handle()
+                except Exception:
+                    logger.exception("Error handling %s %s", command, path)
+                    handler.send_error(500, "Server error")
+                writer.write(handler.response(keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+async def run_http_server(handler_factory, host, port):
+    server = AsyncHTTPServer(handler_factory)
+    return await asyncio.start_server(server.handle_connection, host, port)
@@ -0,0 +1,59 @@
+import struct
+
+# Binary input messages, as sent by display.html
+#   version (B) | record count (B) | records
+# Every record is 8 bytes long and starts with its type (B), decoded with the table below.
+# Anything else (resize, refresh, text input...) is still sent as JSON, which always starts with '{'
+INPUT_VERSION = 1
+INPUT_HEADER = struct.Struct('>BB')
+INPUT_RECORD_SIZE = 8
+
+MOUSE_RECORD = struct.Struct('>xBHHxx')  # button, x, y
+MOTION_RECORD = struct.Struct('>xxHHxx')  # x, y
+SCROLL_RECORD = struct.Struct('>xxHHh')  # x, y, deltaY
+KEY_RECORD = struct.Struct('>xxxxI')  # keysym
+
+INPUT_RECORDS = {
+    1: ('mousedown', MOUSE_RECORD, ('button', 'x', 'y')),
+    2: ('mouseup', MOUSE_RECORD, ('button', 'x', 'y')),
+    3: ('mousemove', MOTION_RECORD, ('x', 'y')),
+    4: ('scroll', SCROLL_RECORD, ('x', 'y', 'deltaY')),
+    5: ('keydown', KEY_RECORD, ('keysym',)),
+    6: ('keyup', KEY_RECORD, ('keysym',)),
+}
+
+
+def is_binary_input(message):
+    return isinstance(message, (bytes, bytearray)) and len(message) >= INPUT_HEADER.size \
+        and message[0] == INPUT_VERSION
+
+
+def decode_input(message):
+    """Decode a batch of input records into the same messages as their JSON counterparts"""
+    _, count = INPUT_HEADER.unpack_from(message)
+    if len(message) < INPUT_HEADER.size + count * INPUT_RECORD_SIZE:
+        raise ValueError("Truncated input message")
+    events = []
+    for i in range(count):
+        offset = INPUT_HEADER.size + i * INPUT_RECORD_SIZE
+        record = INPUT_RECORDS.get(message[offset])
+        if record is None:
+            continue  # Unknown record type, from a newer client
+        msg_type, record_struct, fields = record
+        event = dict(zip(fields, record_struct.unpack_from(message, offset)))
+        event['type'] = msg_type
+        events.append(event)
+    return events
+
+
+def encode_input(events):
+    """Encode a batch of input messages (at most 255), the inverse of decode_input"""
+    record_types = {name: (record_type, record_struct, fields)
+                    for record_type, (name, record_struct, fields) in INPUT_RECORDS.items()}
+    message = bytearray(INPUT_HEADER.pack(INPUT_VERSION, len(events)))
+    for event in events:
+        record_type, record_struct, fields = record_types[event['type']]
+        record = bytearray(record_struct.pack(*(event.get(field, 0) for field in fields)))
+        record[0] = record_type
+        message += record
+    return bytes(message)
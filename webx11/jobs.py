@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from webx11.log import get_logger, fields
+
+logger = get_logger('jobs')
+
+
+class Job:
+    """A display operation running in the background"""
+    def __init__(self, job_id, kind, display_id):
+        self.id = job_id
+        self.kind = kind
+        self.display_id = display_id
+        self.status = 'pending'  # pending, running, done or failed
+        self.result = None
+        self.error = None
+        self.future = None
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish, returns False on timeout"""
+        try:
+            self.future.exception(timeout=timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'display': self.display_id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobRunner:
+    """Run the slow display operations (starting Xvfb, an application...) on a thread pool
+
+    The HTTP API returns the job right away, its status can then be polled or awaited.
+    Only the last max_jobs jobs are kept."""
+    max_jobs = 1000
+
+    def __init__(self, workers=8):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webx11-jobs')
+        self.jobs = OrderedDict()
+        self.next_job_id = 1
+        self.lock = threading.Lock()
+
+    def submit(self, kind, display_id, func, *args):
+        """Run func(*args) in the background, its return value becomes the job result"""
+        with self.lock:
+            job = Job(self.next_job_id, kind, display_id)
+            self.next_job_id += 1
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        job.future = self.executor.submit(self.run, job, func, args)
+        return job
+
+    def run(self, job, func, args):
+        job.status = 'running'
+        try:
+            job.result = func(*args)
+            job.status = 'done'
+        except Exception as e:
+            logger.error("Job failed: %s", e, extra=fields(job=job.id, kind=job.kind, display=job.display_id))
+            job.error = str(e)
+            job.status = 'failed'
+        return job.result
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
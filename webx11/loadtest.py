@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Headless load generator, simulating viewers of WebX11 displays
+
+Every viewer speaks the same protocol as the web client: it receives the frames over
+WebSocket or WebTransport, sends binary input batches and its stats feedback every second.
+Slow readers take longer to handle each frame, like a viewer on a weak device or link.
+
+    python -m webx11.loadtest --displays 1 --viewers 50 --duration 60 --input-rate 30
+    python -m webx11.loadtest --create 4 --run xterm --viewers 25 --transport webtransport --insecure
+"""
+
+import os
+import ssl
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import urllib.request
+from datetime import datetime, timezone
+
+import websockets
+
+from webx11.input_protocol import encode_input
+
+try:
+    from aioquic.asyncio.client import connect
+    from aioquic.asyncio.protocol import QuicConnectionProtocol
+    from aioquic.h3.connection import H3_ALPN, H3Connection
+    from aioquic.h3.events import HeadersReceived, WebTransportStreamDataReceived
+    from aioquic.quic.configuration import QuicConfiguration
+    WEBTRANSPORT_AVAILABLE = True
+except ImportError:
+    WEBTRANSPORT_AVAILABLE = False
+
+# WebTransport frame header: frame counter (H) | frame size (I) | server timestamp in ms (Q)
+WT_HEADER_SIZE = 14
+STATS_INTERVAL = 1.0
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return None
+    values = sorted(values)
+    result = {f'p{point}': round(values[min(len(values) - 1, int(len(values) * point / 100))], 3) for point in points}
+    result['max'] = round(values[-1], 3)
+    return result
+
+
+class Viewer:
+    """One simulated viewer of a display"""
+    def __init__(self, display_id, args, slow):
+        self.display_id = display_id
+        self.args = args
+        self.slow_delay = args.slow_delay / 1000 if slow else 0
+        self.slow = slow
+        self.frames = 0
+        self.bytes = 0
+        self.arrivals = []  # Milliseconds between two frames
+        # Milliseconds between the server sending a frame (its header timestamp) and its arrival,
+        # WebTransport only. Not input latency: frames are not matched with the inputs that caused them
+        self.frame_delays = []
+        self.last_arrival = None
+        self.first_frame = None
+        self.inputs = 0
+        self.errors = []
+        self.report = {'frames': 0, 'latency': 0, 'latency_samples': 0}
+        self.queued = 0
+        self.busy = asyncio.Lock()  # Frames are handled one at a time, like the web client does
+
+    async def frame_received(self, frame, timestamp=None):
+        now = time.monotonic()
+        if self.first_frame is None:
+            self.first_frame = now
+        if self.last_arrival is not None:
+            self.arrivals.append((now - self.last_arrival) * 1000)
+        self.last_arrival = now
+        self.frames += 1
+        self.bytes += len(frame)
+        self.report['frames'] += 1
+        if timestamp is not None:
+            delay = time.time() * 1000 - timestamp
+            self.frame_delays.append(delay)
+            # Reported like the web client does, as the latency of the frames
+            self.report['latency'] += delay
+            self.report['latency_samples'] += 1
+        if self.slow_delay:
+            # Decoding and drawing take that long, the next frames wait meanwhile
+            self.queued += 1
+            async with self.busy:
+                await asyncio.sleep(self.slow_delay)
+            self.queued -= 1
+
+    def stats_message(self):
+        report, self.report = self.report, {'frames': 0, 'latency': 0, 'latency_samples': 0}
+        message = {
+            'type': 'stats',
+            'fps': report['frames'] / STATS_INTERVAL,
+            'decode': self.slow_delay * 1000,
+            'queued': self.queued,
+        }
+        if report['latency_samples']:
+            message['latency'] = report['latency'] / report['latency_samples']
+        return message
+
+    def input_batch(self):
+        """A pointer motion, and a key press now and then"""
+        x, y = random.randrange(self.args.width), random.randrange(self.args.height)
+        events = [{'type': 'mousemove', 'x': x, 'y': y}]
+        if self.args.key_rate and random.random() < self.args.key_rate / self.args.input_rate:
+            keysym = ord(random.choice('abcdefghijklmnopqrstuvwxyz'))
+            events += [{'type': 'keydown', 'keysym': keysym}, {'type': 'keyup', 'keysym': keysym}]
+        self.inputs += len(events)
+        return encode_input(events)
+
+    async def send_loop(self, send_input, send_message, deadline):
+        """Input at input_rate and the stats feedback every second, until the deadline"""
+        loop = asyncio.get_running_loop()
+        next_input = loop.time()
+        next_stats = loop.time() + STATS_INTERVAL
+        interval = 1 / self.args.input_rate if self.args.input_rate else None
+        while loop.time() < deadline:
+            now = loop.time()
+            if interval and now >= next_input:
+                await send_input(self.input_batch())
+                next_input += interval
+            if now >= next_stats:
+                await send_message(json.dumps(self.stats_message()))
+                next_stats += STATS_INTERVAL
+            wake = min(next_stats, next_input if interval else next_stats, deadline)
+            await asyncio.sleep(max(0, wake - loop.time()))
+
+    async def run_websocket(self, deadline):
+        url = f'ws://{self.args.host}:{self.args.websocket_port}/ws/{self.display_id}'
+        # Slow readers only read the socket once done with a frame, the server sees the backpressure
+        async with websockets.connect(url, max_size=None, max_queue=1 if self.slow else 16) as websocket:
+            async def send_message(message):
+                await websocket.send(message)
+
+            sender = asyncio.create_task(self.send_loop(send_message, send_message, deadline))
+            try:
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    if isinstance(message, bytes):
+                        await self.frame_received(message)
+            finally:
+                sender.cancel()
+
+    async def run_webtransport(self, deadline):
+        configuration = QuicConfiguration(is_client=True, alpn_protocols=H3_ALPN, max_datagram_frame_size=65536,
+                                          server_name=self.args.host)
+        if self.args.insecure:
+            configuration.verify_mode = ssl.CERT_NONE
+        async with connect(self.args.host, self.args.webtransport_port, configuration=configuration,
+                           create_protocol=WebTransportClient) as client:
+            client.viewer = self
+            await asyncio.wait_for(client.open_session(self.args.host, f'/wt/{self.display_id}'), 10)
+
+            async def send_input(data):
+                client.send_datagram(data)
+
+            async def send_message(message):
+                client.send_datagram(message.encode('utf-8'))
+
+            await self.send_loop(send_input, send_message, deadline)
+            await client.wait_frames()
+
+    async def run(self, deadline):
+        try:
+            if self.args.transport == 'webtransport':
+                await self.run_webtransport(deadline)
+            else:
+                await self.run_websocket(deadline)
+        except Exception as e:
+            self.errors.append(f'{type(e).__name__}: {e}')
+
+
+if WEBTRANSPORT_AVAILABLE:
+    class WebTransportClient(QuicConnectionProtocol):
+        """A WebTransport session over HTTP/3, receiving one frame per unidirectional stream"""
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.http = H3Connection(self._quic, enable_webtransport=True)
+            self.viewer = None
+            self.session_id = None
+            self.session_ready = None
+            self.streams = {}
+            self.frames = set()
+
+        async def open_session(self, authority, path):
+            self.session_ready = asyncio.get_running_loop().create_future()
+            self.session_id = self._quic.get_next_available_stream_id()
+            self.http.send_headers(self.session_id, [
+                (b':method', b'CONNECT'),
+                (b':protocol', b'webtransport'),
+                (b':scheme', b'https'),
+                (b':authority', authority.encode()),
+                (b':path', path.encode()),
+            ])
+            self.transmit()
+            await self.session_ready
+
+        def send_datagram(self, data):
+            self.http.send_datagram(self.session_id, data)
+            self.transmit()
+
+        def quic_event_received(self, event):
+            for h3_event in self.http.handle_event(event):
+                if isinstance(h3_event, HeadersReceived) and h3_event.stream_id == self.session_id:
+                    status = dict(h3_event.headers).get(b':status')
+                    if status == b'200':
+                        self.session_ready.set_result(None)
+                    else:
+                        self.session_ready.set_exception(Exception(f'Session refused with status {status}'))
+                elif isinstance(h3_event, WebTransportStreamDataReceived):
+                    data = self.streams.setdefault(h3_event.stream_id, bytearray())
+                    data += h3_event.data
+                    if h3_event.stream_ended:
+                        data = bytes(self.streams.pop(h3_event.stream_id))
+                        timestamp = int.from_bytes(data[6:WT_HEADER_SIZE], 'big')
+                        task = asyncio.ensure_future(self.viewer.frame_received(data[WT_HEADER_SIZE:], timestamp))
+                        self.frames.add(task)
+                        task.add_done_callback(self.frames.discard)
+
+        async def wait_frames(self):
+            if self.frames:
+                await asyncio.wait(list(self.frames))
+
+
+def api_request(args, method, path, data=None):
+    request = urllib.request.Request(f'http://{args.host}:{args.http_port}{path}', method=method,
+                                     data=json.dumps(data).encode('utf-8') if data is not None else None,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=70) as response:
+        return json.loads(response.read() or b'null')
+
+
+def wait_job(args, job_id, action):
+    job = api_request(args, 'GET', f"/job/{job_id}?wait=60")
+    if job['status'] != 'done':
+        raise Exception(f"{action} failed: {job['error'] or job['status']}")
+    return job
+
+
+def create_displays(args, created):
+    """Create displays through the HTTP API, optionally running an application on each
+
+    Every display ID goes into created as soon as it is known, so that it is removed even
+    when a later step fails."""
+    for _ in range(args.create):
+        accepted = api_request(args, 'POST', '/display', {'width': args.width, 'height': args.height})
+        created.append(accepted['display'])
+        wait_job(args, accepted['job'], "Display creation")
+        if args.run:
+            accepted = api_request(args, 'POST', f"/display/{accepted['display']}/run", {'executable': args.run})
+            wait_job(args, accepted['job'], f"Starting {args.run}")
+
+
+def process_cpu_seconds(pid):
+    """User and system CPU time of a process, from /proc"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def own_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def summarize(viewers, elapsed, server_cpu, own_cpu, args):
+    connected = [viewer for viewer in viewers if viewer.frames]
+    fps = [(viewer.frames - 1) / max(0.001, viewer.last_arrival - viewer.first_frame) for viewer in connected
+           if viewer.frames > 1]
+    total_bytes = sum(viewer.bytes for viewer in viewers)
+    errors = {}
+    for viewer in viewers:
+        for error in viewer.errors:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        'date': datetime.now(timezone.utc).isoformat(),
+        'transport': args.transport,
+        'displays': sorted({viewer.display_id for viewer in viewers}),
+        'viewers': len(viewers),
+        'viewers_receiving': len(connected),
+        'slow_viewers': sum(viewer.slow for viewer in viewers),
+        'duration': round(elapsed, 3),
+        'frames': sum(viewer.frames for viewer in viewers),
+        'throughput_mbps': round(total_bytes * 8 / elapsed / 1e6, 3),
+        'fps_per_viewer': {
+            'mean': round(sum(fps) / len(fps), 3) if fps else 0,
+            'min': round(min(fps), 3) if fps else 0,
+        },
+        'frame_interval_ms': percentiles([gap for viewer in viewers for gap in viewer.arrivals]),
+        'frame_delay_ms': percentiles([delay for viewer in viewers for delay in viewer.frame_delays]),
+        'inputs_sent': sum(viewer.inputs for viewer in viewers),
+        'server_cpu_percent': round(server_cpu / elapsed * 100, 1) if server_cpu is not None else None,
+        'loadtest_cpu_percent': round(own_cpu / elapsed * 100, 1),
+        'errors': errors,
+    }
+
+
+async def run_load(args, display_ids):
+    loop = asyncio.get_running_loop()
+    viewers = []
+    slow = round(args.viewers * args.slow_readers)
+    for display_id in display_ids:
+        for i in range(args.viewers):
+            viewers.append(Viewer(display_id, args, i < slow))
+    server_cpu = process_cpu_seconds(args.server_pid) if args.server_pid else None
+    own_cpu = own_cpu_seconds()
+    start = loop.time()
+    deadline = start + args.ramp_up + args.duration
+    tasks = []
+    for i, viewer in enumerate(viewers):
+        tasks.append(asyncio.create_task(viewer.run(deadline)))
+        if args.ramp_up:
+            # Connections spread over the ramp up, instead of hundreds of handshakes at once
+            await asyncio.sleep(args.ramp_up / len(viewers))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+    if server_cpu is not None:
+        server_cpu = process_cpu_seconds(args.server_pid) - server_cpu
+    return summarize(viewers, elapsed, server_cpu, own_cpu_seconds() - own_cpu, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=8080)
+    parser.add_argument('--websocket-port', type=int, default=8081)
+    parser.add_argument('--webtransport-port', type=int, default=4433)
+    parser.add_argument('--transport', choices=['websocket', 'webtransport'], default='websocket')
+    parser.add_argument('--insecure', action='store_true', help='Do not verify the WebTransport certificate')
+    parser.add_argument('--displays', default='', help='Comma separated IDs of running displays')
+    parser.add_argument('--create', type=int, default=0, help='Displays to create (and remove) through the API')
+    parser.add_argument('--run', help='Executable started on every created display')
+    parser.add_argument('--width', type=int, default=1280, help='Size of the created displays and input area')
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--viewers', type=int, default=10, help='Viewers per display (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load once ramped up (default: %(default)s)')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which viewers connect (default: %(default)s)')
+    parser.add_argument('--input-rate', type=float, default=0, help='Pointer motions per second per viewer')
+    parser.add_argument('--key-rate', type=float, default=0, help='Key presses per second per viewer, at most input-rate')
+    parser.add_argument('--slow-readers', type=float, default=0, help='Fraction of slow viewers, 0 to 1')
+    parser.add_argument('--slow-delay', type=float, default=200, help='Milliseconds a slow viewer spends on each frame')
+    parser.add_argument('--server-pid', type=int, help='PID of the server, to report its CPU use (same host only)')
+    parser.add_argument('--output', default='-', help='JSON results file, - for stdout (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.transport == 'webtransport' and not WEBTRANSPORT_AVAILABLE:
+        parser.error('aioquic is required for WebTransport viewers')
+    if args.key_rate and args.key_rate > args.input_rate:
+        parser.error('--key-rate can not be higher than --input-rate')
+    if args.server_pid and not os.path.exists(f'/proc/{args.server_pid}/stat'):
+        parser.error(f'No process {args.server_pid} on this host')
+
+    display_ids = [int(display_id) for display_id in args.displays.split(',') if display_id]
+    if not display_ids and not args.create:
+        parser.error('No display to load, use --displays or --create')
+
+    created = []
+    try:
+        create_displays(args, created)
+        report = asyncio.run(run_load(args, display_ids + created))
+    finally:
+        # A failed removal must neither hide the error of the run nor stop the other removals
+        for display_id in created:
+            try:
+                api_request(args, 'DELETE', f'/display/{display_id}')
+            except (OSError, ValueError) as e:
+                print(f"Could not remove display {display_id}: {e}", file=sys.stderr)
+
+    print(f"{report['viewers_receiving']}/{report['viewers']} viewers receiving, "
+          f"{report['fps_per_viewer']['mean']} fps per viewer, {report['throughput_mbps']} Mbit/s, "
+          f"frame delay {report['frame_delay_ms']}", file=sys.stderr)
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import sys
+import queue
+import atexit
+import logging
+import itertools
+import logging.handlers
+
+# Every logger is a child of this one, named after its category: webx11.frames, webx11.input...
+ROOT_LOGGER = 'webx11'
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_listener = None
+_sampling_filter = None
+
+
+def get_logger(category):
+    return logging.getLogger(f'{ROOT_LOGGER}.{category}')
+
+
+def fields(**values):
+    """Structured fields of a record, logger.debug("Frame sent", extra=fields(display=1, size=1024))"""
+    return {'fields': values}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Appends the fields of a record as key=value pairs"""
+    def format(self, record):
+        line = super().format(record)
+        values = getattr(record, 'fields', None)
+        if values:
+            line += ' ' + ' '.join(f'{key}={value!r}' if isinstance(value, str) and (' ' in value or not value)
+                                   else f'{key}={value}' for key, value in values.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Only let one out of every n records of a category through, warnings and errors always go through"""
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+        self.counters = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        category = record.name[len(ROOT_LOGGER) + 1:]
+        rate = self.rates.get(category)
+        if not rate or rate <= 1:
+            return True
+        counter = self.counters.get(category)
+        if counter is None:
+            counter = self.counters.setdefault(category, itertools.count())
+        return next(counter) % rate == 0
+
+
+def setup_logging(settings):
+    """Send the records through a queue, written to stdout by a background thread
+
+    Logging from the event loop or a capture thread never waits for the terminal. Sampling
+    is applied by the category loggers themselves, a sampled out record never reaches a handler."""
+    global _listener, _sampling_filter
+    from webx11.settings import add_settings_listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    _sampling_filter = SamplingFilter()
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+    apply_log_settings(settings)
+    add_settings_listener(apply_log_settings)
+
+
+def apply_log_settings(settings):
+    logging.getLogger(ROOT_LOGGER).setLevel(settings.log_level.upper())
+    if _sampling_filter is not None:
+        _sampling_filter.rates = settings.log_sampling
+        # Filters of a parent logger do not apply to the records of its children
+        for category in settings.log_sampling:
+            get_logger(category).addFilter(_sampling_filter)
@@ -0,0 +1,164 @@
+import threading
+
+# Prometheus text exposition format, served at /metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+
+_metrics = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs) + '}'
+
+
+class Metric:
+    """A metric and its series, one per combination of label values
+
+    Updated from the event loop as well as from the capture threads, hence the lock."""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        series = self.series.get(key)
+        if series is None:
+            with self.lock:
+                series = self.series.setdefault(key, self.new_series())
+        return series
+
+    def remove(self, **labels):
+        """Drop the series matching these label values, e.g. of a stopped display"""
+        indexes = [(self.labelnames.index(name), str(value)) for name, value in labels.items()
+                   if name in self.labelnames]
+        if len(indexes) != len(labels):
+            return
+        with self.lock:
+            for key in [key for key in self.series if all(key[i] == value for i, value in indexes)]:
+                del self.series[key]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                lines += self.render_series(key, series)
+        return lines
+
+    def render_series(self, key, series):
+        return ['%s%s %s' % (self.name, format_labels(self.labelnames, key), series.value)]
+
+
+class Value:
+    def __init__(self, lock):
+        self.lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def new_series(self):
+        return Value(self.lock)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def new_series(self):
+        return Value(self.lock)
+
+
+class HistogramValue:
+    def __init__(self, lock, buckets):
+        self.lock = lock
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        with self.lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def new_series(self):
+        return HistogramValue(self.lock, self.buckets)
+
+    def render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series.counts):
+            cumulative += count
+            lines.append('%s_bucket%s %s' % (self.name, format_labels(self.labelnames, key, [('le', bound)]), cumulative))
+        lines.append('%s_bucket%s %s' % (self.name, format_labels(self.labelnames, key, [('le', '+Inf')]), series.count))
+        lines.append('%s_sum%s %s' % (self.name, format_labels(self.labelnames, key), series.sum))
+        lines.append('%s_count%s %s' % (self.name, format_labels(self.labelnames, key), series.count))
+        return lines
+
+
+def render():
+    """Every metric, in the Prometheus text format"""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+def forget(**labels):
+    """Drop the series of a stopped display or a gone client from every metric"""
+    for metric in _metrics:
+        metric.remove(**labels)
+
+
+# Capture and encoding, per display
+CAPTURE_SECONDS = Histogram('webx11_capture_seconds', 'Time spent reading the pixels from the X server', ['display'])
+ENCODE_SECONDS = Histogram('webx11_encode_seconds', 'Time spent comparing and encoding a captured frame', ['display'])
+FRAMES_ENCODED = Counter('webx11_frames_encoded_total', 'Captured frames that were encoded', ['display'])
+FRAMES_UNCHANGED = Counter('webx11_frames_unchanged_total', 'Captured frames skipped as identical to the previous one', ['display'])
+ENCODED_BYTES = Counter('webx11_encoded_bytes_total', 'Bytes of encoded frames, every profile included', ['display'])
+
+# Sending, per client of a display
+CLIENTS = Gauge('webx11_clients', 'Clients receiving frames', ['display'])
+FRAMES_SENT = Counter('webx11_frames_sent_total', 'Frames sent to a client, its achieved fps is the rate of this counter', ['display', 'client'])
+SENT_BYTES = Counter('webx11_sent_bytes_total', 'Bytes sent to a client', ['display', 'client'])
+SEND_SECONDS = Histogram('webx11_send_seconds', 'Time the transport takes to accept a frame', ['display', 'client'])
+SEND_QUEUE = Gauge('webx11_send_queue_depth', 'Updates waiting to be sent to a client', ['display', 'client'])
+CLIENT_FPS = Gauge('webx11_client_fps', 'Frames per second drawn, as reported by the client', ['display', 'client'])
+CLIENT_DECODE_SECONDS = Gauge('webx11_client_decode_seconds', 'Frame decode time, as reported by the client', ['display', 'client'])
+
+# Input, per display
+INPUT_EVENTS = Counter('webx11_input_events_total', 'Input events received from the clients', ['display', 'type'])
+INPUT_SECONDS = Histogram('webx11_input_latency_seconds', 'Time between receiving input events and sending them to the X server', ['display'])
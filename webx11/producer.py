@@ -0,0 +1,287 @@
+import asyncio
+import concurrent.futures
+from webx11.settings import get_settings
+from webx11.quality import QualityController
+from webx11.tiles import is_keyframe, unpack_tiles, merge_tiles, pack_tiles
+from webx11.video import is_video_chunk, is_video_keyframe
+from webx11 import metrics
+from webx11.log import get_logger
+
+logger = get_logger('frames')
+
+
+class FramePacer:
+    """Deadline based frame pacing
+
+    Deadlines are spaced by the frame interval whatever the time spent working in-between,
+    so the frame rate does not drift like it does when sleeping a full interval after the work."""
+    def __init__(self, fps=30):
+        self.interval = 1.0 / fps
+        self.deadline = None
+        self.woken = None
+
+    def set_fps(self, fps):
+        self.interval = 1.0 / fps
+
+    async def wait(self):
+        """Wait for the next deadline, returns right away on the first call"""
+        loop = asyncio.get_running_loop()
+        if self.woken is None:
+            self.woken = asyncio.Event()
+        now = loop.time()
+        if self.deadline is None or now - self.deadline > self.interval:
+            # First frame, or too far behind: restart the schedule instead of sending a burst
+            self.deadline = now
+        else:
+            try:
+                await asyncio.wait_for(self.woken.wait(), self.deadline - now)
+                self.deadline = loop.time()
+            except asyncio.TimeoutError:
+                pass
+        self.woken.clear()
+        self.deadline += self.interval
+
+    def wake(self):
+        """Skip the current wait, e.g. to send the first frame of a new client right away"""
+        if self.woken is not None:
+            self.woken.set()
+
+
+class FrameOutbox:
+    """One-slot outbox of a single client, sending from its own task
+
+    A new full frame replaces whatever is still waiting. Tile updates can not be dropped,
+    so a new one is merged into the waiting update instead. A slow client thus only ever
+    gets the latest state of the screen, and its memory use stays bounded.
+    Its quality controller picks the profile frames are encoded with, and the client's fps.
+    Video chunks can neither be dropped nor merged, they are queued up to max_pending_chunks."""
+    max_pending_tiles = 1024
+    max_pending_chunks = 30
+
+    def __init__(self, send, request_keyframe, labels=()):
+        self.send = send
+        self.request_keyframe = request_keyframe
+        self.labels = labels  # (display, client) of the metrics
+        self.controller = QualityController(get_settings())
+        self.send_time = 0  # Moving average of the time the transport takes to accept a frame
+        self.last_sent = 0
+        self.keyframe = None
+        self.tiles = None  # (width, height, tiles) merged since the last send
+        self.tile_message = None  # Packed update, while there is nothing to merge it with
+        self.chunks = []
+        # Tile updates are meaningless to a client which did not get a full frame yet
+        self.awaiting_keyframe = True
+        self.ready = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self.run())
+
+    def put(self, frame):
+        if is_video_chunk(frame):
+            self.put_chunk(frame)
+        elif is_keyframe(frame):
+            self.keyframe = frame
+            self.tiles = self.tile_message = None
+            self.awaiting_keyframe = False
+        elif self.awaiting_keyframe:
+            return
+        elif self.tiles is None and self.tile_message is None:
+            self.tile_message = frame
+        else:
+            self.merge(frame)
+        metrics.SEND_QUEUE.labels(*self.labels).set(self.pending())
+        self.ready.set()
+
+    def put_chunk(self, chunk):
+        if is_video_keyframe(chunk):
+            # Decoding restarts from a keyframe, whatever is still waiting is useless
+            self.chunks = [chunk]
+            self.awaiting_keyframe = False
+        elif self.awaiting_keyframe:
+            return
+        elif len(self.chunks) >= self.max_pending_chunks:
+            # Too far behind, the client would decode garbage after a dropped chunk
+            self.chunks = []
+            self.awaiting_keyframe = True
+            self.request_keyframe()
+            return
+        else:
+            self.chunks.append(chunk)
+        metrics.SEND_QUEUE.labels(*self.labels).set(self.pending())
+        self.ready.set()
+
+    def merge(self, frame):
+        if self.tile_message is not None:
+            self.tiles = unpack_tiles(self.tile_message)
+            self.tile_message = None
+        width, height, tiles = self.tiles
+        new_width, new_height, new_tiles = unpack_tiles(frame)
+        tiles = merge_tiles(tiles, new_tiles)
+        if (new_width, new_height) != (width, height) or len(tiles) > self.max_pending_tiles:
+            # Too far behind, the client catches up with the next full frame instead
+            self.tiles = None
+            self.awaiting_keyframe = True
+            self.request_keyframe()
+            return
+        self.tiles = (width, height, tiles)
+
+    def pending(self):
+        """Number of updates waiting to be sent: a full frame, a tile update, and up to max_pending_chunks video chunks"""
+        return int(self.keyframe is not None) + int(self.tiles is not None or self.tile_message is not None) \
+            + len(self.chunks)
+
+    def report(self, stats):
+        """Feed a client report to the quality controller"""
+        if isinstance(stats.get('fps'), (int, float)):
+            metrics.CLIENT_FPS.labels(*self.labels).set(stats['fps'])
+        if isinstance(stats.get('decode'), (int, float)):
+            metrics.CLIENT_DECODE_SECONDS.labels(*self.labels).set(stats['decode'] / 1000)
+        if self.controller.update(stats, self.send_time, self.loop.time()) > 0:
+            # What is on the client's screen was sent with a lower quality
+            self.request_keyframe()
+
+    async def timed_send(self, frame):
+        start = self.loop.time()
+        await self.send(frame)
+        self.last_sent = self.loop.time()
+        self.send_time = 0.8 * self.send_time + 0.2 * (self.last_sent - start)
+        metrics.SEND_SECONDS.labels(*self.labels).observe(self.last_sent - start)
+        metrics.FRAMES_SENT.labels(*self.labels).inc()
+        metrics.SENT_BYTES.labels(*self.labels).inc(len(frame))
+        metrics.SEND_QUEUE.labels(*self.labels).set(self.pending())
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            if self.controller.fps < self.controller.levels[0][2]:
+                # Below the producer's fps, frames keep merging into the slot in the meantime
+                delay = self.last_sent + 1 / self.controller.fps - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.ready.clear()
+            keyframe, self.keyframe = self.keyframe, None
+            if keyframe is not None:
+                await self.timed_send(keyframe)
+            if self.tiles is not None:
+                width, height, tiles = self.tiles
+                self.tile_message = pack_tiles(width, height, tiles)
+                self.tiles = None
+            tile_message, self.tile_message = self.tile_message, None
+            if tile_message is not None:
+                # send() only returns once the transport accepted the data, frames coming
+                # in the meantime are merged into the slot
+                await self.timed_send(tile_message)
+            while self.chunks:
+                await self.timed_send(self.chunks.pop(0))
+
+    def close(self):
+        self.task.cancel()
+
+
+class FrameProducer:
+    """Capture and encode a display once per tick, then publish the frame to every subscriber
+
+    The outboxes are only ever touched from the event loop, stop() hands the teardown over to it
+    when a display is stopped from a job thread."""
+    stop_timeout = 5
+
+    def __init__(self, window_display, fps=30):
+        self.window_display = window_display
+        self.pacer = FramePacer(fps)
+        self.outboxes = {}
+        self.loop = None  # Known once the first client subscribes
+        self.task = None
+        self.force = False
+        self.next_client = 1  # Only identifies the clients in the metrics
+
+    def subscribe(self, callback):
+        """Register an async callback receiving every frame, the first one being a full frame"""
+        self.loop = asyncio.get_running_loop()
+        labels = (self.window_display.display_id, self.next_client)
+        self.next_client += 1
+        self.outboxes[callback] = FrameOutbox(callback, self.request_keyframe, labels)
+        metrics.CLIENTS.labels(self.window_display.display_id).set(len(self.outboxes))
+        self.request_keyframe()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        else:
+            self.pacer.wake()
+
+    def unsubscribe(self, callback):
+        outbox = self.outboxes.pop(callback, None)
+        if outbox is not None:
+            outbox.close()
+            metrics.forget(display=outbox.labels[0], client=outbox.labels[1])
+            metrics.CLIENTS.labels(self.window_display.display_id).set(len(self.outboxes))
+
+    def request_keyframe(self):
+        """Make the next capture a full frame, e.g. for a new client or one that lost track"""
+        self.force = True
+
+    def report_stats(self, callback, stats):
+        """Feedback of the client receiving frames through callback"""
+        outbox = self.outboxes.get(callback)
+        if outbox is not None:
+            outbox.report(stats)
+
+    def apply_settings(self, settings):
+        """Use the reloaded fps and quality from the next frame on"""
+        self.pacer.set_fps(settings.fps)
+        for outbox in self.outboxes.values():
+            outbox.controller.apply_settings(settings)
+        # Re-encode the whole screen with the new quality
+        self.request_keyframe()
+
+    def profiles(self):
+        """The (quality, scale) profiles the subscribers currently need"""
+        return tuple(sorted({outbox.controller.profile for outbox in self.outboxes.values()}, reverse=True))
+
+    async def run(self):
+        # Only runs while somebody is watching, and stops with the display
+        while True:
+            await self.pacer.wait()
+            if not self.outboxes or not self.window_display.is_running:
+                break
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error("Error producing frame for display %s: %s", self.window_display.display_id, e)
+        self.task = None
+
+    async def tick(self):
+        force, self.force = self.force, False
+        # Captured and encoded on the capture pool, the event loop keeps serving inputs and sends
+        frames = await self.window_display.capture_window_async(force=force, profiles=self.profiles())
+        if frames:
+            # Subscribers sharing a profile get the same encoded frame, a slow one never delays the others
+            for outbox in list(self.outboxes.values()):
+                frame = frames.get(outbox.controller.profile)
+                if frame is None:
+                    # Profile changed during the capture. Every profile covers the same
+                    # tiles, any of them keeps the client in sync until the next frame
+                    frame = next(iter(frames.values()))
+                outbox.put(frame)
+
+    def stop(self):
+        """Drop every subscriber, waits for the event loop to do it when called from another thread"""
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop or self.loop is None or not self.loop.is_running():
+            self.unsubscribe_all()
+            return
+        done = concurrent.futures.Future()
+
+        def unsubscribe_all():
+            try:
+                self.unsubscribe_all()
+                done.set_result(None)
+            except Exception as e:
+                done.set_exception(e)
+        self.loop.call_soon_threadsafe(unsubscribe_all)
+        done.result(self.stop_timeout)
+
+    def unsubscribe_all(self):
+        for callback in list(self.outboxes):
+            self.unsubscribe(callback)
+
@@ -0,0 +1,88 @@
+from webx11.log import get_logger, fields
+
+logger = get_logger('quality')
+
+
+def quality_levels(settings):
+    """Quality levels, from the configured quality down to a small, blurry, but fluid stream
+    Each level is a (quality, scale, fps) tuple. Levels are the same for every client,
+    so the frame producer only encodes each frame once per level in use."""
+    quality, fps = settings.image_quality, settings.fps
+    return [
+        (quality, 1.0, fps),
+        (max(20, quality - 20), 1.0, fps),
+        (max(20, quality - 35), 0.75, max(1, fps * 2 // 3)),
+        (max(20, quality - 45), 0.5, max(1, fps // 2)),
+    ]
+
+
+class QualityController:
+    """Pick the quality level of a single client from its feedback
+
+    The client reports its frame latency, decode time and backlog about every second.
+    Frame timestamps come from the server clock, so only the latency above the lowest one
+    seen is used: the time frames spend waiting in queues, whatever the clock offset."""
+    hold = 2.0  # Seconds between two level changes
+    upgrade_after = 5.0  # Seconds of low latency before going up a level
+
+    def __init__(self, settings):
+        self.level = 0
+        self.min_latency = None
+        self.last_change = 0
+        self.calm_since = None
+        self.apply_settings(settings)
+
+    def apply_settings(self, settings):
+        # A video stream can not skip frames, and is encoded once for every client
+        self.enabled = settings.adaptive_quality and settings.video_codec == 'none'
+        self.levels = quality_levels(settings)
+        self.target_latency = settings.target_latency / 1000
+        if not self.enabled:
+            self.level = 0
+
+    @property
+    def profile(self):
+        """The (quality, scale) pair frames are encoded with for this client"""
+        quality, scale, _ = self.levels[self.level]
+        return quality, scale
+
+    @property
+    def fps(self):
+        return self.levels[self.level][2]
+
+    def update(self, stats, send_time, now):
+        """Update the level from a client report and the time the server takes to send a frame.
+        Returns 1 when the level went up (better quality), -1 when it went down, 0 otherwise"""
+        if not self.enabled:
+            return 0
+        delay = send_time
+        latency = stats.get('latency')
+        if isinstance(latency, (int, float)):
+            latency = latency / 1000
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            delay = max(delay, latency - self.min_latency)
+        decode_time = stats.get('decode') or 0
+        queued = stats.get('queued') or 0
+
+        overloaded = delay > self.target_latency or decode_time / 1000 > 1 / self.fps or queued > 2
+        if overloaded:
+            self.calm_since = None
+            if self.level < len(self.levels) - 1 and now - self.last_change > self.hold:
+                return self.change(1, now)
+        elif delay < self.target_latency / 2:
+            if self.calm_since is None:
+                self.calm_since = now
+            elif self.level > 0 and now - self.calm_since > self.upgrade_after and now - self.last_change > self.hold:
+                self.calm_since = now
+                return self.change(-1, now)
+        else:
+            self.calm_since = None
+        return 0
+
+    def change(self, step, now):
+        self.level += step
+        self.last_change = now
+        quality, scale, fps = self.levels[self.level]
+        logger.info("Adaptive quality level changed", extra=fields(level=self.level, quality=quality, scale=scale, fps=fps))
+        return -step
@@ -5,26 +5,20 @@ Main X11 Web Display Server with HTTP API and WebTransport
 
 import sys
 import atexit
+import signal
 import asyncio
 import subprocess
 from sys import argv
-from http.server import HTTPServer
-from socketserver import ThreadingMixIn
 from webx11.api_handler import APIHandler
+from webx11.http_server import run_http_server
 from webx11.display import DisplayManager
-from webx11.settings import SettingsManager
+from webx11.settings import get_settings, reload_settings, watch_settings
+from webx11.log import setup_logging
 from webx11 import websockets
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Handle requests in separate threads"""
-    def __init__(self, display_manager, *args, **kwargs):
-        self.display_manager = display_manager
-        super().__init__(*args, **kwargs)
-
-def cleanup(display_manager, websocket_handler):
+def cleanup(display_manager):
     """Cleanup function to stop all window displays on exit"""
     print("\nCleaning up...")
-    websocket_handler.stop_window_broadcast()
     display_manager.stop_all()
 
 
@@ -44,7 +38,8 @@ async def main_async():
     print("=" * 50)
     
     # Parsing settings
-    settings = SettingsManager()
+    settings = get_settings()
+    setup_logging(settings)
 
     HOST = settings.host
     WEBTRANSPORT_HOST = settings.webtransport_host
@@ -68,11 +63,10 @@ async def main_async():
     if settings.transport == 'webtransport':
         webtransport_server = await webtransport.run_webtransport_server(display_manager, WEBTRANSPORT_HOST, WEBTRANSPORT_PORT)
 
-    # Start window broadcast
-    websocket_handler.start_window_broadcast(interval=round(1.0/settings.fps, 2))
+    # Frames are captured by each display's frame producer while it has clients
 
     # Register cleanup function
-    atexit.register(lambda: cleanup(display_manager, websocket_handler))
+    atexit.register(lambda: cleanup(display_manager))
     
     print(f"✅ X11 Web Display Server with HTTP API started!")
     print(f"🌐 HTTP interface: http://{HOST}:{HTTP_PORT}")
@@ -88,22 +82,20 @@ async def main_async():
     print("\nPress Ctrl+C to stop the server")
     print("=" * 50)
     
-    # Create and start HTTP server
-    # TODO replace the current HTTP server with something more robust using jinja2 templates
-    http_server = ThreadedHTTPServer(display_manager, (HOST, HTTP_PORT), handler_factory(display_manager))
-    
-    # Run HTTP server in a separated thread
-    import threading
-    http_thread = threading.Thread(target=http_server.serve_forever)
-    http_thread.daemon = True
-    http_thread.start()
+    # The HTTP API is served from the event loop, slow display operations run as jobs
+    http_server = await run_http_server(handler_factory(display_manager), HOST, HTTP_PORT)
+
+    # settings.json is reloaded when modified, or on SIGHUP, and applied to the running displays
+    settings_watcher = asyncio.create_task(watch_settings())
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
 
     # If a parameter is passed, the executable is started
     process = None
     if len(sys.argv) > 1:
-        # Creating the display
-        display = display_manager.create_display(settings.max_width, settings.max_height)
-        process = display_manager.start_executable(display.display_id, argv[1])
+        # Creating the display, off the event loop which is already serving clients
+        loop = asyncio.get_running_loop()
+        display = await loop.run_in_executor(None, display_manager.create_display, settings.max_width, settings.max_height)
+        process = await loop.run_in_executor(None, display_manager.start_executable, display.display_id, argv[1])
 
     # Start the main loop
     try:
@@ -116,7 +108,9 @@ async def main_async():
         websocket_server.close()
         await websocket_server.wait_closed()
         # TODO: Make sure that the webtransport server is closed too
-        http_server.shutdown()
+        # Not waiting for idle keep-alive connections to time out
+        http_server.close()
+        settings_watcher.cancel()
         display_manager.stop_all()
 
 def main():
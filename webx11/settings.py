@@ -1,17 +1,24 @@
 import json
 import os
+import asyncio
+import threading
+import logging
+
+# Not through webx11.log, which itself depends on the settings
+logger = logging.getLogger('webx11.settings')
 
 class SettingsManager:
+    """A snapshot of settings.json, use get_settings() for the current one instead of loading it again"""
     def __init__(self, filename='settings.json'):
         self.settings_file = filename
         if os.path.isfile(filename):
-            with open(filename) as f:
-                self.settings = json.load(f)
+            self.path = filename
         else:
             module_dir = os.path.dirname(os.path.abspath(__file__))
-            settings = os.path.join(module_dir, "settings.json")
-            with open(settings) as f:
-                self.settings = json.load(f)
+            self.path = os.path.join(module_dir, "settings.json")
+        self.mtime = os.stat(self.path).st_mtime
+        with open(self.path) as f:
+            self.settings = json.load(f)
         self.check_settings()
 
     def check_settings(self):
@@ -33,9 +40,73 @@ class SettingsManager:
             self.max_width = self.settings.get('max_width')
         if isinstance(self.settings.get('max_height'), int):
             self.max_height = self.settings.get('max_height')
+        # Either poll (capture at max_fps) or damage (only capture when the
+        #       X DAMAGE extension reports that something was drawn)
+        if self.settings.get('capture_mode') in ['poll', 'damage']:
+            self.capture_mode = self.settings.get('capture_mode')
+        else:
+            self.capture_mode = 'poll'
+        # Either xlib (GetImage requests over the X socket), shm (MIT-SHM)
+        #       or fbdir (memory-mapped Xvfb framebuffer), both falling back to xlib
+        if self.settings.get('capture_backend') in ['xlib', 'shm', 'fbdir']:
+            self.capture_backend = self.settings.get('capture_backend')
+        else:
+            self.capture_backend = 'xlib'
+        # Where frames are captured and encoded: thread (shared thread pool) or process (worker processes)
+        if self.settings.get('capture_executor') in ['thread', 'process']:
+            self.capture_executor = self.settings.get('capture_executor')
+        else:
+            self.capture_executor = 'thread'
+        # Number of capture threads/processes, defaults to the number of CPUs
+        if isinstance(self.settings.get('capture_workers'), int) and self.settings.get('capture_workers') > 0:
+            self.capture_workers = self.settings.get('capture_workers')
+        else:
+            self.capture_workers = None
+        # Size of the tiles used for partial frame updates, 0 always sends full frames
+        if isinstance(self.settings.get('tile_size'), int) and self.settings.get('tile_size') >= 16:
+            self.tile_size = self.settings.get('tile_size')
+        else:
+            self.tile_size = 0
         if isinstance(self.settings.get('max_fps'), int):
             self.fps = self.settings.get('max_fps')
             self.max_fps = self.settings.get('max_fps')
+        # Stream frames through a video encoder (h264 or vp8, requires PyAV) instead of
+        #       independent images, none keeps sending images
+        if self.settings.get('video_codec') in ['none', 'h264', 'vp8']:
+            self.video_codec = self.settings.get('video_codec')
+        else:
+            self.video_codec = 'none'
+        # Number of Xvfb displays started ahead of time at max_width x max_height, 0 disables the pool
+        if isinstance(self.settings.get('display_pool_size'), int) and self.settings.get('display_pool_size') >= 0:
+            self.display_pool_size = self.settings.get('display_pool_size')
+        else:
+            self.display_pool_size = 0
+        # Seconds without any display creation after which the pooled displays are stopped
+        if isinstance(self.settings.get('display_pool_idle_timeout'), int) and self.settings.get('display_pool_idle_timeout') > 0:
+            self.display_pool_idle_timeout = self.settings.get('display_pool_idle_timeout')
+        else:
+            self.display_pool_idle_timeout = 300
+        # Adapt the quality, scale and fps of each client to its feedback
+        if isinstance(self.settings.get('adaptive_quality'), bool):
+            self.adaptive_quality = self.settings.get('adaptive_quality')
+        else:
+            self.adaptive_quality = True
+        # Frame latency (ms) the adaptive quality aims for
+        if isinstance(self.settings.get('target_latency'), int) and self.settings.get('target_latency') > 0:
+            self.target_latency = self.settings.get('target_latency')
+        else:
+            self.target_latency = 200
+        # Level of the webx11 loggers: debug, info, warning or error
+        if self.settings.get('log_level') in ['debug', 'info', 'warning', 'error']:
+            self.log_level = self.settings.get('log_level')
+        else:
+            self.log_level = 'info'
+        # Category -> n, only one out of every n debug and info records of the category is logged
+        if isinstance(self.settings.get('log_sampling'), dict):
+            self.log_sampling = {category: rate for category, rate in self.settings.get('log_sampling').items()
+                                 if isinstance(rate, int) and rate >= 1}
+        else:
+            self.log_sampling = {'frames': 30, 'input': 10}
         self.host = self.settings.get('host')
         self.webtransport_host = self.settings.get('webtransport_host')
         self.cors_unsafe_allow_all = self.settings.get('cors_unsafe_allow_all')
@@ -52,6 +123,68 @@ class SettingsManager:
             "resize_mode": self.resize_mode,
             "transport": self.transport,
             "image_format": self.image_format,
+            "video_codec": self.video_codec,
             "max_height": self.max_height,
             "max_width": self.max_width
-        }})
\ No newline at end of file
+        }})
+
+
+_settings = None
+_settings_lock = threading.Lock()
+_settings_listeners = []
+
+
+def get_settings():
+    """The process-wide settings, loaded on first use
+
+    A reload replaces the snapshot as a whole, so a caller keeping one never sees a mix
+    of old and new values. Long-lived objects get the new one through add_settings_listener."""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = SettingsManager()
+    return _settings
+
+
+def add_settings_listener(callback):
+    """Call callback(settings) with every new snapshot"""
+    _settings_listeners.append(callback)
+
+
+def reload_settings():
+    """Load settings.json again, returns True if the settings changed"""
+    global _settings
+    current = get_settings()
+    try:
+        settings = SettingsManager(current.settings_file)
+    except (OSError, ValueError) as e:
+        # Keep running with the current settings, e.g. while the file is being written
+        logger.error("Could not reload the settings: %s", e)
+        return False
+    with _settings_lock:
+        _settings = settings
+    if settings.settings == current.settings:
+        return False
+    logger.info("Settings reloaded")
+    for callback in list(_settings_listeners):
+        try:
+            callback(settings)
+        except Exception as e:
+            logger.exception("Error applying the new settings: %s", e)
+    return True
+
+
+async def watch_settings(interval=2):
+    """Reload the settings whenever settings.json is modified"""
+    seen = get_settings().mtime
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.stat(get_settings().path).st_mtime
+        except OSError:
+            continue
+        if mtime != seen and mtime != get_settings().mtime:
+            # An invalid file is only reported once, until it is modified again
+            reload_settings()
+        seen = mtime
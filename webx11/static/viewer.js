@@ -0,0 +1,1021 @@
+const debounce_timeout = 10;
+
+function debounce(func, timeout = debounce_timeout){
+    let timer;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => { func.apply(this, args); }, timeout);
+    };
+}
+
+const windowId = parseInt(document.body.dataset.display);
+let transport = null;
+let ws = null;
+let datagramWriter = null;
+// Below the usual QUIC datagram payload, when the browser does not tell its maxDatagramSize
+const fallbackDatagramSize = 1000;
+let useWebTransport = false;
+
+// Track composition state for dead keys
+let isComposing = false;
+let lastInputValue = '';
+
+// Touch gesture tracking
+let touchState = {
+    lastTapTime: 0,
+    tapCount: 0,
+    edgeScrollActive: false,
+    edgeScrollStartY: 0,
+    twoFingerScrollActive: false,
+    lastTwoFingerY: 0,
+    touches: new Map()
+};
+
+// Stats
+let stats = {
+    framesReceived: 0,
+    lastFrameTime: Date.now(),
+    fpsHistory: [],
+    showFPS: false
+};
+
+// Feedback sent to the server about every second, to adapt the quality of our frames
+const statsInterval = 1000;
+let feedback = { frames: 0, decodeTime: 0, latency: 0, latencySamples: 0 };
+
+// OPTIMIZATION: Frame processing state
+// Updates are applied in order: tile updates can not be dropped, full frames supersede anything queued before them
+let frameQueue = [];
+let isProcessingFrame = false;
+let currentBlobURL = null;
+let fpsUpdateTimer = null;
+const maxQueuedFrames = 30;
+
+// Partial frame updates, see webx11/tiles.py
+const tileMagic = [0x57, 0x58, 0x54, 0x31]; // WXT1
+const tileHeaderSize = 11;
+const tileEntrySize = 12;
+const tileKeyframeFlag = 0x01;
+
+// Video chunks, see webx11/video.py
+const videoMagic = [0x57, 0x58, 0x56, 0x31]; // WXV1
+const videoHeaderSize = 13;
+const videoKeyframeFlag = 0x01;
+const videoCodecs = { h264: 'avc1.42E033', vp8: 'vp8' };
+let videoDecoder = null;
+let videoSize = null;
+let awaitingVideoKeyframe = true;
+
+// WebTransport frames come on separate streams which may complete out of order
+// null after a frame was lost: the order starts over with the next frame to arrive
+let nextFrameId = 1;
+let outOfOrderFrames = new Map();
+
+// Get canvas and context once
+const canvas = document.getElementById('windowImage');
+const ctx = canvas.getContext('2d', { 
+    alpha: false,
+    desynchronized: true // Hint for better performance
+});
+
+// FPS counter update - OPTIMIZED: Batched updates
+function updateFPSCounter() {
+    if (!stats.showFPS) return;
+    
+    // Update at most once per 200ms
+    if (!fpsUpdateTimer) {
+        fpsUpdateTimer = setTimeout(() => {
+            fpsUpdateTimer = null;
+            const now = Date.now();
+            const oneSecondAgo = now - 1000;
+            stats.fpsHistory = stats.fpsHistory.filter(time => time > oneSecondAgo);
+            const fps = stats.fpsHistory.length;
+            const fpsEl = document.getElementById('fpsCounter');
+            fpsEl.textContent = `FPS: ${fps.toFixed(1)}`;
+        }, 200);
+    }
+}
+
+// Toggle FPS counter with F3
+document.addEventListener('keydown', (e) => {
+    if (e.key === 'F3') {
+        e.preventDefault();
+        stats.showFPS = !stats.showFPS;
+        const fpsEl = document.getElementById('fpsCounter');
+        const statusEl = document.getElementById('connectionStatus')
+        fpsEl.style.display = stats.showFPS ? 'block' : 'none';
+        statusEl.style.display = stats.showFPS ? 'block' : 'none'
+        if (stats.showFPS) {
+            stats.fpsHistory = [];
+        }
+        return;
+    }
+}, true);
+
+// Try WebTransport first, fallback to WebSocket
+async function connectWebTransport() {
+    if (!window.WebTransport) {
+        console.log('WebTransport not supported, falling back to WebSocket');
+        await connectWebSocket();
+        return;
+    }
+    
+    try {
+        const hostname = window.location.hostname || 'localhost';
+        const wtUrl = `https://${hostname}:4433/wt/${windowId}`;
+        let connected = false;
+        transport = new WebTransport(wtUrl);
+
+        setTimeout(() => {
+            if (!connected) {
+                console.log('Falling back to WebSocket');
+                connectWebSocket();
+                throw new Error('WebTransport:: TimeoutError');
+            }
+        }, 2000);
+        
+        await transport.ready;
+        connected = true;
+        useWebTransport = true;
+        updateStatus('webtransport');
+        console.log('WebTransport connected');
+        
+        datagramWriter = transport.datagrams.writable.getWriter();
+        
+        // Handle incoming datagrams (control messages only)
+        handleIncomingDatagrams();
+        
+        // Handle incoming streams (frame data)
+        handleIncomingStreams();
+        
+        transport.closed.then(() => {
+            console.log('WebTransport closed');
+            useWebTransport = false;
+            updateStatus('disconnected');
+        }).catch(err => {
+            console.error('WebTransport error:', err);
+            useWebTransport = false;
+            updateStatus('disconnected');
+        });
+        
+    } catch (error) {
+        console.error('WebTransport connection failed:', error);
+    }
+}
+
+async function serverSync(settings) {
+    console.log('Settings :: ', window.settings)
+    resize()
+    clearInterval(window.setupInterval)
+}
+
+const resize = debounce(() => {
+    if (window.settings.resize_mode == 'resize-x11') {
+        sendMessage({
+            type: 'resize',
+            width: document.documentElement.clientWidth,
+            height: document.documentElement.clientHeight 
+        });
+    }
+}, 100)
+
+async function handleIncomingDatagrams() {
+    try {
+        const reader = transport.datagrams.readable.getReader();
+        console.log('Started listening for datagrams (control messages)...');
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            
+            if (done) break;
+            
+            handleControlMessage(value);
+        }
+    } catch (error) {
+        console.error('Error reading datagrams:', error);
+    }
+}
+
+async function handleIncomingStreams() {
+    try {
+        const reader = transport.incomingUnidirectionalStreams.getReader();
+        console.log('Started listening for streams (frame data)...');
+        
+        while (true) {
+            const { value: stream, done } = await reader.read();
+            
+            if (done) break;
+            
+            // Handle each stream in parallel
+            handleFrameStream(stream);
+        }
+    } catch (error) {
+        console.error('Error reading streams:', error);
+    }
+}
+
+async function handleFrameStream(stream) {
+    try {
+        const reader = stream.getReader();
+        const chunks = [];
+        let totalLength = 0;
+        
+        // Read all chunks from the stream
+        while (true) {
+            const { value, done } = await reader.read();
+            
+            if (done) break;
+            
+            chunks.push(value);
+            totalLength += value.length;
+        }
+        
+        // Combine all chunks
+        const fullData = new Uint8Array(totalLength);
+        let offset = 0;
+        for (const chunk of chunks) {
+            fullData.set(chunk, offset);
+            offset += chunk.length;
+        }
+        
+        // Parse header (14 bytes)
+        const view = new DataView(fullData.buffer, fullData.byteOffset, fullData.byteLength);
+        const frameId = view.getUint16(0);
+        const dataSize = view.getUint32(2);
+        const timestamp = Number(view.getBigUint64(6));
+        
+        // Extract frame data
+        const frameData = fullData.slice(14, 14 + dataSize);
+        
+        // Display frames in the order they were sent
+        if (nextFrameId === null) {
+            nextFrameId = frameId;
+        } else if ((frameId - nextFrameId + 65536) % 65536 >= 32768) {
+            return; // Sent before a lost frame we already gave up on
+        }
+        outOfOrderFrames.set(frameId, { frameData, timestamp });
+        if (outOfOrderFrames.size > maxQueuedFrames) {
+            // A frame went missing
+            frameLost();
+            return;
+        }
+        while (outOfOrderFrames.has(nextFrameId)) {
+            const frame = outOfOrderFrames.get(nextFrameId);
+            outOfOrderFrames.delete(nextFrameId);
+            displayFrame(frame.frameData, nextFrameId, frame.timestamp);
+            nextFrameId = (nextFrameId + 1) % 65536;
+        }
+        
+    } catch (error) {
+        // Closed or reset stream, its frame will never arrive
+        console.error('Error handling frame stream:', error);
+        frameLost();
+    }
+}
+
+// The next video chunks and tiles refer to a frame we did not get, start over from a full frame
+function frameLost() {
+    outOfOrderFrames.clear();
+    nextFrameId = null;
+    awaitingVideoKeyframe = true;
+    requestFullFrame();
+}
+
+function displayFrame(frameData, frameId, timestamp) {
+    try {
+        stats.framesReceived++;
+        
+        const now = Date.now();
+        const latency = now - timestamp;
+        feedback.latency += latency;
+        feedback.latencySamples++;
+        const timeSinceLastFrame = now - stats.lastFrameTime;
+        stats.lastFrameTime = now;
+        
+        // Add to FPS history
+        stats.fpsHistory.push(now);
+        updateFPSCounter();
+        
+        // OPTIMIZATION: Only log every 100 frames
+        if (stats.framesReceived % 100 === 0) {
+            console.log(`Frame ${frameId}: ${frameData.length} bytes, latency: ${latency}ms, delta: ${timeSinceLastFrame}ms`);
+        }
+        
+        queueFrame(frameData);
+        
+    } catch (error) {
+        console.error('Error displaying frame:', error);
+    }
+}
+
+function handleControlMessage(data) {
+    try {
+        const message = JSON.parse(new TextDecoder().decode(data));
+        console.log('Control message:', message);
+    } catch (e) {
+        console.error('Error parsing control message:', e);
+    }
+}
+
+async function setup() {
+    const request = await fetch("/settings.json")
+    let response = await request.json()
+    window.settings = response.settings
+    if (window.settings && window.settings.transport == 'webtransport') {
+        connectWebTransport()
+    } else {
+        console.log(window.settings, window.settings.transport)
+        connectWebSocket()
+    }
+}
+
+function isTileUpdate(data) {
+    return data.length >= tileHeaderSize && tileMagic.every((byte, i) => data[i] === byte);
+}
+
+function parseFrame(data) {
+    const imageType = 'image/' + window.settings.image_format;
+    if (!isTileUpdate(data)) {
+        return { keyframe: true, blob: new Blob([data], { type: imageType }) };
+    }
+    const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+    const flags = view.getUint8(4);
+    const width = view.getUint16(5);
+    const height = view.getUint16(7);
+    const count = view.getUint16(9);
+    const tiles = [];
+    let offset = tileHeaderSize + count * tileEntrySize;
+    for (let i = 0; i < count; i++) {
+        const entry = tileHeaderSize + i * tileEntrySize;
+        const length = view.getUint32(entry + 8);
+        tiles.push({
+            x: view.getUint16(entry),
+            y: view.getUint16(entry + 2),
+            width: view.getUint16(entry + 4),
+            height: view.getUint16(entry + 6),
+            blob: new Blob([data.subarray(offset, offset + length)], { type: imageType })
+        });
+        offset += length;
+    }
+    // Keyframe updates cover the whole frame, e.g. a scaled down full frame
+    return { keyframe: (flags & tileKeyframeFlag) !== 0, width, height, tiles };
+}
+
+function isVideoChunk(data) {
+    return data.length >= videoHeaderSize && videoMagic.every((byte, i) => data[i] === byte);
+}
+
+function resetVideoDecoder() {
+    if (videoDecoder && videoDecoder.state !== 'closed') {
+        videoDecoder.close();
+    }
+    videoDecoder = null;
+    awaitingVideoKeyframe = true;
+}
+
+function createVideoDecoder(width, height) {
+    const decoder = new VideoDecoder({
+        output: (frame) => {
+            if (canvas.width !== videoSize.width || canvas.height !== videoSize.height) {
+                canvas.width = videoSize.width;
+                canvas.height = videoSize.height;
+            }
+            ctx.drawImage(frame, 0, 0);
+            frame.close();
+            feedback.frames++;
+        },
+        error: (error) => {
+            // Lost or corrupted chunk: start again from a new keyframe
+            console.error('Video decoding error:', error);
+            resetVideoDecoder();
+            requestFullFrame();
+        }
+    });
+    decoder.configure({
+        codec: videoCodecs[window.settings.video_codec],
+        codedWidth: width - width % 2,
+        codedHeight: height - height % 2,
+        optimizeForLatency: true
+    });
+    return decoder;
+}
+
+// Video chunks bypass the frame queue, the decoder keeps them in order by itself
+function decodeVideoChunk(data) {
+    if (!('VideoDecoder' in window)) {
+        console.error('Video streaming requires WebCodecs support');
+        return;
+    }
+    const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+    const keyframe = (view.getUint8(4) & videoKeyframeFlag) !== 0;
+    const width = view.getUint16(5);
+    const height = view.getUint16(7);
+    const number = view.getUint32(9);
+    if (!keyframe && awaitingVideoKeyframe) {
+        return; // The server sends one on connect and when we ask for it
+    }
+    if (keyframe && (!videoDecoder || !videoSize || videoSize.width !== width || videoSize.height !== height)) {
+        resetVideoDecoder();
+        videoSize = { width, height };
+        videoDecoder = createVideoDecoder(width, height);
+    }
+    awaitingVideoKeyframe = false;
+    videoDecoder.decode(new EncodedVideoChunk({
+        type: keyframe ? 'key' : 'delta',
+        timestamp: number * 1000,
+        data: data.subarray(videoHeaderSize)
+    }));
+}
+
+function queueFrame(data) {
+    if (isVideoChunk(data)) {
+        decodeVideoChunk(data);
+        return;
+    }
+    const update = parseFrame(data);
+    if (update.keyframe) {
+        frameQueue = [];
+    } else if (frameQueue.length >= maxQueuedFrames) {
+        // We are too far behind to catch up with partial updates
+        frameQueue = [];
+        requestFullFrame();
+        return;
+    }
+    frameQueue.push(update);
+    if (!isProcessingFrame) {
+        processNextFrame();
+    }
+}
+
+function sendFeedback() {
+    const report = {
+        type: 'stats',
+        fps: feedback.frames * 1000 / statsInterval,
+        decode: feedback.frames ? feedback.decodeTime / feedback.frames : 0,
+        queued: frameQueue.length
+    };
+    // Only WebTransport frames carry the server timestamp
+    if (feedback.latencySamples) {
+        report.latency = feedback.latency / feedback.latencySamples;
+    }
+    feedback = { frames: 0, decodeTime: 0, latency: 0, latencySamples: 0 };
+    sendMessage(report);
+}
+
+function requestFullFrame() {
+    sendMessage({ type: 'refresh' });
+}
+
+// OPTIMIZATION: Frame processing with createImageBitmap
+async function processNextFrame() {
+    if (frameQueue.length === 0) {
+        isProcessingFrame = false;
+        return;
+    }
+    
+    isProcessingFrame = true;
+    const update = frameQueue.shift();
+    const decodeStart = performance.now();
+    
+    try {
+        if (update.keyframe && !update.tiles) {
+            // Use createImageBitmap for faster decoding
+            const bitmap = await createImageBitmap(update.blob);
+            
+            // Resize canvas if needed
+            if (canvas.width !== bitmap.width || canvas.height !== bitmap.height) {
+                canvas.width = bitmap.width;
+                canvas.height = bitmap.height;
+            }
+            
+            // Draw bitmap to canvas
+            ctx.drawImage(bitmap, 0, 0);
+            bitmap.close(); // Free memory
+        } else if (!update.keyframe && (canvas.width !== update.width || canvas.height !== update.height)) {
+            // Tiles of a frame we never received, wait for the next full frame
+            frameQueue = frameQueue.filter(queued => queued.keyframe);
+            requestFullFrame();
+        } else {
+            if (update.keyframe && (canvas.width !== update.width || canvas.height !== update.height)) {
+                canvas.width = update.width;
+                canvas.height = update.height;
+            }
+            // Decode every tile in parallel, then composite them onto the existing canvas
+            // Tiles may have been encoded at a lower resolution, they are stretched to their rectangle
+            const bitmaps = await Promise.all(update.tiles.map(tile => createImageBitmap(tile.blob)));
+            bitmaps.forEach((bitmap, i) => {
+                const tile = update.tiles[i];
+                ctx.drawImage(bitmap, tile.x, tile.y, tile.width, tile.height);
+                bitmap.close();
+            });
+        }
+        feedback.frames++;
+        feedback.decodeTime += performance.now() - decodeStart;
+        
+    } catch (error) {
+        console.error('Frame processing error:', error);
+        if (update.keyframe) {
+            // Fallback: use blob URL
+            if (currentBlobURL) {
+                URL.revokeObjectURL(currentBlobURL);
+            }
+            currentBlobURL = URL.createObjectURL(update.blob);
+            // Note: This would need an img element as fallback
+        } else {
+            requestFullFrame();
+        }
+    }
+    
+    // Process next frame if one arrived while we were working
+    if (frameQueue.length > 0) {
+        requestAnimationFrame(processNextFrame);
+    } else {
+        isProcessingFrame = false;
+    }
+}
+
+async function connectWebSocket() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const wsUrl = `${protocol}//${window.location.hostname}:8081/ws/${windowId}`;
+    let numFrames = 0;
+    let lastDelta = Date.now();
+
+    ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
+    
+    ws.onopen = () => {
+        useWebTransport = false;
+        updateStatus('websocket');
+        console.log('WebSocket connected');
+        numFrames = 0;
+        lastDelta = Date.now();
+    };
+    
+    ws.onmessage = (event) => {
+        // OPTIMIZATION: Skip if we're already processing a frame
+        if (event.data instanceof ArrayBuffer) {
+            numFrames += 1;
+            
+            // Queue the update, full frames discard older unprocessed ones
+            queueFrame(new Uint8Array(event.data));
+            
+            stats.framesReceived++;
+            stats.fpsHistory.push(Date.now());
+            updateFPSCounter();
+            
+            // OPTIMIZATION: Only log every 100 frames
+            if (numFrames % 100 === 0) {
+                console.log(`===== frame ${numFrames} =====`);
+                console.log('clientdelta', (Date.now() - lastDelta) / 1000);
+            }
+            lastDelta = Date.now();
+        } else {
+            // It's a JSON message
+            const data = JSON.parse(event.data);
+            if (data.settings) {
+                serverSync(data.settings)
+            }
+        }
+    };
+    
+    ws.onclose = () => {
+        updateStatus('reconnecting');
+        setTimeout(connectWebSocket, 5000);
+    };
+    
+    ws.onerror = (error) => {
+        console.error('WebSocket error:', error);
+    };
+}
+
+function updateStatus(status) {
+    const statusEl = document.getElementById('connectionStatus');
+    statusEl.className = 'connection-status';
+    
+    switch(status) {
+        case 'webtransport':
+            statusEl.classList.add('status-webtransport');
+            statusEl.textContent = 'WebTransport (Streams)';
+            break;
+        case 'websocket':
+            statusEl.classList.add('status-websocket');
+            statusEl.textContent = 'WebSocket';
+            break;
+        case 'disconnected':
+            statusEl.classList.add('status-disconnected');
+            statusEl.textContent = 'Disconnected';
+            break;
+        case 'reconnecting':
+            statusEl.classList.add('status-disconnected');
+            statusEl.textContent = 'Reconnecting';
+            break;
+    }
+}
+
+// Binary input records, see webx11/input_protocol.py
+// Pointer and key events are batched in a few milliseconds window and sent as one message
+const inputVersion = 1;
+const inputHeaderSize = 2;
+const inputRecordSize = 8;
+const maxInputRecords = 128; // Keeps a batch within a single datagram
+const inputBatchDelay = 4;
+const inputRecordTypes = { mousedown: 1, mouseup: 2, mousemove: 3, scroll: 4, keydown: 5, keyup: 6 };
+const namedKeysyms = {
+    'escape': 0xff1b, 'enter': 0xff8d, 'tab': 0xff09, 'backspace': 0xff08, 'delete': 0xff9f,
+    'left': 0xff51, 'right': 0xff53, 'up': 0xff52, 'down': 0xff54,
+    'shift': 0xffe1, 'control': 0xffe3, 'alt': 0xffe9, 'super': 0xffe7, 'space': 0x0020
+};
+let inputBatch = [];
+let inputFlushTimer = null;
+
+function keysymFromKey(key) {
+    if (namedKeysyms[key] !== undefined) return namedKeysyms[key];
+    if (key.match(/^f[1-9]$|^f1[0-2]$/)) return 0xffbe + parseInt(key.substring(1));
+    const code = key.toLowerCase().codePointAt(0);
+    // Latin-1 keysyms are their code point, other characters use the Unicode keysym range
+    return code < 0x100 ? code : 0x01000000 | code;
+}
+
+function encodeInputBatch(events) {
+    const view = new DataView(new ArrayBuffer(inputHeaderSize + events.length * inputRecordSize));
+    view.setUint8(0, inputVersion);
+    view.setUint8(1, events.length);
+    events.forEach((message, i) => {
+        const offset = inputHeaderSize + i * inputRecordSize;
+        view.setUint8(offset, inputRecordTypes[message.type]);
+        if (message.type === 'keydown' || message.type === 'keyup') {
+            view.setUint32(offset + 4, keysymFromKey(message.key));
+            return;
+        }
+        view.setUint8(offset + 1, message.button || 0);
+        view.setUint16(offset + 2, Math.max(0, message.x));
+        view.setUint16(offset + 4, Math.max(0, message.y));
+        if (message.type === 'scroll') {
+            view.setInt16(offset + 6, Math.max(-32768, Math.min(32767, Math.round(message.deltaY))));
+        }
+    });
+    return new Uint8Array(view.buffer);
+}
+
+async function sendRaw(data) {
+    if (useWebTransport && datagramWriter) {
+        try {
+            await datagramWriter.write(data);
+        } catch (error) {
+            console.error('Error sending via WebTransport:', error);
+        }
+    } else if (ws && ws.readyState === WebSocket.OPEN) {
+        await ws.send(data);
+    }
+}
+
+async function sendOnStream(data) {
+    try {
+        const writer = (await transport.createUnidirectionalStream()).getWriter();
+        await writer.write(data);
+        await writer.close();
+    } catch (error) {
+        console.error('Error sending via WebTransport stream:', error);
+    }
+}
+
+async function flushInput() {
+    clearTimeout(inputFlushTimer);
+    inputFlushTimer = null;
+    while (inputBatch.length) {
+        await sendRaw(encodeInputBatch(inputBatch.splice(0, maxInputRecords)));
+    }
+}
+
+async function sendMessage(message) {
+    if (inputRecordTypes[message.type] !== undefined) {
+        inputBatch.push(message);
+        if (inputBatch.length >= maxInputRecords) {
+            await flushInput();
+        } else if (inputFlushTimer === null) {
+            inputFlushTimer = setTimeout(flushInput, inputBatchDelay);
+        }
+        return;
+    }
+    // Everything else stays JSON, sent after the pending input to keep the ordering
+    await flushInput();
+    if (useWebTransport && datagramWriter) {
+        const data = new TextEncoder().encode(JSON.stringify(message));
+        if (data.length > (transport.datagrams.maxDatagramSize || fallbackDatagramSize)) {
+            // A pasted text does not fit in a datagram, which would be dropped: send it on its own stream
+            await sendOnStream(data);
+        } else {
+            await sendRaw(data);
+        }
+    } else {
+        await sendRaw(JSON.stringify(message));
+    }
+}
+
+// Front-end event handling
+addEventListener("resize", resize)
+
+// Hidden input for capturing text with dead keys
+const hiddenInput = document.getElementById('hiddenInput');
+
+// Detect if device is mobile/tablet
+const isMobile = /Android|webOS|iPhone|iPad|iPod|BlackBerry|IEMobile|Opera Mini/i.test(navigator.userAgent) || 
+                 ('ontouchstart' in window);
+
+// Keep focus on hidden input to capture all text (desktop only or after double-tap on mobile)
+if (!isMobile) {
+    document.addEventListener('click', () => {
+        hiddenInput.focus();
+    });
+    hiddenInput.focus();
+}
+
+// Handle text input from hidden field
+hiddenInput.addEventListener('input', (e) => {
+    const newValue = hiddenInput.value;
+    const addedText = newValue.substring(lastInputValue.length);
+    
+    if (addedText) {
+        sendMessage({type: 'text_input', text: addedText});
+    }
+    
+    lastInputValue = newValue;
+    
+    // Clear input periodically to prevent it from getting too long
+    if (newValue.length > 100) {
+        hiddenInput.value = '';
+        lastInputValue = '';
+    }
+});
+
+// Composition events
+hiddenInput.addEventListener('compositionstart', (e) => {
+    isComposing = true;
+});
+
+hiddenInput.addEventListener('compositionend', (e) => {
+    isComposing = false;
+});
+
+// Mouse and keyboard event handling
+canvas.addEventListener('mousedown', (e) => {
+    const rect = e.target.getBoundingClientRect();
+    const scaleX = e.target.width / rect.width;
+    const scaleY = e.target.height / rect.height;
+    const x = Math.round(e.offsetX * scaleX);
+    const y = Math.round(e.offsetY * scaleY);
+    
+    sendMessage({type: 'mousedown', x, y, button: 1});
+});
+
+canvas.addEventListener('mouseup', (e) => {
+    const rect = e.target.getBoundingClientRect();
+    const scaleX = e.target.width / rect.width;
+    const scaleY = e.target.height / rect.height;
+    const x = Math.round(e.offsetX * scaleX);
+    const y = Math.round(e.offsetY * scaleY);
+    sendMessage({type: 'mouseup', x, y, button: 1});
+});
+
+canvas.addEventListener('contextmenu', (e) => {
+    e.preventDefault();
+    const rect = e.target.getBoundingClientRect();
+    const scaleX = e.target.width / rect.width;
+    const scaleY = e.target.height / rect.height;
+    const x = Math.round(e.offsetX * scaleX);
+    const y = Math.round(e.offsetY * scaleY);
+
+    sendMessage({type: 'mousedown', x, y, button: 3});
+});
+
+// OPTIMIZATION: More aggressive debouncing for mouse move
+const onMouseMove = debounce((e) => {
+    const rect = e.target.getBoundingClientRect();
+    const scaleX = e.target.width / rect.width;
+    const scaleY = e.target.height / rect.height;
+    const x = Math.round(e.offsetX * scaleX);
+    const y = Math.round(e.offsetY * scaleY);
+    sendMessage({type: 'mousemove', x, y});
+}, 16); // ~60fps max for mouse moves
+
+canvas.addEventListener('mousemove', onMouseMove);
+
+canvas.addEventListener('wheel', (e) => {
+    const rect = e.target.getBoundingClientRect();
+    const scaleX = e.target.width / rect.width;
+    const scaleY = e.target.height / rect.height;
+    const x = Math.round(e.offsetX * scaleX);
+    const y = Math.round(e.offsetY * scaleY);
+    
+    sendMessage({type: 'scroll', x, y, deltaY: e.deltaY});
+    e.preventDefault();
+}, { passive: false });
+
+// Touch event handlers for gestures
+canvas.addEventListener('touchstart', handleTouchStart, { passive: false });
+canvas.addEventListener('touchmove', handleTouchMove, { passive: false });
+canvas.addEventListener('touchend', handleTouchEnd, { passive: false });
+canvas.addEventListener('touchcancel', handleTouchEnd, { passive: false });
+
+function handleTouchStart(e) {
+    const touches = e.touches;
+    const rect = e.target.getBoundingClientRect();
+    const edgeThreshold = 30; // pixels from right edge
+    
+    // Update touch tracking
+    for (let touch of touches) {
+        touchState.touches.set(touch.identifier, {
+            x: touch.clientX,
+            y: touch.clientY,
+            startX: touch.clientX,
+            startY: touch.clientY
+        });
+    }
+    
+    // Check for double-tap (mobile keyboard activation)
+    if (isMobile && touches.length === 1) {
+        const now = Date.now();
+        const timeSinceLastTap = now - touchState.lastTapTime;
+        
+        if (timeSinceLastTap < 300) {
+            // Double tap detected
+            touchState.tapCount = 2;
+            hiddenInput.focus();
+            console.log('Double-tap: keyboard activated');
+            e.preventDefault();
+            return;
+        } else {
+            touchState.tapCount = 1;
+        }
+        touchState.lastTapTime = now;
+    }
+    
+    // Check for edge scroll (single finger on right edge)
+    if (touches.length === 1) {
+        const touch = touches[0];
+        const distanceFromRightEdge = rect.right - touch.clientX;
+        
+        if (distanceFromRightEdge <= edgeThreshold) {
+            touchState.edgeScrollActive = true;
+            touchState.edgeScrollStartY = touch.clientY;
+            document.getElementById('edgeScrollIndicator').classList.add('active');
+            e.preventDefault();
+            return;
+        }
+    }
+    
+    // Check for two-finger scroll
+    if (touches.length === 2) {
+        touchState.twoFingerScrollActive = true;
+        touchState.lastTwoFingerY = (touches[0].clientY + touches[1].clientY) / 2;
+        e.preventDefault();
+        return;
+    }
+    
+    // Regular mouse down for single touch (not on edge)
+    if (touches.length === 1 && !touchState.edgeScrollActive) {
+        const touch = touches[0];
+        const scaleX = e.target.width / rect.width;
+        const scaleY = e.target.height / rect.height;
+        const x = Math.round((touch.clientX - rect.left) * scaleX);
+        const y = Math.round((touch.clientY - rect.top) * scaleY);
+        
+        sendMessage({type: 'mousedown', x, y, button: 1});
+    }
+}
+
+function handleTouchMove(e) {
+    const touches = e.touches;
+    const rect = e.target.getBoundingClientRect();
+    
+    // Handle edge scroll
+    if (touchState.edgeScrollActive && touches.length === 1) {
+        const touch = touches[0];
+        const deltaY = touch.clientY - touchState.edgeScrollStartY;
+        const scaleX = e.target.width / rect.width;
+        const scaleY = e.target.height / rect.height;
+        const x = Math.round((touch.clientX - rect.left) * scaleX);
+        const y = Math.round((touch.clientY - rect.top) * scaleY);
+        
+        // Send scroll message (converting touch delta to wheel delta)
+        sendMessage({type: 'scroll', x, y, deltaY: -deltaY * 2});
+        touchState.edgeScrollStartY = touch.clientY;
+        e.preventDefault();
+        return;
+    }
+    
+    // Handle two-finger scroll
+    if (touchState.twoFingerScrollActive && touches.length === 2) {
+        const currentY = (touches[0].clientY + touches[1].clientY) / 2;
+        const deltaY = currentY - touchState.lastTwoFingerY;
+        
+        const scaleX = e.target.width / rect.width;
+        const scaleY = e.target.height / rect.height;
+        const centerX = (touches[0].clientX + touches[1].clientX) / 2;
+        const centerY = (touches[0].clientY + touches[1].clientY) / 2;
+        const x = Math.round((centerX - rect.left) * scaleX);
+        const y = Math.round((centerY - rect.top) * scaleY);
+        
+        // Send scroll message (converting touch delta to wheel delta)
+        sendMessage({type: 'scroll', x, y, deltaY: -deltaY * 2});
+        touchState.lastTwoFingerY = currentY;
+        e.preventDefault();
+        return;
+    }
+    
+    // Regular mouse move for single touch
+    if (touches.length === 1 && !touchState.edgeScrollActive && !touchState.twoFingerScrollActive) {
+        const touch = touches[0];
+        const scaleX = e.target.width / rect.width;
+        const scaleY = e.target.height / rect.height;
+        const x = Math.round((touch.clientX - rect.left) * scaleX);
+        const y = Math.round((touch.clientY - rect.top) * scaleY);
+        
+        sendMessage({type: 'mousemove', x, y});
+    }
+}
+
+function handleTouchEnd(e) {
+    const touches = e.touches;
+    const rect = e.target.getBoundingClientRect();
+    
+    // Clean up edge scroll
+    if (touchState.edgeScrollActive) {
+        touchState.edgeScrollActive = false;
+        document.getElementById('edgeScrollIndicator').classList.remove('active');
+    }
+    
+    // Clean up two-finger scroll
+    if (touchState.twoFingerScrollActive && touches.length < 2) {
+        touchState.twoFingerScrollActive = false;
+    }
+    
+    // Update touch tracking
+    const changedTouches = e.changedTouches;
+    for (let touch of changedTouches) {
+        touchState.touches.delete(touch.identifier);
+    }
+    
+    // Send mouse up if all touches are gone
+    if (touches.length === 0 && changedTouches.length > 0) {
+        const touch = changedTouches[0];
+        const scaleX = e.target.width / rect.width;
+        const scaleY = e.target.height / rect.height;
+        const x = Math.round((touch.clientX - rect.left) * scaleX);
+        const y = Math.round((touch.clientY - rect.top) * scaleY);
+        
+        sendMessage({type: 'mouseup', x, y, button: 1});
+    }
+}
+
+// Only send special keys via key events, regular text via input event
+document.addEventListener('keydown', (e) => {
+    if (e.key === 'F3') return; // Already handled above
+    
+    const key = getKeyFromEvent(e);
+    
+    // Only send special keys (not regular text)
+    if (key && !isRegularTextKey(e)) {
+        sendMessage({type: 'keydown', key});
+        e.preventDefault();
+    }
+});
+
+document.addEventListener('keyup', (e) => {
+    if (e.key === 'F3') return;
+    
+    const key = getKeyFromEvent(e);
+    
+    // Only send special keys (not regular text)
+    if (key && !isRegularTextKey(e)) {
+        sendMessage({type: 'keyup', key});
+        e.preventDefault();
+    }
+});
+
+function isRegularTextKey(e) {
+    // Regular text keys should be handled by the input event
+    // Special keys should be sent as key events
+    return e.key.length === 1 && !e.ctrlKey && !e.altKey && !e.metaKey;
+}
+
+function getKeyFromEvent(e) {
+    const specialKeys = {
+        'Escape': 'escape', 'Enter': 'enter', 'Tab': 'tab', 'Backspace': 'backspace',
+        'Delete': 'delete', 'ArrowLeft': 'left', 'ArrowRight': 'right', 
+        'ArrowUp': 'up', 'ArrowDown': 'down', 'Shift': 'shift', 'Control': 'control',
+        'Alt': 'alt', 'Meta': 'super', ' ': 'space'
+    };
+    
+    if (specialKeys[e.key]) return specialKeys[e.key];
+    if (e.key.match(/^F[1-9]$|^F1[0-2]$/)) return e.key.toLowerCase();
+    if (e.key.length === 1) return e.key;
+    return null;
+}
+
+// Start connection
+setup()
+window.setupInterval = setInterval(() => {
+    serverSync()
+}, 2000)
+window.statsInterval = setInterval(sendFeedback, statsInterval)
@@ -0,0 +1,120 @@
+import struct
+from PIL import Image
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    print("Warning: numpy not installed. Tile updates will not be available.")
+
+# Partial frame update, as understood by display.html:
+#   magic (4s) | flags (B) | frame width (H) | frame height (H) | tile count (H)
+#   then for each tile: x (H) | y (H) | width (H) | height (H) | data length (I)
+#   then the encoded tiles, concatenated in the same order
+# Tiles are drawn stretched to their rectangle, so they may be encoded at a lower resolution.
+# With the keyframe flag, the update covers the whole frame and replaces it, e.g. a scaled down full frame
+TILE_MAGIC = b'WXT1'
+TILE_KEYFRAME = 0x01
+TILE_HEADER = struct.Struct('>4sBHHH')
+TILE_ENTRY = struct.Struct('>HHHHI')
+
+
+def pack_tiles(width, height, tiles, flags=0):
+    """Pack a list of encoded (x, y, w, h, data) tiles into a single binary message"""
+    header = [TILE_HEADER.pack(TILE_MAGIC, flags, width, height, len(tiles))]
+    for x, y, w, h, data in tiles:
+        header.append(TILE_ENTRY.pack(x, y, w, h, len(data)))
+    return b''.join(header + [data for _, _, _, _, data in tiles])
+
+
+class TileTracker:
+    """Split the raw framebuffer in fixed size tiles and find the ones that changed"""
+    def __init__(self, tile_size=64, max_dirty_ratio=0.5):
+        self.tile_size = tile_size
+        # Above this ratio of dirty tiles, a single full frame is cheaper to encode and to send
+        self.max_dirty_ratio = max_dirty_ratio
+        self.previous = None
+        self.frame = None
+
+    def reset(self):
+        self.previous = None
+        self.frame = None
+
+    def update(self, buffer, width, height, stride=None, force=False):
+        """Compare a BGRX buffer with the previous one.
+        Returns None when a full frame has to be sent, or the list of dirty (x, y, w, h) rectangles."""
+        stride = stride or width * 4
+        self.frame = np.ndarray((height, width), dtype=np.uint32, buffer=buffer, strides=(stride, 4))
+
+        if force or self.previous is None or self.previous.shape != self.frame.shape:
+            self.previous = self.frame.copy()
+            return None
+
+        size = self.tile_size
+        rows = np.arange(0, height, size)
+        cols = np.arange(0, width, size)
+        # Vectorized compare, then reduce the pixel mask to one boolean per tile
+        changed = self.frame != self.previous
+        dirty = np.logical_or.reduceat(np.logical_or.reduceat(changed, rows, axis=0), cols, axis=1)
+
+        dirty_count = int(dirty.sum())
+        if dirty_count > self.max_dirty_ratio * dirty.size:
+            self.previous[...] = self.frame
+            return None
+
+        rects = []
+        for row, col_mask in enumerate(dirty):
+            if not col_mask.any():
+                continue
+            y = row * size
+            h = min(size, height - y)
+            # Merge horizontal runs of dirty tiles into a single rectangle to reduce encoder calls
+            col = 0
+            while col < len(col_mask):
+                if not col_mask[col]:
+                    col += 1
+                    continue
+                start = col
+                while col < len(col_mask) and col_mask[col]:
+                    col += 1
+                x = start * size
+                w = min(col * size, width) - x
+                self.previous[y:y + h, x:x + w] = self.frame[y:y + h, x:x + w]
+                rects.append((x, y, w, h))
+        return rects
+
+    def tile_image(self, rect):
+        """Return a Pillow image of a rectangle of the current frame"""
+        x, y, w, h = rect
+        tile = np.ascontiguousarray(self.frame[y:y + h, x:x + w])
+        return Image.frombuffer("RGB", (w, h), tile, "raw", "BGRX", 0, 1)
+
+
+def is_tile_update(frame):
+    return frame[:len(TILE_MAGIC)] == TILE_MAGIC
+
+
+def is_keyframe(frame):
+    """Full frames, and tile updates replacing the whole frame"""
+    return not is_tile_update(frame) or bool(frame[4] & TILE_KEYFRAME)
+
+
+def unpack_tiles(message):
+    """Unpack a tile update into its frame size and its list of (x, y, w, h, data) tiles"""
+    _, _, width, height, count = TILE_HEADER.unpack_from(message)
+    tiles = []
+    offset = TILE_HEADER.size + count * TILE_ENTRY.size
+    for i in range(count):
+        x, y, w, h, length = TILE_ENTRY.unpack_from(message, TILE_HEADER.size + i * TILE_ENTRY.size)
+        tiles.append((x, y, w, h, message[offset:offset + length]))
+        offset += length
+    return width, height, tiles
+
+
+def merge_tiles(older, newer):
+    """Merge two lists of tiles, drawn in order: older tiles fully covered by a newer one are dropped"""
+    def covered(tile):
+        x, y, w, h, _ = tile
+        return any(nx <= x and ny <= y and x + w <= nx + nw and y + h <= ny + nh for nx, ny, nw, nh, _ in newer)
+    return [tile for tile in older if not covered(tile)] + newer
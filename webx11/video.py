@@ -0,0 +1,75 @@
+import struct
+from fractions import Fraction
+
+try:
+    import numpy as np
+    import av
+    from av.video.frame import VideoFrame
+    VIDEO_AVAILABLE = True
+except ImportError:
+    VIDEO_AVAILABLE = False
+    print("Warning: PyAV (av) or numpy not installed. Video streaming will not be available.")
+
+# Video chunk, as understood by display.html (decoded with WebCodecs):
+#   magic (4s) | flags (B) | frame width (H) | frame height (H) | chunk number (I)
+#   then the encoded chunk (H.264 Annex B or raw VP8)
+VIDEO_MAGIC = b'WXV1'
+VIDEO_HEADER = struct.Struct('>4sBHHI')
+VIDEO_KEYFRAME = 0x01
+
+# video_codec setting -> (encoder, options)
+VIDEO_ENCODERS = {
+    'h264': ('libx264', {'preset': 'ultrafast', 'tune': 'zerolatency', 'profile': 'baseline'}),
+    'vp8': ('libvpx', {'deadline': 'realtime', 'cpu-used': '8', 'lag-in-frames': '0'}),
+}
+
+
+def is_video_chunk(frame):
+    return frame[:len(VIDEO_MAGIC)] == VIDEO_MAGIC
+
+
+def is_video_keyframe(frame):
+    return bool(frame[4] & VIDEO_KEYFRAME)
+
+
+class VideoEncoder:
+    """Persistent video encoder of a display, fed with raw BGRX frames
+
+    Keyframes are only produced on request (new client, lost chunk, resize), every other
+    frame only encodes what changed since the previous one."""
+    def __init__(self, codec, width, height, fps=30):
+        name, options = VIDEO_ENCODERS[codec]
+        # 4:2:0 needs even dimensions, the last odd row or column is dropped
+        self.width = width
+        self.height = height
+        self.context = av.CodecContext.create(name, 'w')
+        self.context.width = width - width % 2
+        self.context.height = height - height % 2
+        self.context.pix_fmt = 'yuv420p'
+        self.context.time_base = Fraction(1, fps)
+        self.context.framerate = Fraction(fps, 1)
+        self.context.gop_size = 10 * 60 * fps  # Keyframes are requested instead
+        self.context.options = options
+        self.context.open()
+        self.pts = 0
+        self.chunk_number = 0
+
+    def encode(self, pixels, stride, keyframe=False):
+        """Encode a BGRX buffer, returns a video chunk message or None if the encoder did not output anything"""
+        rows = np.ndarray((self.height, self.width, 4), dtype=np.uint8, buffer=pixels, strides=(stride, 4, 1))
+        frame = VideoFrame.from_ndarray(
+            np.ascontiguousarray(rows[:self.context.height, :self.context.width]), format='bgra')
+        frame.pts = self.pts
+        self.pts += 1
+        if keyframe:
+            frame.pict_type = av.video.frame.PictureType.I
+        packets = self.context.encode(frame)
+        if not packets:
+            return None
+        data = b''.join(bytes(packet) for packet in packets)
+        flags = VIDEO_KEYFRAME if any(packet.is_keyframe for packet in packets) else 0
+        self.chunk_number += 1
+        return VIDEO_HEADER.pack(VIDEO_MAGIC, flags, self.width, self.height, self.chunk_number) + data
+
+    def close(self):
+        self.context = None
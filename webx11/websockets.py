@@ -3,8 +3,12 @@ import time
 import asyncio
 import websockets
 import base64
-from datetime import datetime
-from webx11.settings import SettingsManager
+from webx11.settings import get_settings
+from webx11.input_protocol import is_binary_input, decode_input
+from webx11.log import get_logger, fields
+
+logger = get_logger('websocket')
+frames_log = get_logger('frames')
 
 IMAGES_SENT = 0
 
@@ -12,79 +16,102 @@ class WebSocketHandler:
     def __init__(self, window_display_manager):
         self.window_manager = window_display_manager
         self.connected_clients = []
-        self.window_update_task = None
-        self.settings = SettingsManager()
-        self.lastupdate = None
-        
+        # Message type -> handler(websocket, data, display_id)
+        self.message_handlers = {
+            'mousedown': lambda websocket, data, display_id: self.handle_mouse_event(websocket, data, True, display_id),
+            'mouseup': lambda websocket, data, display_id: self.handle_mouse_event(websocket, data, False, display_id),
+            'mousemove': self.handle_mouse_move,
+            'scroll': self.handle_scroll_event,
+            'keydown': lambda websocket, data, display_id: self.handle_key_event(websocket, data, True, display_id),
+            'keyup': lambda websocket, data, display_id: self.handle_key_event(websocket, data, False, display_id),
+            'text_input': self.handle_text_input,
+            'refresh': self.handle_refresh,
+            'resize': self.handle_resize,
+            'stats': self.handle_stats,
+        }
+
     async def handle_websocket(self, websocket, path="/"):
         path = websocket.request.path
         try:
             display_id = int(path.strip('/').split('/')[-1])
         except (ValueError, IndexError):
-            print(f"Invalid WebSocket path: {path}")
+            logger.warning("Invalid WebSocket path: %s", path)
             return
         
         window_display = self.window_manager.get_display(display_id)
         if not window_display:
-            print(f"Window {display_id} not found for WebSocket connection")
+            logger.warning("Window %s not found for WebSocket connection", display_id)
             return
             
-        client = {"websocket": websocket, "display_id": display_id}
+        async def send_frame(frame):
+            await self.send_window_update(websocket, display_id, frame)
+
+        client = {"websocket": websocket, "display_id": display_id, "send_frame": send_frame}
         self.connected_clients.append(client)
-        print(f"WebSocket client connected for window {display_id}. Total clients: {len(self.connected_clients)}")
+        logger.info("WebSocket client connected", extra=fields(display=display_id, clients=len(self.connected_clients)))
         
         try:
             await self.send_settings(websocket)
-            await self.send_window_update(websocket, display_id, force=True)
+            # The display's frame producer sends a full frame first, then every update
+            window_display.frame_producer.subscribe(send_frame)
             async for message in websocket:
                 await self.handle_client_message(websocket, message, display_id)
         except websockets.exceptions.ConnectionClosed:
-            print(f"WebSocket connection closed for window {display_id}")
+            logger.debug("WebSocket connection closed", extra=fields(display=display_id))
         finally:
+            window_display.frame_producer.unsubscribe(send_frame)
             for client in self.connected_clients:
                 if client.get('websocket') == websocket:
                     self.connected_clients.remove(client)
-            print(f"WebSocket client disconnected for window {display_id}. Total clients: {len(self.connected_clients)}")
+            logger.info("WebSocket client disconnected", extra=fields(display=display_id, clients=len(self.connected_clients)))
     
     async def send_settings(self, websocket):
-        await websocket.send(self.settings.dump_json())
+        await websocket.send(get_settings().dump_json())
 
     async def handle_client_message(self, websocket, message, display_id):
         """Handle incoming WebSocket messages for a specific window"""
         try:
-            data = json.loads(message)
-            msg_type = data.get('type')
-            
+            # Pointer and key events come in binary batches, the other messages as JSON
+            if is_binary_input(message):
+                events = decode_input(message)
+            else:
+                events = [json.loads(message)]
+
             window_display = self.window_manager.get_display(display_id)
             if not window_display or not window_display.input_handler:
                 return
-            
-            if msg_type == 'mousedown':
-                await self.handle_mouse_event(websocket, data, True, display_id)
-            elif msg_type == 'mouseup':
-                await self.handle_mouse_event(websocket, data, False, display_id)
-            elif msg_type == 'mousemove':
-                await self.handle_mouse_move(websocket, data, display_id)
-            elif msg_type == 'scroll':
-                await self.handle_scroll_event(websocket, data, display_id)
-            elif msg_type == 'keydown':
-                await self.handle_key_event(websocket, data, True, display_id)
-            elif msg_type == 'keyup':
-                await self.handle_key_event(websocket, data, False, display_id)
-            elif msg_type == 'text_input':
-                await self.handle_text_input(websocket, data, display_id)
-            elif msg_type == 'refresh':
-                await self.send_window_update(websocket, display_id)
-            elif msg_type == 'resize':
-                if data.get('height') and data.get('width'):
-                    if window_display.height != data.get('height') or data.get('width') != window_display.width:
-                        window_display.force_resize(data.get('height'), data.get('width'))
-                
+
+            for data in events:
+                handler = self.message_handlers.get(data.get('type'))
+                if handler:
+                    await handler(websocket, data, display_id)
+
         except json.JSONDecodeError as e:
-            print(f"Invalid JSON message: {e}")
+            logger.warning("Invalid JSON message: %s", e)
         except Exception as e:
-            print(f"Error handling client message: {e}")
-    
+            logger.error("Error handling client message: %s", e)
+
+    async def handle_refresh(self, websocket, data, display_id):
+        window_display = self.window_manager.get_display(display_id)
+        if window_display:
+            window_display.frame_producer.request_keyframe()
+
+    async def handle_resize(self, websocket, data, display_id):
+        window_display = self.window_manager.get_display(display_id)
+        if window_display and data.get('height') and data.get('width'):
+            if window_display.height != data.get('height') or data.get('width') != window_display.width:
+                # Off the event loop, the display lock may be held by a job or the window watcher
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.window_manager.resize_display, display_id, data.get('width'), data.get('height'))
+
+    async def handle_stats(self, websocket, data, display_id):
+        """Client feedback, used to adapt the quality of its frames"""
+        window_display = self.window_manager.get_display(display_id)
+        if window_display:
+            for client in self.connected_clients:
+                if client.get('websocket') == websocket:
+                    window_display.frame_producer.report_stats(client['send_frame'], data)
+
     async def handle_mouse_event(self, websocket, data, pressed, display_id):
         x = data.get('x')
         y = data.get('y')
@@ -102,11 +129,7 @@ class WebSocketHandler:
         if x is not None and y is not None:
             window_display = self.window_manager.get_display(display_id)
             if window_display and window_display.input_handler:
-                try:
-                    window_display.input_handler.root.warp_pointer(x + window_display.x, y + window_display.y)
-                    window_display.input_handler.display.sync()
-                except Exception as e:
-                    print(f"Mouse move error: {e}")
+                window_display.input_handler.send_mouse_move(x, y)
     
     async def handle_scroll_event(self, websocket, data, display_id):
         x = data.get('x')
@@ -121,11 +144,16 @@ class WebSocketHandler:
     
     async def handle_key_event(self, websocket, data, pressed, display_id):
         key = data.get('key')
+        keysym = data.get('keysym')
         
-        if key:
+        if key or keysym:
             window_display = self.window_manager.get_display(display_id)
             if window_display and window_display.input_handler:
-                success = window_display.input_handler.send_key_event_by_name(key, pressed)
+                if keysym:
+                    # Binary key records carry the keysym, no name lookup needed
+                    success = window_display.input_handler.send_key_event(keysym, pressed)
+                else:
+                    success = window_display.input_handler.send_key_event_by_name(key, pressed)
 
     async def handle_text_input(self, websocket, data, display_id):
         text = data.get('text', '')
@@ -135,47 +163,18 @@ class WebSocketHandler:
             if window_display and window_display.input_handler:
                 success = window_display.input_handler.send_text_input(text)
     
-    async def send_window_update(self, websocket, display_id, force=False):
-        if self.lastupdate is None:
-            self.lastupdate = datetime.now()
-        self.lastupdate = datetime.now()
+    async def send_window_update(self, websocket, display_id, window_image):
+        """Send a frame published by the display's frame producer"""
         global IMAGES_SENT
         try:
-            window_display = self.window_manager.get_display(display_id)
-            if window_display:
-                window_image = window_display.capture_window(compressed=False, force=force)
-                
-                if window_image:
-                    IMAGES_SENT += 1
-                    print("[Send %s images via WebSocket (update) for window %s]" %(IMAGES_SENT, display_id), len(window_image))
-                    await websocket.send(window_image)
-
+            IMAGES_SENT += 1
+            frames_log.debug("Frame sent", extra=fields(transport='websocket', display=display_id, count=IMAGES_SENT,
+                                                        size=len(window_image)))
+            await websocket.send(window_image)
+        except websockets.exceptions.ConnectionClosed:
+            pass  # Handled by handle_websocket
         except Exception as e:
-            print(f"Error sending window update for {display_id}: {e}")
-
-    async def broadcast_window_updates(self, interval=2.0):
-        while True:
-            try:
-                if self.connected_clients:
-                    disconnected = []
-                    for client in self.connected_clients:
-                        await self.send_window_update(client.get('websocket'), client.get('display_id'), force=False)
-                    for client in disconnected:
-                        self.connected_clients.remove(client)
-                            
-            except Exception as e:
-                print(f"Error in window broadcast: {e}")
-            
-            await asyncio.sleep(interval)
-    
-    def start_window_broadcast(self, interval=2.0):
-        if self.window_update_task is None:
-            self.window_update_task = asyncio.create_task(self.broadcast_window_updates(interval))
-    
-    def stop_window_broadcast(self):
-        if self.window_update_task:
-            self.window_update_task.cancel()
-            self.window_update_task = None
+            logger.error("Error sending window update for %s: %s", display_id, e)
 
 
 async def run_websocket_server(window_manager, host='127.0.0.1', port=8081):
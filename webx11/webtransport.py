@@ -5,17 +5,22 @@ import base64
 import json
 import time
 import os
-from datetime import datetime
-from webx11.settings import SettingsManager
+from collections import deque
+from webx11.input_protocol import is_binary_input, decode_input
+from webx11.log import get_logger, fields
+
+logger = get_logger('webtransport')
+frames_log = get_logger('frames')
+input_log = get_logger('input')
 
 IMAGES_SENT = 0
-LAST_FRAME = datetime.now()
 
 try:
     from aioquic.asyncio import QuicConnectionProtocol, serve
     from aioquic.h3.connection import H3_ALPN, H3Connection
     from aioquic.h3.events import (
         H3Event,
+        DataReceived,
         HeadersReceived,
         WebTransportStreamDataReceived,
         DatagramReceived,
@@ -35,14 +40,32 @@ class WebTransportHandler:
     """Handler for a single WebTransport session"""
     def __init__(self, session_id, http, window_manager, display_id, protocol):
         self.session_id = session_id
-        print('Session Id', session_id)
         self.http = http
         self.protocol = protocol 
         self.window_manager = window_manager
         self.display_id = display_id
         self.running = True
         self.frame_counter = 0
-        self.settings = SettingsManager()
+        # Frame streams sent but not yet acknowledged by the client
+        self.streams_in_flight = deque()
+        self.max_streams_in_flight = 2
+        self.drain_timeout = 1.0
+        self.packets_received = asyncio.Event()
+        # Data received so far on the client streams, by stream id
+        self.incoming_streams = {}
+        # Message type -> handler(data)
+        self.message_handlers = {
+            'mousedown': lambda data: self.handle_mouse_event(data, True),
+            'mouseup': lambda data: self.handle_mouse_event(data, False),
+            'mousemove': self.handle_mouse_move,
+            'scroll': self.handle_scroll_event,
+            'keydown': lambda data: self.handle_key_event(data, True),
+            'keyup': lambda data: self.handle_key_event(data, False),
+            'text_input': self.handle_text_input,
+            'refresh': self.handle_refresh,
+            'resize': self.handle_resize,
+            'stats': self.handle_stats,
+        }
         
     def h3_event_received(self, event: H3Event):
         """Handle H3 events for this session"""
@@ -54,51 +77,62 @@ class WebTransportHandler:
     async def handle_datagram(self, data: bytes):
         """Handle incoming datagram (control messages)"""
         try:
-            message = json.loads(data.decode('utf-8'))
-            await self.handle_client_message(message)
+            # Pointer and key events come in binary batches, the other messages as JSON
+            if is_binary_input(data):
+                for message in decode_input(data):
+                    await self.handle_client_message(message)
+            else:
+                message = json.loads(data.decode('utf-8'))
+                await self.handle_client_message(message)
         except Exception as e:
-            print(f"Error handling datagram: {e}")
+            logger.error("Error handling datagram: %s", e)
     
     async def handle_stream_data(self, event):
-        """Handle incoming stream data (control messages)"""
+        """Handle incoming stream data (control messages too large for a datagram, e.g. pasted text)
+
+        A message may arrive in several parts, it is complete once the client ends the stream"""
         try:
-            message = json.loads(event.data.decode('utf-8'))
+            data = self.incoming_streams.pop(event.stream_id, b'') + event.data
+            if not event.stream_ended:
+                self.incoming_streams[event.stream_id] = data
+                return
+            message = json.loads(data.decode('utf-8'))
             await self.handle_client_message(message)
         except Exception as e:
-            print(f"Error handling stream data: {e}")
+            logger.error("Error handling stream data: %s", e)
     
     async def handle_client_message(self, data):
-        print('got message', data)
         """Handle incoming control messages"""
-        msg_type = data.get('type')
+        input_log.debug("Message received", extra=fields(display=self.display_id, type=data.get('type')))
         window_display = self.window_manager.get_display(self.display_id)
         
         if not window_display or not window_display.input_handler:
             return
         
-        if msg_type == 'mousedown':
-            await self.handle_mouse_event(data, True)
-        elif msg_type == 'mouseup':
-            await self.handle_mouse_event(data, False)
-        elif msg_type == 'mousemove':
-            await self.handle_mouse_move(data)
-        elif msg_type == 'scroll':
-            await self.handle_scroll_event(data)
-        elif msg_type == 'keydown':
-            await self.handle_key_event(data, True)
-        elif msg_type == 'keyup':
-            await self.handle_key_event(data, False)
-        elif msg_type == 'text_input':
-            await self.handle_text_input(data)
-        elif msg_type == 'refresh':
-            await self.send_window_update(force=True)
-        elif msg_type == 'resize':
-            if data.get('height') and data.get('width'):
-                if window_display.height != data.get('height') or data.get('width') != window_display.width:
-                    window_display.force_resize(data.get('height'), data.get('width'))
-                    await asyncio.sleep(0.1)
-                    await self.send_window_update()
+        handler = self.message_handlers.get(data.get('type'))
+        if handler:
+            await handler(data)
+
+    async def handle_refresh(self, data):
+        window_display = self.window_manager.get_display(self.display_id)
+        if window_display:
+            window_display.frame_producer.request_keyframe()
+
+    async def handle_resize(self, data):
+        window_display = self.window_manager.get_display(self.display_id)
+        if window_display and data.get('height') and data.get('width'):
+            if window_display.height != data.get('height') or data.get('width') != window_display.width:
+                # Off the event loop, the display lock may be held by a job or the window watcher.
+                # The frame producer sends the resized frame on its next tick
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.window_manager.resize_display, self.display_id, data.get('width'), data.get('height'))
     
+    async def handle_stats(self, data):
+        """Client feedback, used to adapt the quality of its frames"""
+        window_display = self.window_manager.get_display(self.display_id)
+        if window_display:
+            window_display.frame_producer.report_stats(self.send_window_update, data)
+
     async def handle_mouse_event(self, data, pressed):
         x, y = data.get('x'), data.get('y')
         button = data.get('button', 1)
@@ -113,12 +147,7 @@ class WebTransportHandler:
         if x is not None and y is not None:
             window_display = self.window_manager.get_display(self.display_id)
             if window_display and window_display.input_handler:
-                try:
-                    window_display.input_handler.root.warp_pointer(
-                        x + window_display.x, y + window_display.y)
-                    window_display.input_handler.display.sync()
-                except Exception as e:
-                    print(f"Mouse move error: {e}")
+                window_display.input_handler.send_mouse_move(x, y)
     
     async def handle_scroll_event(self, data):
         x, y = data.get('x'), data.get('y')
@@ -129,11 +158,15 @@ class WebTransportHandler:
                 success = window_display.input_handler.send_scroll_event(x, y, delta_y)
     
     async def handle_key_event(self, data, pressed):
-        key = data.get('key')
-        if key:
+        key, keysym = data.get('key'), data.get('keysym')
+        if key or keysym:
             window_display = self.window_manager.get_display(self.display_id)
             if window_display and window_display.input_handler:
-                success = window_display.input_handler.send_key_event_by_name(key, pressed)
+                if keysym:
+                    # Binary key records carry the keysym, no name lookup needed
+                    success = window_display.input_handler.send_key_event(keysym, pressed)
+                else:
+                    success = window_display.input_handler.send_key_event_by_name(key, pressed)
     
     async def handle_text_input(self, data):
         text = data.get('text', '')
@@ -148,66 +181,84 @@ class WebTransportHandler:
             data = json.dumps(message).encode('utf-8')
             self.http.send_datagram(self.session_id, data)
         except Exception as e:
-            print(f"Error sending control message: {e}")
+            logger.error("Error sending control message: %s", e)
     
-    async def send_updates_loop(self):
-        """Continuously send window updates"""
-        while self.running:
-            await self.send_window_update()
-            await asyncio.sleep(round(1.0 / self.settings.fps, 2))
+    def start(self):
+        """Subscribe to the display's frame producer, which sends a full frame first"""
+        window_display = self.window_manager.get_display(self.display_id)
+        if window_display:
+            window_display.frame_producer.subscribe(self.send_window_update)
 
-    async def send_window_update(self, force=False):
+    async def send_window_update(self, window_image):
         """Send window image via WebTransport stream"""
-        global IMAGES_SENT, LAST_FRAME
+        global IMAGES_SENT
         try:
-            delta = datetime.now() - LAST_FRAME
-            framerate_delta = 1000000 / self.settings.fps  # microseconds
-            if delta.seconds == 0 and delta.microseconds < framerate_delta:
-                return
-            LAST_FRAME = datetime.now()
-        
-            window_display = self.window_manager.get_display(self.display_id)
-            if window_display:
-                window_image = window_display.capture_window(compressed=False, force=force)
-                if window_image:
-                    IMAGES_SENT += 1
-                    self.frame_counter = (self.frame_counter + 1) % 65536
+            if self.running and window_image:
+                # Already paced by the frame producer, and throttled by this session's outbox
+                IMAGES_SENT += 1
+                self.frame_counter = (self.frame_counter + 1) % 65536
 
-                    print(f"[Send image #{IMAGES_SENT} via stream (frame {self.frame_counter}) for window {self.display_id}, size: {len(window_image)} bytes]")
+                frames_log.debug("Frame sent", extra=fields(transport='webtransport', display=self.display_id,
+                                                            count=IMAGES_SENT, frame=self.frame_counter, size=len(window_image)))
 
-                    # Create a new unidirectional stream for this frame
-                    stream_id = self.http.create_webtransport_stream(
-                        session_id=self.session_id, is_unidirectional=True
-                    )
-                    
-                    # Create header with frame metadata
-                    header = (
-                        self.frame_counter.to_bytes(2, 'big') +
-                        len(window_image).to_bytes(4, 'big') +
-                        int(time.time() * 1000).to_bytes(8, 'big')
-                    )
-                    
-                    # Send header + complete frame data on the stream
-                    self.protocol._quic.send_stream_data(
-                        stream_id=stream_id,
-                        data=header + window_image,
-                        end_stream=True
-                    )
-                    
-                    # Transmit the data
-                    self.protocol.transmit()
+                # Create a new unidirectional stream for this frame
+                stream_id = self.http.create_webtransport_stream(
+                    session_id=self.session_id, is_unidirectional=True
+                )
                 
-                    # Yield to event loop
-                    await asyncio.sleep(0)
+                # Create header with frame metadata
+                header = (
+                    self.frame_counter.to_bytes(2, 'big') +
+                    len(window_image).to_bytes(4, 'big') +
+                    int(time.time() * 1000).to_bytes(8, 'big')
+                )
                 
+                # Send header + complete frame data on the stream
+                self.protocol._quic.send_stream_data(
+                    stream_id=stream_id,
+                    data=header + window_image,
+                    end_stream=True
+                )
+                
+                # Transmit the data
+                self.protocol.transmit()
+            
+                # Wait for the client to catch up, newer frames wait in our outbox meanwhile
+                self.streams_in_flight.append(stream_id)
+                await self.wait_drained()
+            
         except Exception as e:
-            print(f"Error sending window update: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error sending window update: %s", e)
     
+    async def wait_drained(self):
+        """Wait until less than max_streams_in_flight frames are still being delivered
+
+        Checked again whenever the connection received packets, which carry the ACKs"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        while True:
+            while self.streams_in_flight and self.protocol.stream_delivered(self.streams_in_flight[0]):
+                self.streams_in_flight.popleft()
+            if len(self.streams_in_flight) < self.max_streams_in_flight or not self.running:
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # Never block the outbox for good, e.g. on a stream we will not hear of anymore
+                self.streams_in_flight.popleft()
+                return
+            self.packets_received.clear()
+            try:
+                await asyncio.wait_for(self.packets_received.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
     def stop(self):
         """Stop the handler"""
         self.running = False
+        self.packets_received.set()
+        window_display = self.window_manager.get_display(self.display_id)
+        if window_display:
+            window_display.frame_producer.unsubscribe(self.send_window_update)
 
 class WebTransportProtocol(QuicConnectionProtocol):
     """WebTransport protocol handler"""
@@ -215,21 +266,45 @@ class WebTransportProtocol(QuicConnectionProtocol):
         super().__init__(*args, **kwargs)
         self.window_manager = window_display_manager
         self._http = None
-        self._handler = None
-        self._update_task = None
+        # A single connection can carry several WebTransport sessions, by session id
+        self._handlers = {}
         
     def quic_event_received(self, event: QuicEvent):
         """Handle QUIC events"""
         if isinstance(event, ProtocolNegotiated):
             self._http = H3Connection(self._quic, enable_webtransport=True)
-        elif isinstance(event, StreamReset) and self._handler is not None:
-            self._handler.stop()
+        elif isinstance(event, StreamReset):
+            self._close_session(event.stream_id)
         
         if self._http is not None:
             output = self._http.handle_event(event)
             for h3_event in output:
                 self._h3_event_received(h3_event)
     
+    def datagram_received(self, data, addr):
+        super().datagram_received(data, addr)
+        # ACKs were processed, the sessions waiting for their frames to be delivered check again
+        for handler in self._handlers.values():
+            handler.packets_received.set()
+
+    def stream_delivered(self, stream_id):
+        """Whether everything sent on a stream was acknowledged
+
+        aioquic has no public API for it, its streams are private. Tested with aioquic 1.2.0 to 1.6.1"""
+        stream = self._quic._streams.get(stream_id)
+        return stream is None or stream.sender.is_finished
+
+    def connection_lost(self, exc):
+        for session_id in list(self._handlers):
+            self._close_session(session_id)
+        super().connection_lost(exc)
+
+    def _close_session(self, session_id):
+        handler = self._handlers.pop(session_id, None)
+        if handler is not None:
+            handler.stop()
+            logger.info("WebTransport session closed", extra=fields(display=handler.display_id))
+
     def _h3_event_received(self, event: H3Event):
         """Handle H3 events"""
         if isinstance(event, HeadersReceived):
@@ -239,9 +314,17 @@ class WebTransportProtocol(QuicConnectionProtocol):
                 self._handshake_webtransport(event.stream_id, headers)
             else:
                 self._send_response(event.stream_id, 400, end_stream=True)
-        
-        if self._handler:
-            self._handler.h3_event_received(event)
+        elif isinstance(event, DatagramReceived):
+            handler = self._handlers.get(event.stream_id)
+            if handler:
+                handler.h3_event_received(event)
+        elif isinstance(event, WebTransportStreamDataReceived):
+            handler = self._handlers.get(event.session_id)
+            if handler:
+                handler.h3_event_received(event)
+        elif isinstance(event, DataReceived) and event.stream_ended:
+            # The client closed the CONNECT stream of a session
+            self._close_session(event.stream_id)
     
     def _handshake_webtransport(self, stream_id: int, request_headers: dict):
         """Handle WebTransport handshake"""
@@ -250,24 +333,25 @@ class WebTransportProtocol(QuicConnectionProtocol):
         
         try:
             display_id = int(path.strip('/').split('/')[-1])
-            print(f"WebTransport session requested for window {display_id}")
+            logger.debug("WebTransport session requested", extra=fields(display=display_id))
         except (ValueError, IndexError):
-            print(f"Invalid WebTransport path: {path}")
+            logger.warning("Invalid WebTransport path: %s", path)
             self._send_response(stream_id, 404, end_stream=True)
             return
         
         if not self.window_manager.get_display(display_id):
-            print(f"Window {display_id} not found")
+            logger.warning("Window %s not found for WebTransport session", display_id)
             self._send_response(stream_id, 404, end_stream=True)
             return
         
-        self._handler = WebTransportHandler(
+        handler = WebTransportHandler(
             stream_id, self._http, self.window_manager, display_id, self
         )
+        self._handlers[stream_id] = handler
         self._send_response(stream_id, 200)
-        self._handler.send_window_update(force=True)
-        self._update_task = asyncio.create_task(self._handler.send_updates_loop())
-        print(f"WebTransport session established for window {display_id}")
+        # Subscribing wakes the frame producer up, the first full frame is sent right away
+        handler.start()
+        logger.info("WebTransport session established", extra=fields(display=display_id))
     
     def _send_response(self, stream_id: int, status_code: int, end_stream=False):
         """Send HTTP response"""
@@ -281,7 +365,7 @@ class WebTransportProtocol(QuicConnectionProtocol):
         """
         Wait for the connection to be closed.
         """
-        print('Connection is closing')
+        logger.debug("Connection is closing")
         await super._closed.wait()
 
 async def run_webtransport_server(window_manager, host, port):
@@ -1,85 +1,268 @@
 import sys
 import io
+import os
+import zlib
+import time
+import asyncio
+import threading
+import select
+from collections import OrderedDict
 from PIL import Image
-from webx11.settings import SettingsManager
+from webx11.settings import get_settings
+from webx11.tiles import TileTracker, pack_tiles, TILE_KEYFRAME, NUMPY_AVAILABLE
+from webx11.framebuffer import XlibFramebuffer, ShmFramebuffer, MmapFramebuffer
+from webx11.video import VideoEncoder, VIDEO_AVAILABLE
+from webx11 import metrics
+from webx11.log import get_logger
 
 try:
     import Xlib
     import Xlib.display
     from Xlib import X, XK
-    from Xlib.ext import xtest
+    from Xlib.ext import xtest, damage
 except ImportError:
     print("Warning: Xlib not available. Install with: pip3 install python-xlib")
     sys.exit(1)
 
+logger = get_logger('capture')
+input_log = get_logger('input')
+
+# Keysyms of the control characters found in typed text
+CONTROL_KEYSYMS = {'\n': 0xff0d, '\r': 0xff0d, '\t': 0xff09, '\b': 0xff08}
+
+
+def char_to_keysym(char):
+    """Latin-1 keysyms are their code point, the other characters have their Unicode keysym"""
+    if char in CONTROL_KEYSYMS:
+        return CONTROL_KEYSYMS[char]
+    code = ord(char)
+    return code if code < 0x100 else 0x01000000 | code
+
+
+def scale_image(image, scale):
+    if scale == 1:
+        return image
+    width, height = image.size
+    return image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+
+
 class WindowScreenCapture:
-    def __init__(self, window_display):
-        self.window_display = window_display
-        self.display = window_display.get_display()
-        if not self.display:
-            raise Exception("No X11 display available")
+    def __init__(self, display_name, fbdir=None):
+        self.display_name = display_name
+        self.fbdir = fbdir
+        # Captures run on the capture pool, they get their own X connection
+        self.display = Xlib.display.Display(display_name)
         self.screen = self.display.screen()
         self.root = self.screen.root
-        self.settings = SettingsManager()
+        self.settings = get_settings()
+        self.framebuffer = self.create_framebuffer()
+        self.lock = threading.Lock()
+        self.size = (self.screen.width_in_pixels, self.screen.height_in_pixels)
         
         # Cache for optimization
-        self.last_frame = None
+        self.last_frames = {}  # Encoded frames of the last fingerprint, by profile
+        self.last_fingerprint = None
         self.frame_buffer = io.BytesIO()
         self.pil_image = None
-        
-    def capture_window(self, x=0, y=0, height=0, width=0, quality=30, dpi=200, force=False):
-        try:
-            # OPTIMIZATION 1: Reuse X11 image capture - avoid recreation
-            raw = self.root.get_image(0, 0, width, height, X.ZPixmap, 0xffffffff)
-            
-            # OPTIMIZATION 2: Reuse PIL Image object instead of creating new one
-            if self.pil_image is None or self.pil_image.size != (width, height):
-                self.pil_image = Image.frombytes("RGB", (width, height), raw.data, "raw", "BGRX")
-            else:
-                # Reuse existing image object, just update data
-                self.pil_image = Image.frombytes("RGB", (width, height), raw.data, "raw", "BGRX")
-            
-            # OPTIMIZATION 3: Reuse BytesIO buffer
-            self.frame_buffer.seek(0)
-            self.frame_buffer.truncate()
-            
-            # OPTIMIZATION 4: Use JPEG with optimized settings for speed
-            # PNG is slower to encode - JPEG is 3-5x faster
-            if self.settings.image_format.lower() == 'png':
-                # Fast PNG encoding
-                self.pil_image.save(
-                    self.frame_buffer, 
-                    format='PNG',
-                    optimize=False,  # Disable optimization for speed
-                    compress_level=1  # Minimum compression for speed
-                )
-            else:
-                # JPEG is much faster
-                self.pil_image.save(
-                    self.frame_buffer,
-                    format=self.settings.image_format, # Should work best with JPEG
-                    quality=self.settings.image_quality,
-                    optimize=False,  # Disable optimization
-                    subsampling=2  # 4:2:0 chroma subsampling for speed
-                )
-            
-            frame_data = self.frame_buffer.getvalue()
+        self.last_stats = None  # (capture, encode) seconds of the last capture, None when skipped
+        self.tiles = None
+        if self.settings.tile_size and NUMPY_AVAILABLE:
+            self.tiles = TileTracker(self.settings.tile_size)
+        self.video = None
+        self.video_codec = None
+        if self.settings.video_codec != 'none' and VIDEO_AVAILABLE:
+            self.video_codec = self.settings.video_codec
+
+        # X DAMAGE tracking, used to skip captures when nothing has been drawn
+        self.damage = None
+        self.damage_event = None
+        self.damaged = True
+        if self.settings.capture_mode == 'damage':
+            self.setup_damage()
+
+    def create_framebuffer(self):
+        """Pick the capture backend from the settings, get_image being always available"""
+        if self.settings.capture_backend == 'fbdir' and self.fbdir:
+            try:
+                return MmapFramebuffer(os.path.join(self.fbdir, 'Xvfb_screen0'))
+            except Exception as e:
+                logger.warning("Xvfb framebuffer file not available (%s), falling back to get_image", e)
+        if self.settings.capture_backend == 'shm':
+            try:
+                return ShmFramebuffer(self.display_name)
+            except Exception as e:
+                logger.warning("MIT-SHM capture not available (%s), falling back to get_image", e)
+        return XlibFramebuffer(self.display)
+
+    def close(self):
+        with self.lock:
+            if self.video is not None:
+                self.video.close()
+            self.framebuffer.close()
+            try:
+                self.display.close()
+            except Xlib.error.ConnectionClosedError:
+                pass
+
+    def setup_damage(self):
+        """Subscribe to DAMAGE events on the root window"""
+        if not self.display.has_extension('DAMAGE'):
+            logger.warning("DAMAGE extension not available, falling back to polling")
+            return
+        self.display.damage_query_version()
+        # NonEmpty only reports once until the damage region is subtracted again
+        self.damage = self.root.damage_create(damage.DamageReportNonEmpty)
+        self.damage_event = self.display.extension_event.DamageNotify
+
+    def has_damage(self):
+        """Return True if something was drawn since the last call (always True when polling)"""
+        if self.damage is None:
+            return True
+        damaged = self.damaged
+        while self.display.pending_events():
+            event = self.display.next_event()
+            if event.type == self.damage_event:
+                damaged = True
+        if damaged:
+            # Subtracting before the capture, anything drawn in-between will be reported again
+            self.display.damage_subtract(self.damage)
+            self.damaged = False
+        return damaged
+
+    def capture_window(self, x=0, y=0, height=0, width=0, quality=30, dpi=200, force=False, profiles=None):
+        """Capture the screen and encode it once per (quality, scale) profile
+        Returns a {profile: frame} dict, or None when nothing changed"""
+        profiles = profiles or ((self.settings.image_quality, 1.0),)
+        start = time.perf_counter()
+        grabbed = None
+        self.last_stats = None
+        # The display might be stopped from another thread while we capture
+        with self.lock:
+            self.size = (width, height)
+            try:
+                # OPTIMIZATION 0: Do not even capture when the X server reports no damage
+                if not self.has_damage() and not force:
+                    return None
+
+                # OPTIMIZATION 1: Reuse X11 image capture - avoid recreation
+                # With MIT-SHM, the pixels are read in place from the shared memory segment
+                pixels, stride = self.framebuffer.grab(width, height)
+                grabbed = time.perf_counter()
+
+                if self.video_codec:
+                    # OPTIMIZATION 8: Feed a persistent video encoder, frames only carry what changed.
+                    # There is a single stream for every client, whatever their profile
+                    chunk = self.encode_video(pixels, stride, width, height, force)
+                    if self.video_codec:
+                        return {profiles[0]: chunk} if chunk else None
+                    force = True  # The encoder is not available, clients need a full image
+
+                if self.tiles is not None:
+                    # OPTIMIZATION 7: Only encode and send the tiles that changed since the previous frame
+                    # The tile compare also covers identical frames, no need for a fingerprint
+                    fingerprint = None
+                    self.last_frames = {}
+                    rects = self.tiles.update(pixels, width, height, stride, force=force)
+                    if rects is not None:
+                        if not rects:
+                            return None  # No change, don't send
+                        images = [self.tiles.tile_image(rect) for rect in rects]
+                        return {profile: self.encode_tiles(rects, images, width, height, profile) for profile in profiles}
+                else:
+                    # OPTIMIZATION 6: Fingerprint the raw BGRX pixels so that identical frames are never encoded
+                    # crc32 is a lot cheaper than any encoder and does not need to keep the previous frame around
+                    fingerprint = (width, height, zlib.crc32(pixels))
+                    if fingerprint == self.last_fingerprint and self.last_frames:
+                        if not force:
+                            return None  # No change, don't send
+                        # Reuse the cached encoded frames, only the new profiles are encoded below
+                    else:
+                        self.last_frames = {}
             
-            # OPTIMIZATION 5: Basic frame comparison to skip identical frames
-            if not force and self.last_frame == frame_data:
-                return None  # No change, don't send
+                # OPTIMIZATION 2: Reuse PIL Image object instead of creating new one
+                if self.pil_image is None or self.pil_image.size != (width, height):
+                    self.pil_image = Image.frombytes("RGB", (width, height), pixels, "raw", "BGRX", stride)
+                else:
+                    # Reuse existing image object, just update data
+                    self.pil_image = Image.frombytes("RGB", (width, height), pixels, "raw", "BGRX", stride)
             
-            self.last_frame = frame_data
-            return frame_data
+                self.last_fingerprint = fingerprint
+                frames = {}
+                for profile in profiles:
+                    if profile not in self.last_frames:
+                        self.last_frames[profile] = self.encode_frame(self.pil_image, width, height, profile)
+                    frames[profile] = self.last_frames[profile]
+                return frames
 
-        except Exception as e:
-            print(f"Window capture error: {e}")
-            return self.create_blank_image()
+            except Exception as e:
+                logger.error("Window capture error: %s", e)
+                if self.tiles is not None:
+                    self.tiles.reset()
+                blank = self.create_blank_image()
+                return {profile: blank for profile in profiles} if blank else None
+            finally:
+                if grabbed is not None:
+                    self.last_stats = (grabbed - start, time.perf_counter() - grabbed)
+
+    def encode_video(self, pixels, stride, width, height, force):
+        fingerprint = (width, height, zlib.crc32(pixels))
+        if fingerprint == self.last_fingerprint and not force:
+            return None  # No change, don't send
+        self.last_fingerprint = fingerprint
+        if self.video is None or (self.video.width, self.video.height) != (width, height):
+            try:
+                self.video = VideoEncoder(self.video_codec, width, height, self.settings.fps)
+            except Exception as e:
+                logger.warning("%s encoder not available (%s), falling back to images", self.video_codec, e)
+                self.video = self.video_codec = self.last_fingerprint = None
+                return None
+            force = True  # A new stream starts with a keyframe
+        return self.video.encode(pixels, stride, keyframe=force)
+
+    def encode_frame(self, image, width, height, profile):
+        quality, scale = profile
+        if scale == 1:
+            return self.encode_image(image, quality)
+        # Scaled down full frames are sent as a single tile, the client stretches it back to the frame size
+        data = self.encode_image(scale_image(image, scale), quality)
+        return pack_tiles(width, height, [(0, 0, width, height, data)], flags=TILE_KEYFRAME)
+
+    def encode_tiles(self, rects, images, width, height, profile):
+        quality, scale = profile
+        tiles = [rect + (self.encode_image(scale_image(image, scale), quality),) for rect, image in zip(rects, images)]
+        return pack_tiles(width, height, tiles)
+
+    def encode_image(self, image, quality=None):
+        """Encode a Pillow image with the configured format"""
+        # OPTIMIZATION 3: Reuse BytesIO buffer
+        self.frame_buffer.seek(0)
+        self.frame_buffer.truncate()
+        
+        # OPTIMIZATION 4: Use JPEG with optimized settings for speed
+        # PNG is slower to encode - JPEG is 3-5x faster
+        if self.settings.image_format.lower() == 'png':
+            # Fast PNG encoding
+            image.save(
+                self.frame_buffer, 
+                format='PNG',
+                optimize=False,  # Disable optimization for speed
+                compress_level=1  # Minimum compression for speed
+            )
+        else:
+            # JPEG is much faster
+            image.save(
+                self.frame_buffer,
+                format=self.settings.image_format, # Should work best with JPEG
+                quality=quality or self.settings.image_quality,
+                optimize=False,  # Disable optimization
+                subsampling=2  # 4:2:0 chroma subsampling for speed
+            )
+        return self.frame_buffer.getvalue()
     
     def create_blank_image(self):
         """Create a blank image when capture fails"""
         try:
-            image = Image.new('RGB', (self.window_display.width, self.window_display.height), color='lightgray')
+            image = Image.new('RGB', self.size, color='lightgray')
             buffer = io.BytesIO()
             image.save(buffer, format=self.settings.image_format)
             return buffer.getvalue()
@@ -87,6 +270,54 @@ class WindowScreenCapture:
             return None
 
 
+class WindowWatcher:
+    """Watch the top-level windows of a display, from its own thread and X connection
+
+    on_change(x11_display) is called as soon as an application maps a window, and whenever
+    a top-level window is resized or moved. Events coming together are handled once."""
+    def __init__(self, display_name, on_change):
+        self.on_change = on_change
+        self.display = Xlib.display.Display(display_name)
+        self.root = self.display.screen().root
+        # MapNotify and ConfigureNotify of every child of the root window
+        self.root.change_attributes(event_mask=X.SubstructureNotifyMask)
+        self.display.flush()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name=f'webx11-watcher{display_name}')
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                # Wakes up regularly to notice stop()
+                if not select.select([self.display.fileno()], [], [], 0.5)[0]:
+                    continue
+                changed = False
+                while self.display.pending_events():
+                    event = self.display.next_event()
+                    if event.type not in (X.MapNotify, X.ConfigureNotify):
+                        continue
+                    # Menus and tooltips do not change the size of the application
+                    if event.override or event.window == self.root:
+                        continue
+                    changed = True
+                if changed and not self.stopped.is_set():
+                    self.on_change(self.display)
+        except Exception as e:
+            if not self.stopped.is_set():
+                logger.error("Window watcher error: %s", e)
+        finally:
+            try:
+                self.display.close()
+            except Exception:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
+
+
 class WindowInputHandler:
     def __init__(self, window_display):
         self.window_display = window_display
@@ -97,6 +328,20 @@ class WindowInputHandler:
         
         # Key mapping
         self.key_map = self._create_key_map()
+
+        # Queued XTest requests, flushed together at the end of the current loop iteration.
+        # Motion is coalesced: only the latest position of a motion_interval window is sent
+        self.requests = []
+        self.motion = None
+        self.motion_interval = 0.008
+        self.flush_handle = None
+        self.flush_urgent = False
+        self.received = None  # When the oldest input not flushed yet was received
+
+        # keysym -> (keycode, shift) from the keymap, and keysyms mapped on spare keycodes (LRU)
+        self.keycodes = {}
+        self.remapped = OrderedDict()
+        self.spare_keycodes = None
         
     def _create_key_map(self):
         """Create mapping from common key names to X11 keycodes"""
@@ -149,31 +394,92 @@ class WindowInputHandler:
         
         return key_map
     
+    def count_input(self, kind):
+        metrics.INPUT_EVENTS.labels(self.window_display.display_id, kind).inc()
+        if self.received is None:
+            self.received = time.perf_counter()
+
+    def queue(self, *request):
+        """Queue an XTest request, sent with the next flush"""
+        self.pending_motion_to_queue()
+        self.requests.append(request)
+        # Same loop iteration: every event of a client batch goes out with a single flush
+        self.schedule_flush(0)
+
+    def pending_motion_to_queue(self):
+        # Clicks and keys must happen where the pointer last was, the motion goes first
+        if self.motion is not None:
+            self.requests.append(('warp',) + self.motion)
+            self.motion = None
+
+    def schedule_flush(self, delay):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()  # Not called from the event loop, nothing to coalesce with
+            return
+        if self.flush_handle is not None:
+            if delay or self.flush_urgent:
+                return
+            self.flush_handle.cancel()
+        self.flush_urgent = not delay
+        self.flush_handle = loop.call_later(delay, self.flush) if delay else loop.call_soon(self.flush)
+
+    def flush(self):
+        """Send every queued request at once
+        The X server handles the requests of a connection in order, so no round-trip is needed in-between"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending_motion_to_queue()
+        requests, self.requests = self.requests, []
+        if not requests:
+            return
+        received, self.received = self.received, None
+        try:
+            for request in requests:
+                if request[0] == 'warp':
+                    self.root.warp_pointer(request[1], request[2])
+                elif request[0] == 'remap':
+                    self.display.change_keyboard_mapping(request[1], [(request[2], request[2])])
+                else:
+                    xtest.fake_input(self.display, request[1], request[2])
+            self.display.flush()
+            if received is not None:
+                metrics.INPUT_SECONDS.labels(self.window_display.display_id).observe(time.perf_counter() - received)
+        except Exception as e:
+            input_log.error("Input flush error: %s", e)
+
+    def send_mouse_move(self, x, y):
+        """Move the pointer, only the latest position within motion_interval is sent"""
+        self.count_input('mousemove')
+        self.motion = (x + self.window_display.x, y + self.window_display.y)
+        self.schedule_flush(self.motion_interval)
+        return True
+
     def send_mouse_event(self, x, y, button=1, pressed=True):
         """Send mouse event to this window's display"""
+        self.count_input('mousedown' if pressed else 'mouseup')
         try:
             event_type = X.ButtonPress if pressed else X.ButtonRelease
             
             # Move pointer first
-            self.root.warp_pointer(x + self.window_display.x, y + self.window_display.y)
-            self.display.sync()
+            self.motion = (x + self.window_display.x, y + self.window_display.y)
             
             # Send button event
-            xtest.fake_input(self.display, event_type, button)
-            self.display.sync()
+            self.queue('fake_input', event_type, button)
             return True
 
         except Exception as e:
-            raise e
-            print(f"Mouse event error: {e}")
+            input_log.error("Mouse event error: %s", e)
             return False
     
     def send_scroll_event(self, x, y, delta_y):
         """Send scroll wheel event to this window's display"""
+        self.count_input('scroll')
         try:
             # Move pointer to the scroll position
-            self.root.warp_pointer(x, y)
-            self.display.sync()
+            self.motion = (x + self.window_display.x, y + self.window_display.y)
             
             # Determine scroll direction and button
             if delta_y > 0:
@@ -184,26 +490,28 @@ class WindowInputHandler:
                 button = 4
             
             # Send scroll events (press and release)
-            xtest.fake_input(self.display, X.ButtonPress, button)
-            self.display.sync()
-            xtest.fake_input(self.display, X.ButtonRelease, button)
-            self.display.sync()
+            self.queue('fake_input', X.ButtonPress, button)
+            self.queue('fake_input', X.ButtonRelease, button)
             return True
             
         except Exception as e:
-            print(f"Scroll event error: {e}")
+            input_log.error("Scroll event error: %s", e)
             return False
     
     def send_key_event(self, keycode, pressed=True):
         """Send keyboard event to this window's display"""
+        self.count_input('keydown' if pressed else 'keyup')
         try:
-            keycode = self.display.keysym_to_keycode(keycode)
+            # Modifiers are pressed by the client itself, only the keycode matters
+            resolved = self.resolve_keysym(keycode)
+            if resolved is None:
+                input_log.warning("Could not find keycode for keysym: %#x", keycode)
+                return False
             event_type = X.KeyPress if pressed else X.KeyRelease
-            xtest.fake_input(self.display, event_type, keycode)
-            self.display.sync()
+            self.queue('fake_input', event_type, resolved[0])
             return True
         except Exception as e:
-            print(f"Key event error: {e}")
+            input_log.error("Key event error: %s", e)
             return False
     
     def send_key_event_by_name(self, key_name, pressed=True):
@@ -212,43 +520,87 @@ class WindowInputHandler:
             # Look up keycode in our mapping
             keycode = self.key_map.get(key_name.lower())
             if keycode is None:
-                print(f"Unknown key: {key_name}")
+                input_log.warning("Unknown key: %s", key_name)
                 return False
             
             return self.send_key_event(keycode, pressed)
             
         except Exception as e:
-            print(f"Key event by name error: {e}")
+            input_log.error("Key event by name error: %s", e)
             return False
     
     def send_text_input(self, text):
-        """Send text input by simulating key presses for each character"""
+        """Type a whole string, every key event being sent with a single flush"""
+        self.count_input('text_input')
         try:
+            shift_keycode, _ = self.resolve_keysym(XK.XK_Shift_L)
+            shifted = False
             for char in text:
-                # Look up keycode in our mapping first
-                keycode = self.key_map.get(char)
-                if keycode is not None:
-                    self.send_key_event(keycode, True)
-                    self.send_key_event(keycode, False)
-                else:
-                    # Try using XK for other characters
-                    keysym = XK.string_to_keysym(char)
-                    if keysym == 0:
-                        # Try uppercase
-                        keysym = XK.string_to_keysym(char.upper())
-                    
-                    if keysym != 0:
-                        keycode = self.display.keysym_to_keycode(keysym)
-                        if keycode:
-                            self.send_key_event(keycode, True)
-                            self.send_key_event(keycode, False)
-                        else:
-                            print(f"Could not find keycode for character: {char}")
-                    else:
-                        print(f"Could not find keysym for character: {char}")
-            
+                resolved = self.resolve_keysym(char_to_keysym(char))
+                if resolved is None:
+                    input_log.warning("Could not find keycode for character: %r", char)
+                    continue
+                keycode, shift = resolved
+                # Shift stays pressed over consecutive shifted characters
+                if shift != shifted:
+                    self.queue('fake_input', X.KeyPress if shift else X.KeyRelease, shift_keycode)
+                    shifted = shift
+                self.queue('fake_input', X.KeyPress, keycode)
+                self.queue('fake_input', X.KeyRelease, keycode)
+            if shifted:
+                self.queue('fake_input', X.KeyRelease, shift_keycode)
             return True
             
         except Exception as e:
-            print(f"Text input error: {e}")
-            return False
\ No newline at end of file
+            input_log.error("Text input error: %s", e)
+            return False
+
+    def resolve_keysym(self, keysym):
+        """Return the (keycode, shift) pair typing a keysym, mapping it to a spare keycode if needed.
+        Returns None when it can not be typed at all"""
+        if keysym in self.remapped:
+            self.remapped.move_to_end(keysym)
+            return self.remapped[keysym], False
+        resolved = self.keycodes.get(keysym)
+        if resolved is None:
+            # Only the plain and shifted levels, the others depend on the keyboard layout
+            for keycode, index in self.display.keysym_to_keycodes(keysym):
+                if index in (0, 1):
+                    resolved = self.keycodes[keysym] = (keycode, index == 1)
+                    break
+        if resolved is None:
+            keycode = self.remap_spare_keycode(keysym)
+            if keycode is not None:
+                resolved = (keycode, False)
+        return resolved
+
+    def remap_spare_keycode(self, keysym):
+        """Map a keysym missing from the keymap on a keycode which has no keysym"""
+        if self.spare_keycodes is None:
+            first = self.display.display.info.min_keycode
+            count = self.display.display.info.max_keycode - first + 1
+            mapping = self.display.get_keyboard_mapping(first, count)
+            self.spare_keycodes = [first + i for i, keysyms in enumerate(mapping) if not any(keysyms)]
+        if self.spare_keycodes:
+            keycode = self.spare_keycodes.pop()
+        elif self.remapped:
+            # Reuse the least recently used one. Its previous key events must have been
+            # handled before the mapping changes: this is the only place needing a round-trip
+            _, keycode = self.remapped.popitem(last=False)
+            self.flush()
+            self.display.sync()
+        else:
+            return None
+        self.queue('remap', keycode, keysym)
+        self.remapped[keysym] = keycode
+        return keycode
+
+    def stop(self):
+        """Give the remapped spare keycodes their empty mapping back"""
+        try:
+            for keycode in self.remapped.values():
+                self.display.change_keyboard_mapping(keycode, [(X.NoSymbol, X.NoSymbol)])
+            self.remapped.clear()
+            self.display.flush()
+        except Exception as e:
+            input_log.error("Keymap restore error: %s", e)
\ No newline at end of file
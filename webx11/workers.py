@@ -0,0 +1,85 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from webx11.settings import get_settings
+from webx11.log import get_logger
+
+logger = get_logger('capture')
+
+# Captures living in a worker process, by display name
+_worker_captures = {}
+
+
+def capture_in_worker(display_name, fbdir, x, y, width, height, force, profiles):
+    """Capture and encode a frame from inside a worker process"""
+    from webx11.window import WindowScreenCapture
+    capture = _worker_captures.get(display_name)
+    if capture is None:
+        capture = _worker_captures[display_name] = WindowScreenCapture(display_name, fbdir)
+    frames = capture.capture_window(x, y, height, width, force=force, profiles=profiles)
+    return frames, capture.last_stats
+
+
+def release_in_worker(display_name):
+    capture = _worker_captures.pop(display_name, None)
+    if capture is not None:
+        capture.close()
+
+
+class CapturePool:
+    """Run the capture and encoding of every display off the asyncio event loop
+
+    thread: a shared thread pool, Xlib requests and Pillow encoders release the GIL
+    process: one single process executor per worker, each display being pinned to one of them
+             so that its capture state (damage, last frame, tiles) stays in the same process"""
+    def __init__(self, executor='thread', workers=None):
+        self.mode = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        self.executors = []
+        if self.mode == 'process':
+            # Forking a process running an event loop and threads is unsafe
+            context = multiprocessing.get_context('spawn')
+            self.executors = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(self.workers)]
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='webx11-capture')
+
+    def executor_for(self, window_display):
+        return self.executors[window_display.display_num % len(self.executors)]
+
+    async def capture(self, window_display, force=False, profiles=None):
+        loop = asyncio.get_running_loop()
+        if self.mode == 'process':
+            capture, stats = await loop.run_in_executor(
+                self.executor_for(window_display), capture_in_worker,
+                window_display.display_name, window_display.fbdir,
+                window_display.x, window_display.y, window_display.width, window_display.height, force, profiles)
+            return window_display.process_frame(capture, stats=stats)
+        return await loop.run_in_executor(self.executor, window_display.capture_window, False, force, profiles)
+
+    def release(self, window_display):
+        """Close the capture of a stopped display, it lives in its worker process"""
+        if self.mode == 'process':
+            try:
+                self.executor_for(window_display).submit(release_in_worker, window_display.display_name).result(timeout=5)
+            except Exception as e:
+                logger.error("Error releasing capture for %s: %s", window_display.display_name, e)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        for executor in self.executors:
+            executor.shutdown(wait=False)
+
+
+_capture_pool = None
+
+
+def capture_pool():
+    """The process-wide capture pool, created on first use"""
+    global _capture_pool
+    if _capture_pool is None:
+        settings = get_settings()
+        _capture_pool = CapturePool(settings.capture_executor, settings.capture_workers)
+    return _capture_pool